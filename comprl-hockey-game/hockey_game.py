@@ -143,16 +143,21 @@ class HockeyGame(IGame):
         )
         # check if the action is in the action space and thus valid
 
-    def _get_observation(self, id: PlayerID) -> list[float]:
+    def _default_action(self, id: PlayerID) -> np.ndarray:
+        """action used if the player is too late (see step_deadline_ms): do nothing"""
+        return np.zeros(4)
+
+    def _get_observation(self, id: PlayerID) -> np.ndarray:
         """return the correct obs respecting if sides are swapped
 
         Args: id: PlayerID of the player to get the observation for
 
-        Returns: list[float]: observation of the player with the given id"""
+        Returns: np.ndarray: observation of the player with the given id (sent as
+        packed array, or converted to a list for old clients)"""
         if id == self.player_1_id:
-            return self.obs_player_one.tolist()  # obs is an np array, we need list
+            return self.obs_player_one
         else:
-            return self.env.obs_agent_two().tolist()  # obs is an np array, we need list
+            return self.env.obs_agent_two()
 
     def _player_won(self, id: PlayerID) -> bool:
         """check if a player has won the game
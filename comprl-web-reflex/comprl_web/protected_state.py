@@ -1,13 +1,16 @@
 """State for the protected pages."""
 
 import dataclasses
+import datetime
 from typing import Sequence
 
 import reflex as rx
 import sqlalchemy as sa
 
-from comprl.server.data.sql_backend import Game, User
+from comprl.server.data import UserData
+from comprl.server.data.sql_backend import Game, User, UserStats
 from comprl.server.data.interfaces import GameEndState
+from comprl.server.replays import REPLAY_SUFFIX
 
 from . import config, reflex_local_auth
 from .reflex_local_auth.local_auth import get_session
@@ -51,46 +54,24 @@ class UserDashboardState(ProtectedState):
     def _load_game_statistics(self):
         stats = GameStatistics()
 
+        # the statistics are maintained by the server, so no need to count the games
         with get_session() as session:
-            stats.num_games_played = (
-                session.query(Game)
-                .filter(
-                    sa.or_(
-                        Game.user1 == self.authenticated_user.user_id,
-                        Game.user2 == self.authenticated_user.user_id,
-                    )
-                )
-                .with_entities(sa.func.count())
-                .scalar()
-            )
-
-            stats.num_games_won = (
-                session.query(Game)
-                .filter(Game.winner == self.authenticated_user.user_id)
-                .with_entities(sa.func.count())
-                .scalar()
-            )
-
-            stats.num_disconnects = (
-                session.query(Game)
-                .filter(Game.disconnected == self.authenticated_user.user_id)
-                .with_entities(sa.func.count())
-                .scalar()
-            )
+            user_stats = session.get(UserStats, self.authenticated_user.user_id)
+            if user_stats is not None:
+                stats.num_games_played = user_stats.played
+                stats.num_games_won = user_stats.won
+                stats.num_disconnects = user_stats.disconnected
         return stats
 
-    def _get_ranked_users(self) -> Sequence[User]:
-        with get_session() as session:
-            stmt = sa.select(User).order_by((User.mu - User.sigma).desc())
-            ranked_users = session.scalars(stmt).all()
-
-        return ranked_users
+    def _get_ranked_users(self) -> list[tuple[int, User]]:
+        # the ranking is maintained by the server
+        return UserData().get_leaderboard()
 
     @rx.var(cache=True)
     def ranked_users(self) -> Sequence[tuple[int, str, str]]:
         return [
-            (i + 1, user.username, f"{user.mu:.2f} / {user.sigma:.2f}")
-            for i, user in enumerate(self._get_ranked_users())
+            (rank, user.username, f"{user.mu:.2f} / {user.sigma:.2f}")
+            for rank, user in self._get_ranked_users()
         ]
 
     @rx.var(cache=True)
@@ -98,10 +79,8 @@ class UserDashboardState(ProtectedState):
         if not self.is_authenticated:
             return -1
 
-        for i, user in enumerate(self._get_ranked_users()):
-            if user.user_id == self.authenticated_user.user_id:
-                return i + 1
-        return -1
+        rank = UserData().get_rank(self.authenticated_user.user_id)
+        return rank if rank is not None else -1
 
 
 class UserGamesState(ProtectedState):
@@ -114,6 +93,11 @@ class UserGamesState(ProtectedState):
     total_items: int
     offset: int = 0
     limit: int = 10
+    # (start_time, id) of the first and last game on the current page.  Pages are
+    # loaded relative to these keys (keyset pagination), so that deep pages are as
+    # fast as the first one.
+    _first_key: tuple[datetime.datetime, int] | None = None
+    _last_key: tuple[datetime.datetime, int] | None = None
 
     def do_logout(self):
         self.user_games = []
@@ -121,23 +105,48 @@ class UserGamesState(ProtectedState):
         return reflex_local_auth.LocalAuthState.do_logout
 
     def _get_num_user_games(self) -> int:
-        with get_session() as session:
-            return (
-                session.query(Game)
-                .filter(
-                    sa.or_(
-                        Game.user1 == self.authenticated_user.user_id,
-                        Game.user2 == self.authenticated_user.user_id,
-                    )
-                )
-                .with_entities(sa.func.count())
-                .scalar()
-            )
+        if self.search_id:
+            return len(self.user_games)
 
-    def _get_user_games(self) -> Sequence[Game]:
+        # the statistics are maintained by the server, so no need to count the games
+        with get_session() as session:
+            user_stats = session.get(UserStats, self.authenticated_user.user_id)
+            return user_stats.played if user_stats is not None else 0
+
+    def _get_user_games(
+        self,
+        before: tuple[datetime.datetime, int] | None = None,
+        after: tuple[datetime.datetime, int] | None = None,
+    ) -> Sequence[Game]:
+        """Get a page of games of the user (most recent first).
+
+        Args:
+            before: Only games before this (start_time, id) key (next page).
+            after: Only games after this (start_time, id) key (previous page).
+        """
         if not self.is_authenticated:
             return []
 
+        user_id = self.authenticated_user.user_id
+        key = sa.tuple_(Game.start_time, Game.id)
+        # newest first, unless going backwards
+        order = (
+            (Game.start_time, Game.id)
+            if after is not None
+            else (Game.start_time.desc(), Game.id.desc())
+        )
+
+        def games_as(player_column):
+            # uses the index on (player_column, start_time)
+            stmt = sa.select(Game.id).where(player_column == user_id)
+            if before is not None:
+                stmt = stmt.where(key < sa.tuple_(*before))
+            if after is not None:
+                stmt = stmt.where(key > sa.tuple_(*after))
+            if self.search_id:
+                stmt = stmt.where(Game.game_id == self.search_id)
+            return sa.select(stmt.order_by(*order).limit(self.limit).subquery().c.id)
+
         with get_session() as session:
             stmt = (
                 sa.select(Game)
@@ -147,20 +156,19 @@ class UserGamesState(ProtectedState):
                     sa.orm.joinedload(Game.winner_),
                     sa.orm.joinedload(Game.disconnected_),
                 )
-                .filter(
-                    sa.or_(
-                        Game.user1 == self.authenticated_user.user_id,
-                        Game.user2 == self.authenticated_user.user_id,
+                .where(
+                    Game.id.in_(
+                        sa.union_all(games_as(Game.user1), games_as(Game.user2))
                     )
                 )
-                .order_by(Game.start_time.desc())
-                .offset(self.offset)
+                .order_by(*order)
                 .limit(self.limit)
             )
-            if self.search_id:
-                stmt = stmt.filter(Game.game_id == self.search_id)
+            games = list(session.scalars(stmt).all())
 
-            return session.scalars(stmt).all()
+        if after is not None:
+            games.reverse()
+        return games
 
     @rx.var(cache=True)
     def page_number(self) -> int:
@@ -174,36 +182,49 @@ class UserGamesState(ProtectedState):
 
     @rx.event
     def first_page(self):
-        self.offset = 0
         self.load_user_games()
 
     @rx.event
     def prev_page(self):
-        self.offset = max(self.offset - self.limit, 0)
-        self.load_user_games()
+        if self.offset - self.limit <= 0:
+            self.load_user_games()
+        else:
+            self.offset -= self.limit
+            self._load_page(after=self._first_key)
 
     @rx.event
     def next_page(self):
-        if self.offset + self.limit < self.total_items:
+        if self.offset + self.limit < self.total_items and self._last_key:
             self.offset += self.limit
-        self.load_user_games()
+            self._load_page(before=self._last_key)
 
     @rx.event
     def search_game(self, form_data):
-        self.offset = 0
         self.search_id = form_data["search_id"]
         self.load_user_games()
 
     @rx.event
     def clear_search(self):
-        self.offset = 0
         self.search_id = ""
         self.load_user_games()
 
     @rx.event
     def load_user_games(self) -> None:
+        self.offset = 0
+        self._load_page()
+
+    def _load_page(
+        self,
+        before: tuple[datetime.datetime, int] | None = None,
+        after: tuple[datetime.datetime, int] | None = None,
+    ) -> None:
+        games = self._get_user_games(before, after)
+        if games:
+            self._first_key = (games[0].start_time, games[0].id)
+            self._last_key = (games[-1].start_time, games[-1].id)
+
         self.user_games = []
-        for game in self._get_user_games():
+        for game in games:
             if game.end_state == GameEndState.WIN:
                 result = f"{game.winner_.username} won ({game.score1} : {game.score2})"
             elif game.end_state == GameEndState.DRAW:
@@ -227,8 +248,13 @@ class UserGamesState(ProtectedState):
 
     @rx.event
     def download_game(self, game_id: str):
-        game_file_name = f"{game_id}.pkl"
-        game_file_path = config.get_config().data_dir / "game_actions" / game_file_name
+        game_actions_dir = config.get_config().data_dir / "game_actions"
+        # games played with older versions of the server are stored as pickle files
+        for suffix in (REPLAY_SUFFIX, ".pkl"):
+            game_file_name = f"{game_id}{suffix}"
+            game_file_path = game_actions_dir / game_file_name
+            if game_file_path.exists():
+                break
 
         try:
             data = game_file_path.read_bytes()
@@ -12,7 +12,7 @@ import datetime
 import sqlalchemy as sa
 import reflex as rx
 
-from comprl.server.data.sql_backend import User
+from comprl.server.data.sql_backend import User, get_engine
 
 from .. import config
 from .auth_session import LocalAuthSession
@@ -24,8 +24,7 @@ DEFAULT_AUTH_REFRESH_DELTA = datetime.timedelta(minutes=10)
 
 # TODO move to other module?
 def get_session() -> sa.orm.Session:
-    db_url = f"sqlite:///{config.get_config().database_path}"
-    engine = sa.create_engine(db_url)
+    engine = get_engine(config.get_config().database_path)
     return sa.orm.Session(engine)
 
 
@@ -10,7 +10,7 @@ import reflex as rx
 from sqlalchemy import select
 
 from comprl.server.util import IDGenerator
-from comprl.server.data.sql_backend import User, hash_password
+from comprl.server.data.sql_backend import User, hash_password, refresh_leaderboard
 
 from ..config import get_config
 from . import routes
@@ -89,6 +89,9 @@ class RegistrationState(LocalAuthState):
             )
 
             session.add(new_user)
+            session.flush()
+            # rank the new user right away
+            refresh_leaderboard(session)
             session.commit()
             session.refresh(new_user)
             self.new_user_id = new_user.user_id
@@ -43,7 +43,16 @@ export async function addUser(username: string, password: string, role: string =
     const userDB = new Database(user_db_path, { verbose: console.log });
     const token = uuidv4();
     const stmt = userDB.prepare(`INSERT INTO ${user_db_name}(username, password, role, token) VALUES (?, ?, ?, ?)`);
-    stmt.run(username, password, role, token);
+    // rank the new user right away (same as refresh_leaderboard() of the server)
+    const ranking = `SELECT row_number() OVER (ORDER BY mu - sigma DESC, user_id), user_id FROM ${user_db_name}`;
+    const deleteRanks = userDB.prepare(`DELETE FROM leaderboard WHERE (rank, user_id) NOT IN (${ranking})`);
+    const insertRanks = userDB.prepare(
+        `INSERT INTO leaderboard(rank, user_id) ${ranking} EXCEPT SELECT rank, user_id FROM leaderboard`);
+    userDB.transaction(() => {
+        stmt.run(username, password, role, token);
+        deleteRanks.run();
+        insertRanks.run();
+    })();
     userDB.close();
 }
 
@@ -75,18 +84,30 @@ export async function getAllUsers() {
 }
 
 
-export async function getRankedUsers() {
-    const users = await getAllUsers();
-
-    const rankedUsers = users.sort((a, b) => {
-        // Sort by descending (mu - sigma)
-        return (b.mu - b.sigma) - (a.mu - a.sigma);
-    });
+export async function getRankedUsers(limit: number = -1, offset: number = 0) {
+    // the ranking (by mu - sigma) is maintained by the server in the table leaderboard
+    const db = new Database(user_db_path, { verbose: console.log });
+    const stmt = db.prepare(`
+        SELECT l.rank, u.user_id, u.username, u.mu, u.sigma
+        FROM leaderboard l JOIN ${user_db_name} u ON u.user_id = l.user_id
+        WHERE l.rank > ? ORDER BY l.rank LIMIT ?`);
+    const rankedUsers = stmt.all(offset, limit);
+    db.close();
 
     return rankedUsers;
 }
 
 
+export async function getRank(user_id: number) {
+    const db = new Database(user_db_path, { verbose: console.log });
+    const stmt = db.prepare(`SELECT rank FROM leaderboard WHERE user_id = ?`);
+    const res = stmt.get(user_id);
+    db.close();
+
+    return res ? res.rank : 0;
+}
+
+
 
 export async function searchUsers(names: string[]) {
     var users = new Set();
@@ -115,18 +136,18 @@ export async function searchUsers(names: string[]) {
 export async function getStatistics(user_id: number) {
     const gameDB = new Database(game_db_path, { verbose: console.log });
 
-    const stmt_played = gameDB.prepare(`SELECT COUNT(*) FROM ${game_db_name} WHERE user1 = ? OR user2 = ?`);
-    const playedGames = stmt_played.get(user_id, user_id)['COUNT(*)'];
-
-    const stmt_won = gameDB.prepare(`SELECT COUNT(winner) FROM ${game_db_name} WHERE winner = ?`);
-    const wonGames = stmt_won.get(user_id)['COUNT(winner)'];
-
-    const stmt_disconnect = gameDB.prepare(`SELECT COUNT(disconnected) FROM ${game_db_name} WHERE disconnected = ?`);
-    const disconnectedGames = stmt_disconnect.get(user_id)['COUNT(disconnected)'];
+    // the statistics are maintained by the server (table user_stats), so the games
+    // don't need to be counted
+    const stmt = gameDB.prepare(`SELECT played, won, disconnected FROM user_stats WHERE user_id = ?`);
+    const stats = stmt.get(user_id);
 
     gameDB.close();
 
-    return { playedGames: playedGames, wonGames: wonGames, disconnectedGames: disconnectedGames } as Statistics
+    return {
+        playedGames: stats?.played ?? 0,
+        wonGames: stats?.won ?? 0,
+        disconnectedGames: stats?.disconnected ?? 0
+    } as Statistics
 }
 
 
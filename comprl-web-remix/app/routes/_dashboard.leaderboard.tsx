@@ -104,7 +104,7 @@ export default function Leaderboard() {
   const [rowsPerPage, setRowsPerPage] = React.useState(10);
   const usersData = useLoaderData<typeof loader>();
   const { users, loggedInUsername } = usersData;
-  const rows = users.map((user, index) => createData(index + 1, user.username));
+  const rows = users.map((user) => createData(user.rank, user.username));
   // Avoid a layout jump when reaching the last page with empty rows.
   const emptyRows =
     page > 0 ? Math.max(0, (1 + page) * rowsPerPage - rows.length) : 0;
@@ -4,7 +4,7 @@ import { LoaderFunctionArgs, redirect } from "@remix-run/node";
 import { authenticator } from "~/services/auth.server";
 import { commitSession, getSession } from "~/services/session.server";
 import { useLoaderData } from "@remix-run/react";
-import { getStatistics, getRankedUsers } from "~/db/sqlite.data";
+import { getStatistics, getRank } from "~/db/sqlite.data";
 import { DashboardsStatistic, DashboardPaper } from '~/components/DashboardContent';
 import React from "react";
 
@@ -29,16 +29,7 @@ export async function loader({ request, params }: LoaderFunctionArgs) {
   }
 
   const games = await getStatistics(user.id)
-  const ranked_users = await getRankedUsers();
-
-  var rank = 0;
-  var i = 1;
-  for (var r_user of ranked_users) {
-    if (r_user.username == user.name) {
-      rank = i;
-    }
-    i += 1;
-  }
+  const rank = await getRank(user.id);
 
   if (!user.token) {
     return { token: "no token exists", username: user.name, games: games, rank: rank };
@@ -0,0 +1,4 @@
+"""Benchmarks for the comprl server.
+
+Run them as modules, e.g. ``python -m comprl.benchmarks.matchmaking --help``.
+"""
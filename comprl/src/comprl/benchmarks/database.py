@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""Measure the time of frequent database queries with and without indexes.
+
+A database with random users and games is generated.  The queries used by the server
+(authentication by token) and the web frontends (game counts and recent games of a
+user) are timed first on the database without indexes (like it was created by older
+versions), then again after upgrading it with ``upgrade_database``.
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import datetime
+import pathlib
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from typing import Callable
+
+import numpy as np
+import sqlalchemy as sa
+import tabulate
+
+from comprl.server.data import sql_backend
+from comprl.server.data.sql_backend import Game, User
+
+#: Number of rows inserted per statement when generating the database
+_CHUNK_SIZE = 50_000
+
+
+def populate(engine: sa.Engine, num_users: int, num_games: int, seed: int) -> None:
+    """Fill the database with random users and games.
+
+    Args:
+        engine: Engine of the (empty) database.
+        num_users: Number of users.
+        num_games: Number of games.
+        seed: Seed of the random number generator.
+    """
+    rng = np.random.default_rng(seed)
+    with engine.begin() as conn:
+        conn.execute(
+            sa.insert(User),
+            [
+                {
+                    "username": f"user{i}",
+                    "password": b"",
+                    "token": uuid.UUID(int=int(rng.integers(2**63))).hex,
+                    "role": "user",
+                    "mu": 25.0,
+                    "sigma": 8.333,
+                }
+                for i in range(num_users)
+            ],
+        )
+
+    t0 = datetime.datetime(2024, 1, 1)
+    for start in range(0, num_games, _CHUNK_SIZE):
+        n = min(_CHUNK_SIZE, num_games - start)
+        user1 = rng.integers(1, num_users + 1, n)
+        user2 = (user1 + rng.integers(1, num_users, n) - 1) % num_users + 1
+        outcome = rng.integers(0, 3, n)
+        disconnected = rng.random(n) < 0.05
+        rows = [
+            {
+                "game_id": str(uuid.uuid4()),
+                "user1": int(u1),
+                "user2": int(u2),
+                "score1": float(o == 1),
+                "score2": float(o == 2),
+                "start_time": t0 + datetime.timedelta(seconds=start + i),
+                "end_state": 1 if d else 0,
+                "winner": int(u1) if o == 1 else int(u2) if o == 2 else None,
+                "disconnected": int(u2) if d else None,
+            }
+            for i, (u1, u2, o, d) in enumerate(
+                zip(user1, user2, outcome, disconnected, strict=True)
+            )
+        ]
+        with engine.begin() as conn:
+            conn.execute(sa.insert(Game), rows)
+
+
+def drop_indexes(engine: sa.Engine) -> None:
+    """Drop all (non-unique) indexes, i.e. restore the schema of older versions."""
+    with engine.begin() as conn:
+        for table in sql_backend.Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.drop(conn, checkfirst=True)
+
+
+def queries(user_id: int, token: str) -> dict[str, Callable[[sa.Connection], None]]:
+    """Queries to benchmark (as executed by the server and the web frontends)."""
+    user_games = sa.or_(Game.user1 == user_id, Game.user2 == user_id)
+
+    def auth(conn: sa.Connection) -> None:
+        conn.execute(sa.select(User).where(User.token == token)).first()
+
+    def count_games(conn: sa.Connection) -> None:
+        conn.execute(sa.select(sa.func.count()).where(user_games)).scalar()
+
+    def count_won(conn: sa.Connection) -> None:
+        conn.execute(sa.select(sa.func.count()).where(Game.winner == user_id)).scalar()
+
+    def count_disconnected(conn: sa.Connection) -> None:
+        conn.execute(
+            sa.select(sa.func.count()).where(Game.disconnected == user_id)
+        ).scalar()
+
+    def recent_games(conn: sa.Connection) -> None:
+        conn.execute(
+            sa.select(Game).where(user_games).order_by(Game.start_time.desc()).limit(20)
+        ).all()
+
+    def latest_games(conn: sa.Connection) -> None:
+        conn.execute(sa.select(Game).order_by(Game.start_time.desc()).limit(20)).all()
+
+    return {
+        "user by token": auth,
+        "count games of user": count_games,
+        "count games won": count_won,
+        "count disconnects": count_disconnected,
+        "recent games of user": recent_games,
+        "latest games": latest_games,
+    }
+
+
+def time_queries(
+    engine: sa.Engine, user_ids: list[int], tokens: list[str]
+) -> dict[str, float]:
+    """Run all queries once for each given user.
+
+    Returns:
+        Median duration of each query in milliseconds.
+    """
+    durations: dict[str, list[float]] = {}
+    with engine.connect() as conn:
+        for user_id, token in zip(user_ids, tokens, strict=True):
+            for name, query in queries(user_id, token).items():
+                start = time.perf_counter()
+                query(conn)
+                durations.setdefault(name, []).append(time.perf_counter() - start)
+
+    return {name: statistics.median(d) * 1000 for name, d in durations.items()}
+
+
+def main() -> int:
+    """Entry point."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--games", type=int, default=1_000_000, help="Number of games.")
+    parser.add_argument("--users", type=int, default=1000, help="Number of users.")
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=20,
+        help="Number of (randomly selected) users for which the queries are run.",
+    )
+    parser.add_argument(
+        "--database",
+        type=pathlib.Path,
+        help="""Database file to use (its indexes are dropped and recreated!).  If it
+            does not exist, it is generated and kept for further runs.  By default a
+            temporary database is generated.
+        """,
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Random seed.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = args.database or pathlib.Path(tmp_dir) / "benchmark.db"
+        engine = sql_backend.get_engine(db_path)
+
+        if not db_path.exists():
+            print(f"Generate database with {args.games} games...", file=sys.stderr)
+            sql_backend.create_database_tables(db_path)
+            populate(engine, args.users, args.games, args.seed)
+
+        drop_indexes(engine)
+
+        with engine.connect() as conn:
+            users = conn.execute(sa.select(User.user_id, User.token)).all()
+        rng = np.random.default_rng(args.seed)
+        selected = [users[i] for i in rng.choice(len(users), args.repeat)]
+        user_ids = [u.user_id for u in selected]
+        tokens = [u.token for u in selected]
+
+        without_indexes = time_queries(engine, user_ids, tokens)
+
+        start = time.perf_counter()
+        sql_backend.upgrade_database(db_path)
+        upgrade_time = time.perf_counter() - start
+
+        with_indexes = time_queries(engine, user_ids, tokens)
+
+        sql_backend.dispose_engines()
+
+    print(
+        tabulate.tabulate(
+            [
+                (name, t, with_indexes[name], t / with_indexes[name])
+                for name, t in without_indexes.items()
+            ],
+            headers=["Query", "No indexes [ms]", "Indexes [ms]", "Speed-up"],
+            floatfmt=".3f",
+        )
+    )
+    print(f"\nCreating the indexes took {upgrade_time:.1f} s.")
+
+    return 0
+
+
+if __name__ == "__main__":
+    with contextlib.suppress(KeyboardInterrupt):
+        sys.exit(main())
@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+"""Measure the throughput of the server with many concurrent clients.
+
+A server is started in a subprocess on a temporary database with one user per client.
+Then the given number of lightweight clients connect from this process (all in one
+reactor) and play with random actions.  After a warm-up phase, the following is
+measured:
+
+- Steps per second (answered by all clients together).
+- Step round-trip latency: time from a client sending its action until it receives the
+  next observation (i.e. server processing, waiting for the opponent and network).
+- Games per minute.
+- CPU time of the server process (in % of one core).
+
+Note that the clients share a single process, so make sure that it is not the
+bottleneck (the CPU usage of the load generator is reported as well).
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import dataclasses
+import json
+import os
+import pathlib
+import random
+import resource
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable
+
+import numpy as np
+import sqlalchemy as sa
+import tabulate
+from twisted.internet import reactor
+from twisted.internet.endpoints import TCP4ClientEndpoint, connectProtocol
+
+from comprl.client.interfaces import IAgent
+from comprl.client.networking import ClientProtocol
+from comprl.server.data import sql_backend
+
+_PROJECT_DIR = pathlib.Path(__file__).resolve().parents[3]
+
+
+@dataclasses.dataclass(frozen=True)
+class GameSpec:
+    """A game that can be used for the benchmark."""
+
+    #: Path to the file containing the game class
+    path: pathlib.Path
+    #: Name of the game class
+    class_name: str
+    #: Function returning a random (valid) action
+    random_action: Callable[[], list[float]]
+
+
+GAMES = {
+    "simple": GameSpec(
+        _PROJECT_DIR / "examples" / "simple" / "game.py",
+        "ExampleGame",
+        lambda: [1.0],
+    ),
+    "rockpaperscissors": GameSpec(
+        _PROJECT_DIR / "examples" / "rockpaperscissors" / "game.py",
+        "RPSGame",
+        lambda: [float(random.randint(0, 2))],
+    ),
+    "hockey": GameSpec(
+        _PROJECT_DIR.parent / "comprl-hockey-game" / "hockey_game.py",
+        "HockeyGame",
+        lambda: [random.uniform(-1, 1) for _ in range(4)],
+    ),
+}
+
+
+class LoadStats:
+    """Measurements collected by all clients."""
+
+    def __init__(self) -> None:
+        #: Only record while this is set (i.e. not during warm-up)
+        self.measuring = False
+        self.steps = 0
+        self.games = 0
+        self.disconnects = 0
+        self.errors = 0
+        self.latencies: list[float] = []
+
+
+class LoadAgent(IAgent):
+    """Agent playing random actions and recording the step latencies."""
+
+    def __init__(
+        self, token: str, random_action: Callable[[], list[float]], stats: LoadStats
+    ) -> None:
+        self.token = token
+        self.random_action = random_action
+        self.stats = stats
+        # time when the last action was sent in the current game
+        self._last_step: float | None = None
+
+    def on_start_game(self, game_id: int) -> None:
+        """Reset the latency measurement."""
+        self._last_step = None
+
+    def get_step(self, obv: list[float] | np.ndarray) -> list[float]:
+        """Record the latency since the last step and return a random action."""
+        now = time.perf_counter()
+        if self.stats.measuring:
+            self.stats.steps += 1
+            if self._last_step is not None:
+                self.stats.latencies.append(now - self._last_step)
+        self._last_step = now
+        return self.random_action()
+
+    def on_end_game(self, result: bool, stats: list[float]) -> None:
+        """Count the game."""
+        self._last_step = None
+        if self.stats.measuring:
+            self.stats.games += 1
+
+    def on_error(self, msg: str) -> None:
+        """Count the error."""
+        if self.stats.measuring:
+            self.stats.errors += 1
+
+    def on_disconnect(self) -> None:
+        """Count the disconnect."""
+        self.stats.disconnects += 1
+
+
+class LoadClientProtocol(ClientProtocol):
+    """Client protocol that does not stop the (shared) reactor on disconnect."""
+
+    def connectionLost(self, reason):
+        """Called when the connection to the server is lost."""
+        self.agent.on_disconnect()
+        # skip ClientProtocol.connectionLost, which stops the reactor
+        return super(ClientProtocol, self).connectionLost(reason)
+
+
+def create_database(db_path: pathlib.Path, num_users: int) -> list[str]:
+    """Create a database with the given number of users.
+
+    Returns:
+        The tokens of the users.
+    """
+    tokens = [f"load-{i}" for i in range(num_users)]
+    sql_backend.create_database_tables(db_path)
+    with sql_backend.get_engine(db_path).begin() as conn:
+        conn.execute(
+            sa.insert(sql_backend.User),
+            # clients only use the token, so skip the (slow) password hashing
+            [{"username": t, "password": b"", "token": t} for t in tokens],
+        )
+    sql_backend.dispose_engines()
+    return tokens
+
+
+def write_config(
+    path: pathlib.Path, port: int, game: GameSpec, options: list[str]
+) -> None:
+    """Write the server config."""
+    lines = [
+        "[CompetitionServer]",
+        f"port = {port}",
+        f'game_path = "{game.path}"',
+        f'game_class = "{game.class_name}"',
+        'database_path = "database.db"',
+        'data_dir = "data"',
+        'log_level = "WARNING"',
+        # match everyone, the benchmark is about throughput, not match quality
+        "match_quality_threshold = 0.0",
+        "percentage_min_players_waiting = 0.0",
+    ]
+    for option in options:
+        key, value = option.split("=", 1)
+        lines = [line for line in lines if not line.startswith(f"{key} =")]
+        lines.append(f"{key} = {value}")
+    path.write_text("\n".join(lines) + "\n")
+
+
+def wait_for_port(port: int, timeout: float) -> None:
+    """Wait until the server accepts connections."""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with socket.create_connection(("localhost", port), timeout=1):
+                return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Server did not start within {timeout}s") from None
+            time.sleep(0.1)
+
+
+def process_cpu_time(pid: int) -> float:
+    """CPU time (user + system) of a process in seconds (NaN if not available)."""
+    try:
+        stat = pathlib.Path(f"/proc/{pid}/stat").read_text()
+    except OSError:
+        return float("nan")
+    # the process name may contain spaces, so split after it
+    fields = stat.rsplit(")", 1)[1].split()
+    utime, stime = int(fields[11]), int(fields[12])
+    return (utime + stime) / os.sysconf("SC_CLK_TCK")
+
+
+def run_clients(
+    port: int,
+    tokens: list[str],
+    game: GameSpec,
+    connect_rate: float,
+    warmup: float,
+    duration: float,
+    server_pid: int,
+) -> dict[str, float]:
+    """Connect the clients and measure.
+
+    Returns:
+        The results of the measurement.
+    """
+    stats = LoadStats()
+    results: dict[str, float] = {}
+    batch_size = max(1, int(connect_rate / 10))
+
+    def connect(start: int) -> None:
+        for token in tokens[start : start + batch_size]:
+            agent = LoadAgent(token, game.random_action, stats)
+            connectProtocol(
+                TCP4ClientEndpoint(reactor, "localhost", port, timeout=30),
+                LoadClientProtocol(agent),
+            ).addErrback(lambda _, agent=agent: agent.on_disconnect())
+        if start + batch_size < len(tokens):
+            reactor.callLater(  # type: ignore[attr-defined]
+                0.1, connect, start + batch_size
+            )
+        else:
+            print(
+                f"All {len(tokens)} clients connected, warm up for {warmup}s...",
+                file=sys.stderr,
+            )
+            reactor.callLater(warmup, start_measurement)  # type: ignore[attr-defined]
+
+    def start_measurement() -> None:
+        stats.measuring = True
+        results["server_cpu"] = process_cpu_time(server_pid)
+        results["client_cpu"] = time.process_time()
+        results["start"] = time.perf_counter()
+        reactor.callLater(duration, stop_measurement)  # type: ignore[attr-defined]
+
+    def stop_measurement() -> None:
+        stats.measuring = False
+        elapsed = time.perf_counter() - results.pop("start")
+        server_cpu = process_cpu_time(server_pid) - results.pop("server_cpu")
+        client_cpu = time.process_time() - results.pop("client_cpu")
+        latencies = np.array(stats.latencies) * 1000
+
+        results.update(
+            clients=len(tokens),
+            duration_s=elapsed,
+            steps_per_s=stats.steps / elapsed,
+            latency_p50_ms=(
+                float(np.percentile(latencies, 50)) if stats.latencies else 0
+            ),
+            latency_p99_ms=(
+                float(np.percentile(latencies, 99)) if stats.latencies else 0
+            ),
+            # each game is counted by both players
+            games_per_min=stats.games / 2 / elapsed * 60,
+            server_cpu_percent=server_cpu / elapsed * 100,
+            load_generator_cpu_percent=client_cpu / elapsed * 100,
+            disconnects=stats.disconnects,
+            errors=stats.errors,
+        )
+        reactor.stop()  # type: ignore[attr-defined]
+
+    reactor.callWhenRunning(connect, 0)  # type: ignore[attr-defined]
+    reactor.run()  # type: ignore[attr-defined]
+
+    return results
+
+
+def main() -> int:
+    """Entry point."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--game", choices=GAMES, default="simple", help="Game to play.")
+    parser.add_argument(
+        "--clients", type=int, default=1000, help="Number of concurrent clients."
+    )
+    parser.add_argument(
+        "--duration", type=float, default=30.0, help="Measurement duration in seconds."
+    )
+    parser.add_argument(
+        "--warmup",
+        type=float,
+        default=5.0,
+        help="Seconds to wait after all clients connected before measuring.",
+    )
+    parser.add_argument(
+        "--connect-rate",
+        type=float,
+        default=500.0,
+        help="Number of clients connecting per second.",
+    )
+    parser.add_argument("--port", type=int, default=65400, help="Server port.")
+    parser.add_argument(
+        "--server-option",
+        type=str,
+        nargs="+",
+        default=[],
+        metavar="KEY=VALUE",
+        help="""Additional server config options (TOML values, e.g.
+            'server_update_interval=0.1').""",
+    )
+    parser.add_argument(
+        "--output", type=pathlib.Path, help="Write results to this JSON file."
+    )
+    args = parser.parse_args()
+
+    game = GAMES[args.game]
+
+    # each client needs a socket in this process and in the server
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < args.clients + 100:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        work_dir = pathlib.Path(tmp_dir)
+        (work_dir / "data").mkdir()
+        tokens = create_database(work_dir / "database.db", args.clients)
+        config_file = work_dir / "config.toml"
+        write_config(config_file, args.port, game, args.server_option)
+
+        server = subprocess.Popen(
+            [sys.executable, "-m", "comprl.server", "--config", str(config_file)],
+            cwd=work_dir,
+        )
+        try:
+            wait_for_port(args.port, timeout=30)
+            results = run_clients(
+                args.port,
+                tokens,
+                game,
+                connect_rate=args.connect_rate,
+                warmup=args.warmup,
+                duration=args.duration,
+                server_pid=server.pid,
+            )
+        finally:
+            server.send_signal(signal.SIGINT)
+            try:
+                server.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                server.kill()
+
+    print(
+        tabulate.tabulate(
+            results.items(), headers=["Metric", args.game], floatfmt=".2f"
+        )
+    )
+    if args.output:
+        args.output.write_text(json.dumps({"game": args.game, **results}, indent=2))
+
+    return 0
+
+
+if __name__ == "__main__":
+    with contextlib.suppress(KeyboardInterrupt):
+        sys.exit(main())
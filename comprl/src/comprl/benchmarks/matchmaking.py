@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""Compare matchmaking strategies in a simulated competition.
+
+A fixed set of players is simulated.  In every tick, the idle players in the queue are
+matched using the same functions as the server, matched players play a game of random
+duration and then queue again.  For each strategy, the average match quality, the time
+players wait in the queue and the CPU time needed per tick are reported.
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import dataclasses
+import sys
+import time
+
+import numpy as np
+import tabulate
+from openskill.models import PlackettLuce
+
+from comprl.server import matchmaking
+
+
+@dataclasses.dataclass
+class SimulationResult:
+    """Results of a simulation run."""
+
+    strategy: str
+    num_games: int
+    mean_quality: float
+    mean_wait: float
+    p99_wait: float
+    mean_queue_length: float
+    mean_tick_ms: float
+    p99_tick_ms: float
+
+
+def simulate(
+    strategy: matchmaking.MatchingStrategy,
+    num_players: int,
+    num_ticks: int,
+    threshold: float,
+    time_bonus: float,
+    min_waiting: float,
+    bot_fraction: float,
+    tick_interval: float,
+    game_duration: tuple[float, float],
+    seed: int,
+) -> SimulationResult:
+    """Simulate the matchmaking with the given strategy.
+
+    Args:
+        strategy: Matchmaking strategy.
+        num_players: Number of players.
+        num_ticks: Number of matchmaking ticks to simulate.
+        threshold: Match quality threshold.
+        time_bonus: Percental time bonus for waiting players.
+        min_waiting: Fraction of players that always stay in the queue.
+        bot_fraction: Fraction of players that are bots.
+        tick_interval: Simulated seconds between two ticks.
+        game_duration: Range of the (uniformly distributed) game duration in seconds.
+        seed: Seed of the random number generator.
+
+    Returns:
+        The results of the simulation.
+    """
+    # use the same players for all strategies
+    rng = np.random.default_rng(seed)
+    beta = PlackettLuce().beta
+    mu = rng.normal(25.0, 5.0, num_players)
+    sigma = rng.uniform(1.0, 8.333, num_players)
+    user_ids = np.arange(num_players)
+    is_bot = rng.random(num_players) < bot_fraction
+    # only used for evaluation, the ticks compute the draw probabilities themselves
+    draw_prob = matchmaking.draw_probability_matrix(mu, sigma, beta)
+
+    # time when the player joined the queue or NaN if the player is playing
+    in_queue_since = np.zeros(num_players)
+    busy_until = np.zeros(num_players)
+    min_queue_length = int(num_players * min_waiting)
+    # match qualities of the queued players, keyed by (player, time of joining)
+    pair_cache = matchmaking.PairQualityCache(beta)
+    pair_cache.set_parameters(threshold, time_bonus)
+
+    qualities: list[float] = []
+    waits: list[float] = []
+    queue_lengths: list[int] = []
+    tick_times: list[float] = []
+
+    for tick in range(num_ticks):
+        now = tick * tick_interval
+
+        # players whose game ended join the queue again
+        returning = np.isnan(in_queue_since) & (busy_until <= now)
+        in_queue_since[returning] = busy_until[returning]
+
+        # queue is ordered by time of joining
+        queue = np.flatnonzero(~np.isnan(in_queue_since))
+        queue = queue[np.argsort(in_queue_since[queue], kind="stable")]
+        queue_lengths.append(len(queue))
+        if len(queue) < max(min_queue_length, 2):
+            continue
+
+        start = time.process_time()
+        # same incremental update as in the server: drop matched players, rate the
+        # new ones
+        pair_cache.keep(
+            np.array([in_queue_since[p] == t for p, t in pair_cache.keys], dtype=bool)
+        )
+        new = queue[len(pair_cache) :]
+        pair_cache.add(
+            [(p, in_queue_since[p]) for p in new],
+            mu=mu[new],
+            sigma=sigma[new],
+            queued_at=in_queue_since[new],
+            user_ids=user_ids[new],
+            is_bot=is_bot[new],
+        )
+        waiting_time = now - in_queue_since[queue]
+        rows, cols = np.nonzero(np.triu(pair_cache.matchable(now), k=1))
+        quality = None
+        if strategy == matchmaking.MatchingStrategy.MAX_WEIGHT:
+            quality = pair_cache.pair_match_quality(rows, cols, now)
+        matches = matchmaking.select_matches_from_pairs(
+            strategy, rows, cols, quality, len(queue), min_queue_length
+        )
+        tick_times.append(time.process_time() - start)
+
+        for i, j in matches:
+            qualities.append(draw_prob[queue[i], queue[j]])
+            waits.extend((waiting_time[i], waiting_time[j]))
+            duration = rng.uniform(*game_duration)
+            for player in (queue[i], queue[j]):
+                in_queue_since[player] = np.nan
+                busy_until[player] = now + duration
+
+    return SimulationResult(
+        strategy=strategy.value,
+        num_games=len(qualities),
+        mean_quality=float(np.mean(qualities)) if qualities else float("nan"),
+        mean_wait=float(np.mean(waits)) if waits else float("nan"),
+        p99_wait=float(np.percentile(waits, 99)) if waits else float("nan"),
+        mean_queue_length=float(np.mean(queue_lengths)),
+        mean_tick_ms=float(np.mean(tick_times)) * 1000 if tick_times else 0.0,
+        p99_tick_ms=float(np.percentile(tick_times, 99)) * 1000 if tick_times else 0.0,
+    )
+
+
+def main() -> int:
+    """Entry point."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--players", type=int, default=300, help="Number of players.")
+    parser.add_argument("--ticks", type=int, default=600, help="Number of ticks.")
+    parser.add_argument(
+        "--threshold", type=float, default=0.8, help="Match quality threshold."
+    )
+    parser.add_argument(
+        "--time-bonus", type=float, default=0.1, help="Percental time bonus."
+    )
+    parser.add_argument(
+        "--min-waiting",
+        type=float,
+        default=0.1,
+        help="Fraction of players that always stay in the queue.",
+    )
+    parser.add_argument(
+        "--bots", type=float, default=0.2, help="Fraction of players that are bots."
+    )
+    parser.add_argument(
+        "--tick-interval",
+        type=float,
+        default=1.0,
+        help="Simulated seconds between two matchmaking ticks.",
+    )
+    parser.add_argument(
+        "--game-duration",
+        type=float,
+        nargs=2,
+        default=(20.0, 60.0),
+        metavar=("MIN", "MAX"),
+        help="Range of the game duration in seconds.",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Random seed.")
+    args = parser.parse_args()
+
+    results = [
+        simulate(
+            strategy,
+            num_players=args.players,
+            num_ticks=args.ticks,
+            threshold=args.threshold,
+            time_bonus=args.time_bonus,
+            min_waiting=args.min_waiting,
+            bot_fraction=args.bots,
+            tick_interval=args.tick_interval,
+            game_duration=tuple(args.game_duration),
+            seed=args.seed,
+        )
+        for strategy in matchmaking.MatchingStrategy
+    ]
+
+    print(
+        tabulate.tabulate(
+            [dataclasses.astuple(r) for r in results],
+            headers=[
+                "Strategy",
+                "Games",
+                "Mean quality",
+                "Mean wait [s]",
+                "P99 wait [s]",
+                "Mean queue",
+                "Mean tick [ms]",
+                "P99 tick [ms]",
+            ],
+            floatfmt=".3f",
+        )
+    )
+
+    return 0
+
+
+if __name__ == "__main__":
+    with contextlib.suppress(KeyboardInterrupt):
+        sys.exit(main())
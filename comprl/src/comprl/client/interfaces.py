@@ -2,6 +2,8 @@
 
 import abc
 
+import numpy as np
+
 
 class IAgent(abc.ABC):
     """agent interface which could be used by the end-user"""
@@ -43,15 +45,20 @@ class IAgent(abc.ABC):
         pass
 
     @abc.abstractmethod
-    def get_step(self, obv: list[float]) -> list[float]:
+    def get_step(self, obv: list[float] | np.ndarray) -> list[float]:
         """
         Requests the agent's action based on the current observation.
 
+        Note that the observation is passed as NumPy array (unless the server only
+        supports the old list-based encoding).  Indexing and iterating work the same
+        way as for a list.
+
         Args:
-            obv (list[float]): The current observation.
+            obv (list[float] | np.ndarray): The current observation.
 
         Returns:
-            list[float]: The agent's action.
+            list[float]: The agent's action.  A 1-dimensional NumPy array of floats is
+            accepted as well.
         """
         raise NotImplementedError("step function not implemented")
 
@@ -4,15 +4,25 @@ Contains all networking related classes and functions for the client.
 
 import logging as log
 
+import numpy as np
 from twisted.protocols import amp
 from twisted.internet import reactor
 from twisted.internet.endpoints import TCP4ClientEndpoint, connectProtocol
 
-from comprl.shared.commands import Ready, StartGame, EndGame, Step, Auth, Error, Message
+from comprl.shared.commands import (
+    Ready,
+    StartGame,
+    EndGame,
+    Step,
+    PackedStep,
+    Auth,
+    Error,
+    Message,
+)
 
 from .interfaces import IAgent
 
-VERSION = 1
+VERSION = 2
 
 
 class ClientProtocol(amp.AMP):
@@ -110,6 +120,8 @@ class ClientProtocol(amp.AMP):
                 Example: {"action": 1}
         """
         action = self.agent.get_step(obv)
+        if isinstance(action, np.ndarray):
+            action = action.tolist()
         if isinstance(action, list) and all(isinstance(x, float) for x in action):
             return {"action": action}
         else:
@@ -118,6 +130,31 @@ class ClientProtocol(amp.AMP):
                 "Only actions of type list[float] can be send."
             )
 
+    @PackedStep.responder
+    def packed_step(self, obv: np.ndarray):
+        """Called when the server wants the client to make a step.
+
+        Same as :meth:`step` but observation and action are sent in binary encoding.
+
+        Args:
+            obv (np.ndarray): The environment given by the server.
+
+        Returns:
+            dict: A dictionary containing the action that should be executed.
+        """
+        action = self.agent.get_step(obv)
+        if isinstance(action, list) and all(isinstance(x, float) for x in action):
+            return {"action": action}
+        elif isinstance(action, np.ndarray) and np.issubdtype(
+            action.dtype, np.floating
+        ):
+            return {"action": action}
+        else:
+            raise Exception(
+                "Tried to send an action with wrong type. "
+                "Only actions of type list[float] or float arrays can be send."
+            )
+
     @Error.responder
     def on_error(self, msg):
         """Called if an error occurred on the server side.
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""Convert game replays from the old pickle format (.pkl) to the .npz format.
+
+Warning: Unpickling can execute arbitrary code, so only convert trusted files.
+"""
+
+import argparse
+import contextlib
+import logging
+import pathlib
+import sys
+
+from comprl.server.replays import convert_pickle_replay
+
+
+def main() -> int:
+    """main."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "paths",
+        type=pathlib.Path,
+        nargs="+",
+        help="""Replay files or directories containing replay files (e.g.
+            '<data_dir>/game_actions').
+        """,
+    )
+    parser.add_argument(
+        "--delete", action="store_true", help="Delete .pkl files after conversion."
+    )
+    parser.add_argument(
+        "--verbose", "-v", action="store_true", help="Enable verbose output."
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.INFO,
+        format="[%(asctime)s] [%(name)s | %(levelname)s] %(message)s",
+    )
+
+    files: list[pathlib.Path] = []
+    for path in args.paths:
+        if path.is_dir():
+            files.extend(sorted(path.glob("*.pkl")))
+        else:
+            files.append(path)
+
+    num_failed = 0
+    for pkl_file in files:
+        try:
+            output_file = convert_pickle_replay(pkl_file)
+        except Exception as e:
+            logging.error("Failed to convert %s: %s", pkl_file, e)
+            num_failed += 1
+            continue
+
+        logging.debug("Converted %s -> %s", pkl_file, output_file)
+        if args.delete:
+            pkl_file.unlink()
+
+    logging.info("Converted %d of %d files.", len(files) - num_failed, len(files))
+
+    return 1 if num_failed else 0
+
+
+if __name__ == "__main__":
+    with contextlib.suppress(KeyboardInterrupt):
+        sys.exit(main())
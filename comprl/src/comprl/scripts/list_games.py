@@ -15,7 +15,7 @@ except ImportError:
     # tomllib was added in Python 3.11.  Older versions can use tomli
     import tomli as tomllib  # type: ignore[import-not-found, no-redef]
 
-from comprl.server.data.sql_backend import Game
+from comprl.server.data.sql_backend import Game, get_engine
 from comprl.server.data.interfaces import GameEndState
 
 
@@ -40,7 +40,7 @@ def main() -> int:
         data = tomllib.load(f)["CompetitionServer"]
 
     db_path = data["database_path"]
-    engine = sa.create_engine(f"sqlite:///{db_path}")
+    engine = get_engine(db_path)
 
     fields = [
         "start_time",
@@ -12,7 +12,7 @@ import sqlalchemy as sa
 import tabulate
 import typer
 
-from comprl.server.data.sql_backend import Game, User, hash_password
+from comprl.server.data.sql_backend import Game, User, get_engine, hash_password
 from comprl.server.data.interfaces import UserRole
 from comprl.server.data import UserData
 
@@ -25,7 +25,7 @@ def list(
     database: Annotated[str, typer.Argument(help="Path to the database file.")],
 ) -> None:
     """List all users."""
-    engine = sa.create_engine(f"sqlite:///{database}")
+    engine = get_engine(database)
 
     data = []
     with sa.orm.Session(engine) as session:
@@ -94,7 +94,7 @@ def show(
     username: Annotated[str, typer.Argument(help="Name of the user")],
 ) -> None:
     """Show user entry."""
-    engine = sa.create_engine(f"sqlite:///{database}")
+    engine = get_engine(database)
     with sa.orm.Session(engine) as session:
         user = session.scalar(sa.select(User).where(User.username == username))
 
@@ -154,7 +154,7 @@ def edit(
         format="[%(asctime)s] [%(name)s | %(levelname)s] %(message)s",
     )
 
-    engine = sa.create_engine(f"sqlite:///{database}")
+    engine = get_engine(database)
 
     with sa.orm.Session(engine) as session:
         changed = False
@@ -180,6 +180,10 @@ def edit(
         if changed:
             session.commit()
             session.refresh(user)
+            logging.info(
+                "A running server picks up the change after `user_cache_ttl` seconds"
+                " or when receiving SIGHUP."
+            )
 
     # print the user entry
     pprint.pprint(user)
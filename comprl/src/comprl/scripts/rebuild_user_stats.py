@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""Rebuild the game statistics of all users from the games table.
+
+The statistics (table ``user_stats``) are updated by the server with every game, so
+this is only needed if the games table was modified by other means.
+"""
+
+import argparse
+import contextlib
+import logging
+import pathlib
+import sys
+import time
+
+from comprl.server.config import load_database_path
+from comprl.server.data import sql_backend
+
+
+def main() -> int:
+    """main."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "config", type=pathlib.Path, help="Path to the configuration file."
+    )
+    parser.add_argument(
+        "--verbose", "-v", action="store_true", help="Enable verbose output."
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.INFO,
+        format="[%(asctime)s] [%(name)s | %(levelname)s] %(message)s",
+    )
+
+    db_path = load_database_path(args.config)
+
+    if not db_path.exists():
+        print(f"ERROR: Database '{db_path}' does not exist.", file=sys.stderr)
+        return 1
+
+    start = time.perf_counter()
+    with sql_backend.get_engine(db_path).begin() as conn:
+        sql_backend.rebuild_user_stats(conn)
+    logging.info("Rebuilt user statistics (%.2fs)", time.perf_counter() - start)
+
+    return 0
+
+
+if __name__ == "__main__":
+    with contextlib.suppress(KeyboardInterrupt):
+        sys.exit(main())
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""Recompute the ratings of all users by replaying the games in the database.
+
+The games are read in the order in which they were started and rated with the same
+model as in the server.  Users without games are reset to the default rating.  The
+rating history is rebuilt from the replayed games (with the start time of each game).
+The new ratings and history are written in a single transaction.
+
+The server must be stopped while the ratings are recomputed: it keeps the ratings of
+the connected users in memory and would overwrite the recomputed ratings with the
+results of games that end in the meantime.  As a safeguard, nothing is written if
+games have been added to the database since they were replayed.
+"""
+
+import argparse
+import contextlib
+import logging
+import pathlib
+import sys
+import time
+
+import sqlalchemy as sa
+from openskill.models import PlackettLuce
+
+from comprl.server import rating
+from comprl.server.config import load_database_path
+from comprl.server.data.interfaces import RatingHistoryEntry
+from comprl.server.data.sql_backend import (
+    DEFAULT_MU,
+    DEFAULT_SIGMA,
+    Game,
+    RatingHistory,
+    User,
+    add_rating_history,
+    get_engine,
+    refresh_leaderboard,
+)
+
+
+def replay_games(
+    engine: sa.Engine,
+    model: PlackettLuce,
+    chunk_size: int = 10000,
+    history: list[RatingHistoryEntry] | None = None,
+) -> tuple[dict[int, tuple[float, float]], int]:
+    """
+    Computes the ratings resulting from all games in the database.
+
+    The games are streamed from the database in chunks, so they don't need to fit
+    into memory.
+
+    Args:
+        engine: Engine of the database.
+        model: The rating model.
+        chunk_size: Number of games fetched and rated at once.
+        history: If given, the ratings of both users after each game are appended
+            (with the start time of the game).
+
+    Returns:
+        The ratings (mu, sigma) by user ID (only users with games) and the number of
+        games.
+    """
+    ratings: dict[int, tuple[float, float]] = {}
+    num_games = 0
+    query = (
+        sa.select(
+            Game.user1,
+            Game.user2,
+            Game.score1,
+            Game.score2,
+            Game.game_id,
+            Game.start_time,
+        )
+        .order_by(Game.start_time, Game.id)
+        .execution_options(yield_per=chunk_size)
+    )
+    with engine.connect() as connection:
+        for rows in connection.execute(query).partitions():
+            chunk_history: list[RatingHistoryEntry] | None = (
+                None if history is None else []
+            )
+            rating.apply_games(
+                model,
+                (rating.GameOutcome(*row[:5]) for row in rows),
+                ratings,
+                history=chunk_history,
+            )
+            if history is not None and chunk_history is not None:
+                start_times = {row.game_id: row.start_time for row in rows}
+                history.extend(
+                    entry._replace(timestamp=start_times[entry.game_id])
+                    for entry in chunk_history
+                )
+            num_games += len(rows)
+            logging.debug("Rated %d games", num_games)
+    return ratings, num_games
+
+
+def write_ratings(
+    engine: sa.Engine,
+    ratings: dict[int, tuple[float, float]],
+    history: list[RatingHistoryEntry] | None = None,
+    num_games: int | None = None,
+) -> int:
+    """
+    Replaces the ratings and the rating history of all users in a single transaction.
+
+    Args:
+        engine: Engine of the database.
+        ratings: The new ratings by user ID.  Users not included are reset to the
+            default rating.
+        history: The new rating history.  The old history is deleted in any case,
+            as it doesn't match the new ratings.
+        num_games: The number of replayed games.  If given and the database
+            contains a different number of games, nothing is written.
+
+    Returns:
+        The number of updated users (excluding reset ones).
+
+    Raises:
+        RuntimeError: If the games in the database don't match ``num_games``.
+    """
+    with sa.orm.Session(engine) as session:
+        if num_games is not None:
+            num_stored = session.scalar(sa.select(sa.func.count()).select_from(Game))
+            if num_stored != num_games:
+                msg = (
+                    f"{num_games} games were replayed, but the database now contains"
+                    f" {num_stored}.  Is the server still running?"
+                )
+                raise RuntimeError(msg)
+        user_ids = set(session.scalars(sa.select(User.user_id)))
+        session.execute(sa.update(User).values(mu=DEFAULT_MU, sigma=DEFAULT_SIGMA))
+        updates = [
+            {"user_id": user_id, "mu": mu, "sigma": sigma}
+            for user_id, (mu, sigma) in ratings.items()
+            # games may refer to users that have been deleted
+            if user_id in user_ids
+        ]
+        if updates:
+            session.execute(sa.update(User), updates)
+        refresh_leaderboard(session)
+        session.execute(sa.delete(RatingHistory))
+        if history:
+            add_rating_history(
+                session, [entry for entry in history if entry.user_id in user_ids]
+            )
+        session.commit()
+    return len(updates)
+
+
+def main() -> int:
+    """main."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "config", type=pathlib.Path, help="Path to the configuration file."
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=10000,
+        help="Number of games read from the database at once.  Default: %(default)s",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Only compute the ratings, don't write them to the database.",
+    )
+    parser.add_argument(
+        "--verbose", "-v", action="store_true", help="Enable verbose output."
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.INFO,
+        format="[%(asctime)s] [%(name)s | %(levelname)s] %(message)s",
+    )
+
+    db_path = load_database_path(args.config)
+
+    if not db_path.exists():
+        print(f"ERROR: Database '{db_path}' does not exist.", file=sys.stderr)
+        return 1
+
+    engine = get_engine(db_path)
+
+    start = time.perf_counter()
+    history: list[RatingHistoryEntry] = []
+    ratings, num_games = replay_games(engine, PlackettLuce(), args.chunk_size, history)
+    logging.info(
+        "Rated %d games of %d users (%.2fs)",
+        num_games,
+        len(ratings),
+        time.perf_counter() - start,
+    )
+
+    if args.dry_run:
+        logging.info("Dry run, ratings are not written.")
+        return 0
+
+    try:
+        num_updated = write_ratings(engine, ratings, history, num_games)
+    except RuntimeError as e:
+        print(f"ERROR: {e}  The ratings have not been written.", file=sys.stderr)
+        return 1
+    logging.info(
+        "Updated the ratings of %d users and wrote %d history entries.",
+        num_updated,
+        len(history),
+    )
+
+    return 0
+
+
+if __name__ == "__main__":
+    with contextlib.suppress(KeyboardInterrupt):
+        sys.exit(main())
@@ -18,13 +18,14 @@ logging.basicConfig(level=logging.DEBUG)
 
 
 def reset_games(game_data: GameData):
-    """deletes the game table"""
+    """deletes the game table (and the user statistics and rating history)"""
     game_data.delete_all()
-    logging.info("The games table has been deleted.")
+    logging.info("The games table and the rating history have been deleted.")
 
 
 def reset_elo(user_data: UserData):
-    """reset the elo in the user database: set mu=25.000 and sigma=8.333"""
+    """reset the elo in the user database: set mu=25.000 and sigma=8.333 and delete
+    the rating history"""
     user_data.reset_all_matchmaking_parameters()
     logging.info(
         "The matchmaking parameters have been reset to default values for all users."
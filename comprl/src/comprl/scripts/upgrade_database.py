@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""Upgrade the database of a given configuration to the current schema.
+
+Missing tables and indexes are added in place, existing data is kept.  It is safe to
+run this multiple times.  Stop the server before upgrading, creating indexes on large
+tables may take a while.
+"""
+
+import argparse
+import contextlib
+import logging
+import pathlib
+import sys
+
+from comprl.server.config import load_database_path
+from comprl.server.data import sql_backend
+
+
+def main() -> int:
+    """main."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "config", type=pathlib.Path, help="Path to the configuration file."
+    )
+    parser.add_argument(
+        "--verbose", "-v", action="store_true", help="Enable verbose output."
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.INFO,
+        format="[%(asctime)s] [%(name)s | %(levelname)s] %(message)s",
+    )
+
+    db_path = load_database_path(args.config)
+
+    if not db_path.exists():
+        print(f"ERROR: Database '{db_path}' does not exist.", file=sys.stderr)
+        return 1
+
+    created = sql_backend.upgrade_database(db_path)
+    for name in created:
+        logging.info("Created %s", name)
+    if not created:
+        logging.info("Database is already up to date.")
+
+    return 0
+
+
+if __name__ == "__main__":
+    with contextlib.suppress(KeyboardInterrupt):
+        sys.exit(main())
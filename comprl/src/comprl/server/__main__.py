@@ -3,17 +3,28 @@
 from __future__ import annotations
 
 import argparse
-import importlib.abc
-import importlib.util
 import inspect
 import logging as log
 import os
 import pathlib
+import signal
+import socket
+import sys
 from typing import Type, TYPE_CHECKING
 
-from comprl.server import config, networking
+from comprl.server import (
+    config,
+    matchmaking,
+    metrics,
+    networking,
+    profiling,
+    replays,
+    sharding,
+)
+from comprl.server.game_worker import GameWorkerPool
 from comprl.server.managers import GameManager, PlayerManager, MatchmakingManager
 from comprl.server.interfaces import IPlayer, IServer
+from comprl.server.util import load_class
 
 if TYPE_CHECKING:
     from comprl.server.interfaces import IGame
@@ -22,17 +33,35 @@ if TYPE_CHECKING:
 class Server(IServer):
     """class for server"""
 
-    def __init__(self, game_type: Type[IGame]):
-        self.game_manager = GameManager(game_type)
+    def __init__(
+        self, game_type: Type[IGame], worker_pool: GameWorkerPool | None = None
+    ):
+        self.worker_pool = worker_pool
+        self.game_manager = GameManager(game_type, worker_pool)
         self.player_manager = PlayerManager()
         self.matchmaking = MatchmakingManager(self.player_manager, self.game_manager)
 
+        metrics.CONNECTED_PLAYERS.set_function(
+            lambda: len(self.player_manager.connected_players)
+        )
+        metrics.AUTHENTICATED_PLAYERS.set_function(
+            lambda: len(self.player_manager.auth_players)
+        )
+        metrics.QUEUE_LENGTH.set_function(lambda: self.matchmaking.queue_length())
+        metrics.ACTIVE_GAMES.set_function(lambda: len(self.game_manager.games))
+
     def on_start(self):
         """gets called when the server starts"""
+        if self.worker_pool is not None:
+            self.worker_pool.start()
         log.info("Server started")
 
     def on_stop(self):
         """gets called when the server stops"""
+        # rate the games that finished since the last update
+        self.matchmaking.update_ratings()
+        if self.worker_pool is not None:
+            self.worker_pool.close()
         log.info("Server stopped")
 
     def on_connect(self, player: IPlayer):
@@ -70,38 +99,8 @@ class Server(IServer):
 
     def on_update(self):
         """gets called every update cycle"""
-        self.matchmaking._update()
-
-
-def load_class(module_path: str, class_name: str):
-    """
-    Loads a a class from a module.
-    """
-    # get the module name by splitting the path and removing the file extension
-    name = module_path.split(os.sep)[-1].split(".")[0]
-
-    # load the module
-    spec = importlib.util.spec_from_file_location(name, module_path)
-
-    # check if the module could be loaded
-    if spec is None:
-        return None
-
-    # create the module
-    module = importlib.util.module_from_spec(spec)
-
-    # this is for mypy
-    if not isinstance(spec.loader, importlib.abc.Loader):
-        return None
-
-    # exec the module
-    try:
-        spec.loader.exec_module(module)
-    except FileNotFoundError:
-        return None
-
-    # finally get the class
-    return getattr(module, class_name)
+        with profiling.span("on_update"):
+            self.matchmaking._update()
 
 
 def main():
@@ -111,6 +110,9 @@ def main():
     parser = argparse.ArgumentParser(description=__doc__)
     parser.add_argument("--config", type=pathlib.Path, help="Config file")
     parser.add_argument("--config-overwrites", type=str, nargs="+", default=[])
+    # used internally to start the shard processes (see `shards` in the config)
+    parser.add_argument("--shard-index", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--coordinator-socket", type=str, help=argparse.SUPPRESS)
     args = parser.parse_args()
 
     try:
@@ -120,7 +122,13 @@ def main():
         return
 
     # set up logging
-    log.basicConfig(level=conf.log_level)
+    if args.shard_index is not None:
+        log.basicConfig(
+            level=conf.log_level,
+            format=f"%(levelname)s:shard-{args.shard_index}:%(message)s",
+        )
+    else:
+        log.basicConfig(level=conf.log_level)
 
     # resolve relative game_path w.r.t. current working directory
     absolute_game_path = os.path.join(os.getcwd(), conf.game_path)
@@ -140,7 +148,68 @@ def main():
         log.error("data_dir '%s' not found or not a directory", conf.data_dir)
         return
 
-    server = Server(game_type)
+    try:
+        replays.FsyncPolicy(conf.replay_fsync)
+    except ValueError:
+        log.error("Invalid value for replay_fsync: '%s'", conf.replay_fsync)
+        return
+
+    if conf.game_workers < 0:
+        log.error("game_workers must not be negative")
+        return
+
+    try:
+        matchmaking.MatchingStrategy(conf.matchmaking_strategy)
+    except ValueError:
+        log.error(
+            "Invalid value for matchmaking_strategy: '%s'", conf.matchmaking_strategy
+        )
+        return
+
+    if conf.shards > 1 and not hasattr(socket, "SO_REUSEPORT"):
+        log.error("shards > 1 is not supported on this platform (no SO_REUSEPORT)")
+        return
+
+    if conf.metrics_port > 0:
+        if args.shard_index is None:
+            metrics.listen(conf.metrics_port)
+        else:
+            metrics.listen(conf.metrics_port + 1 + args.shard_index)
+
+    if conf.profiling:
+        profiling.setup(
+            conf.data_dir, conf.profiling_slow_ms, conf.profiling_sample_interval_ms
+        )
+
+    if conf.shards > 1 and args.shard_index is None:
+        # this process only runs the matchmaking, the clients are handled by the shards
+        sharding.launch_coordinator(sys.argv[1:], conf.shards)
+        return
+
+    worker_pool = None
+    if conf.game_workers > 0:
+        worker_pool = GameWorkerPool(
+            absolute_game_path, conf.game_class, conf.game_workers
+        )
+
+    server = Server(game_type, worker_pool)
+
+    # user data is cached by the server.  Send SIGHUP to reload it immediately (e.g.
+    # after editing a user with `comprl-users edit`).
+    signal.signal(
+        signal.SIGHUP, lambda signum, frame: server.player_manager.clear_user_cache()
+    )
+
+    if args.shard_index is not None:
+        shard = sharding.Shard(
+            server.player_manager, server.game_manager, args.shard_index
+        )
+        server.matchmaking = sharding.ShardMatchmaking(
+            server.player_manager, server.game_manager, shard
+        )
+        sharding.launch_shard(server, shard, args.coordinator_socket)
+        return
+
     networking.launch_server(
         server=server, port=conf.port, update_interval=conf.server_update_interval
     )
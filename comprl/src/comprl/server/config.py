@@ -24,6 +24,10 @@ class Config:
     server_update_interval: float = 1.0
     #: Seconds to wait for a player to answer
     timeout: int = 10
+    #: If > 0, games do not wait longer than this (in milliseconds) for the action of a
+    #: player but use a default action (e.g. the previous one) instead.  Players are
+    #: still disconnected if they do not answer within ``timeout``.
+    step_deadline_ms: float = 0.0
     #: Log level used by the server
     log_level: str = "INFO"
     #: File containing the game class to run
@@ -40,6 +44,47 @@ class Config:
     percentage_min_players_waiting: float = 0.1
     #: (Minutes waiting * percentage) added as a time bonus for waiting players
     percental_time_bonus: float = 0.1
+    #: How matches are selected from the queue ("first_fit" or "max_weight")
+    matchmaking_strategy: str = "first_fit"
+    #: With at least this many players in the queue, only opponents with a similar
+    #: rating are rated (using an index sorted by mu) instead of all pairs.  The
+    #: matches are the same, but large queues need much less time and memory.  0
+    #: disables the index.
+    matchmaking_index_min_queue_length: int = 1000
+    #: Maximum time (in seconds) game results and rating updates are buffered before
+    #: they are written to the database
+    db_flush_interval: float = 0.5
+    #: Number of buffered records (game results and rating updates) that triggers
+    #: writing them to the database
+    db_flush_max_records: int = 100
+    #: Seconds after which cached user data is reloaded from the database (to pick up
+    #: changes made while the server is running, e.g. with ``comprl-users edit``)
+    user_cache_ttl: float = 300.0
+    #: Number of worker processes running the games.  With 0, games are run in the
+    #: server process.
+    game_workers: int = 0
+    #: Number of server processes sharing the port (see :mod:`comprl.server.sharding`).
+    #: With 0 or 1, a single process handles all clients.
+    shards: int = 0
+    #: Number of background threads writing game replays
+    replay_writer_threads: int = 1
+    #: Maximum number of replays waiting to be written.  If the queue is full, the
+    #: server waits until there is space again.
+    replay_queue_size: int = 64
+    #: When to sync replay files to disk ("none", "file" or "full" (file + directory))
+    replay_fsync: str = "none"
+
+    #: Port of the HTTP server providing metrics in the Prometheus format (at
+    #: ``/metrics``).  With 0, no metrics are served.  With ``shards``, shard i uses
+    #: ``metrics_port + 1 + i``.
+    metrics_port: int = 0
+    #: Enable profiling (timing spans, reactor lag warnings and a sampling profiler
+    #: toggled with SIGUSR1, see :mod:`comprl.server.profiling`)
+    profiling: bool = False
+    #: Spans and reactor lags longer than this (in milliseconds) are logged
+    profiling_slow_ms: float = 100.0
+    #: Time between samples of the sampling profiler (in milliseconds)
+    profiling_sample_interval_ms: float = 5.0
 
     # key that has to be specified to register
     registration_key: str = ""
@@ -85,3 +130,16 @@ def load_config(
     set_config(config)
 
     return get_config()
+
+
+def load_database_path(config_file: str | os.PathLike) -> pathlib.Path:
+    """
+    Get the database path from a config file without loading the whole config.
+
+    Like in :func:`load_config`, a relative path is resolved w.r.t. the config file
+    location.
+    """
+    config_file = pathlib.Path(config_file)
+    with open(config_file, "rb") as f:
+        config_from_file = tomllib.load(f)["CompetitionServer"]
+    return config_file.parent / config_from_file["database_path"]
@@ -1 +1 @@
-from .sql_backend import GameData, UserData  # noqa
+from .sql_backend import GameData, RatingHistoryData, UserData  # noqa
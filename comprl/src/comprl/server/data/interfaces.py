@@ -4,7 +4,7 @@ This module contains the interfaces for the game data.
 
 from datetime import datetime
 from enum import IntEnum, Enum
-from typing import Optional
+from typing import NamedTuple, Optional
 
 from comprl.shared.types import GameID
 
@@ -90,3 +90,28 @@ class UserRole(Enum):
     USER = "user"
     ADMIN = "admin"
     BOT = "bot"
+
+
+class UserSnapshot(NamedTuple):
+    """Immutable copy of the data of a user that is needed by the server."""
+
+    user_id: int
+    username: str
+    role: str
+    mu: float
+    sigma: float
+
+    @classmethod
+    def from_user(cls, user) -> "UserSnapshot":
+        """Create snapshot from a user database entry."""
+        return cls(user.user_id, user.username, user.role, user.mu, user.sigma)
+
+
+class RatingHistoryEntry(NamedTuple):
+    """Rating of a user after a game."""
+
+    game_id: Optional[str]
+    user_id: int
+    mu: float
+    sigma: float
+    timestamp: datetime
@@ -6,19 +6,89 @@ from __future__ import annotations
 
 import datetime
 import os
+import threading
 from typing import Optional, Sequence
 
 import bcrypt
 import sqlalchemy as sa
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
-from comprl.server.data.interfaces import GameResult, UserRole
+from comprl.server.data.interfaces import (
+    GameEndState,
+    GameResult,
+    RatingHistoryEntry,
+    UserRole,
+)
 from comprl.server.config import get_config
 
 
 DEFAULT_MU = 25.0
 DEFAULT_SIGMA = 8.333
 
+#: Number of connections kept open in the pool of each engine
+POOL_SIZE = 5
+#: Number of additional connections that may be opened when the pool is exhausted
+POOL_MAX_OVERFLOW = 10
+#: Milliseconds SQLite waits for a lock to be released before raising an error
+SQLITE_BUSY_TIMEOUT_MS = 5000
+
+
+_engines: dict[str, sa.Engine] = {}
+_engines_lock = threading.Lock()
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    """Configure new SQLite connections.
+
+    WAL mode allows readers (e.g. the web frontend) to access the database while the
+    server is writing, and synchronous=NORMAL avoids an fsync on every commit (which
+    is safe in WAL mode).
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.close()
+
+
+def get_engine(db_path: str | os.PathLike) -> sa.Engine:
+    """Get the engine for the given database.
+
+    Engines are shared process-wide (one per database file), so that connections are
+    pooled and not opened again for every query.
+
+    Args:
+        db_path: Path to the sqlite database.
+
+    Returns:
+        The engine for the database.
+    """
+    key = os.path.abspath(db_path)
+    with _engines_lock:
+        engine = _engines.get(key)
+        if engine is None:
+            engine = sa.create_engine(
+                f"sqlite:///{key}",
+                poolclass=sa.pool.QueuePool,
+                pool_size=POOL_SIZE,
+                max_overflow=POOL_MAX_OVERFLOW,
+                # connections are only used by one thread at a time (ensured by the
+                # pool), so they can safely be passed between threads
+                connect_args={"check_same_thread": False},
+            )
+            sa.event.listen(engine, "connect", _set_sqlite_pragmas)
+            _engines[key] = engine
+    return engine
+
+
+def dispose_engines() -> None:
+    """Close all pooled connections and forget the shared engines."""
+    with _engines_lock:
+        for engine in _engines.values():
+            engine.dispose()
+        _engines.clear()
+
 
 class Base(sa.orm.MappedAsDataclass, sa.orm.DeclarativeBase):
     """Base class for all ORM classes."""
@@ -32,16 +102,44 @@ class User(Base):
     user_id: Mapped[int] = mapped_column(init=False, primary_key=True)
     username: Mapped[str] = mapped_column(unique=True)
     password: Mapped[bytes] = mapped_column()
-    token: Mapped[str] = mapped_column(sa.String(64))
+    # users are authenticated by token, so look-ups need to be fast
+    token: Mapped[str] = mapped_column(sa.String(64), index=True)
     role: Mapped[str] = mapped_column(default="user")
     mu: Mapped[float] = mapped_column(default=DEFAULT_MU)
     sigma: Mapped[float] = mapped_column(default=DEFAULT_SIGMA)
 
 
+#: Users are ranked by mu - sigma (see :func:`refresh_leaderboard`).  The order
+#: matches the index, so ranking does not need to sort.
+RANKING_ORDER = ((User.mu - User.sigma).desc(), User.user_id)
+sa.Index("ix_users_ranking", *RANKING_ORDER)
+
+
+class LeaderboardEntry(Base):
+    """Rank of a user.
+
+    The table is a snapshot of the ranking, which is refreshed whenever ratings
+    change, so that the top users and the rank of a user can be looked up without
+    sorting all users.
+    """
+
+    __tablename__ = "leaderboard"
+
+    rank: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
+    user_id: Mapped[int] = mapped_column(sa.ForeignKey("users.user_id"), unique=True)
+    user: Mapped["User"] = relationship(init=False)
+
+
 class Game(Base):
     """Games."""
 
     __tablename__ = "games"
+    __table_args__ = (
+        # the games of a user are usually listed/counted with the most recent first.
+        # These also serve queries filtering only by user1/user2.
+        sa.Index("ix_games_user1_start_time", "user1", "start_time"),
+        sa.Index("ix_games_user2_start_time", "user2", "start_time"),
+    )
 
     id: Mapped[int] = mapped_column(init=False, primary_key=True)
     game_id: Mapped[str] = mapped_column(unique=True)
@@ -53,23 +151,84 @@ class Game(Base):
 
     score1: Mapped[float]
     score2: Mapped[float]
-    start_time: Mapped[datetime.datetime] = mapped_column(sa.DateTime)
+    start_time: Mapped[datetime.datetime] = mapped_column(sa.DateTime, index=True)
     end_state: Mapped[int]
 
-    winner: Mapped[Optional[int]] = mapped_column(sa.ForeignKey("users.user_id"))
+    winner: Mapped[Optional[int]] = mapped_column(
+        sa.ForeignKey("users.user_id"), index=True
+    )
     winner_: Mapped["User"] = relationship(init=False, foreign_keys=[winner])
-    disconnected: Mapped[Optional[int]] = mapped_column(sa.ForeignKey("users.user_id"))
+    disconnected: Mapped[Optional[int]] = mapped_column(
+        sa.ForeignKey("users.user_id"), index=True
+    )
     disconnected_: Mapped["User"] = relationship(
         init=False, foreign_keys=[disconnected]
     )
 
+    @classmethod
+    def from_result(cls, game_result: GameResult) -> Game:
+        """Create a database entry from a game result."""
+        return cls(
+            game_id=str(game_result.game_id),
+            user1=game_result.user1_id,
+            user2=game_result.user2_id,
+            score1=game_result.score_user_1,
+            score2=game_result.score_user_2,
+            start_time=game_result.start_time,
+            end_state=int(game_result.end_state),
+            winner=game_result.winner_id,
+            disconnected=game_result.disconnected_id,
+        )
+
+
+class UserStats(Base):
+    """Game statistics of a user (updated with every game added to the database)."""
+
+    __tablename__ = "user_stats"
+
+    user_id: Mapped[int] = mapped_column(
+        sa.ForeignKey("users.user_id"), primary_key=True
+    )
+    played: Mapped[int] = mapped_column(default=0)
+    won: Mapped[int] = mapped_column(default=0)
+    lost: Mapped[int] = mapped_column(default=0)
+    drawn: Mapped[int] = mapped_column(default=0)
+    #: Number of games in which the user disconnected
+    disconnected: Mapped[int] = mapped_column(default=0)
+    #: Start time of the most recent game
+    last_game_at: Mapped[Optional[datetime.datetime]] = mapped_column(
+        sa.DateTime, default=None
+    )
+
+
+class RatingHistory(Base):
+    """Ratings of the users after each game (append-only)."""
+
+    __tablename__ = "rating_history"
+    __table_args__ = (
+        # the history is always queried per user, ordered by time
+        sa.Index("ix_rating_history_user_id_ts", "user_id", "ts"),
+    )
+
+    id: Mapped[int] = mapped_column(init=False, primary_key=True)
+    game_id: Mapped[Optional[str]]
+    user_id: Mapped[int] = mapped_column(sa.ForeignKey("users.user_id"))
+    mu: Mapped[float]
+    sigma: Mapped[float]
+    ts: Mapped[datetime.datetime] = mapped_column(sa.DateTime)
+
+    def to_entry(self) -> RatingHistoryEntry:
+        """Convert the database entry to a history entry."""
+        return RatingHistoryEntry(
+            self.game_id, self.user_id, self.mu, self.sigma, self.ts
+        )
+
 
 class GameData:
     """Represents a data access object for managing game data in a SQLite database."""
 
     def __init__(self, db_path: str | os.PathLike) -> None:
-        db_url = f"sqlite:///{db_path}"
-        self.engine = sa.create_engine(db_url)
+        self.engine = get_engine(db_path)
 
     def add(self, game_result: GameResult) -> None:
         """
@@ -80,18 +239,8 @@ class GameData:
 
         """
         with sa.orm.Session(self.engine) as session:
-            game = Game(
-                game_id=str(game_result.game_id),
-                user1=game_result.user1_id,
-                user2=game_result.user2_id,
-                score1=game_result.score_user_1,
-                score2=game_result.score_user_2,
-                start_time=game_result.start_time,
-                end_state=int(game_result.end_state),
-                winner=game_result.winner_id,
-                disconnected=game_result.disconnected_id,
-            )
-            session.add(game)
+            session.add(Game.from_result(game_result))
+            update_user_stats(session, [game_result])
             session.commit()
 
     def get_all(self) -> Sequence[Game]:
@@ -105,11 +254,29 @@ class GameData:
             return session.scalars(sa.select(Game)).all()
 
     def delete_all(self) -> None:
-        """Delete all games."""
+        """Delete all games (and the statistics and rating history of the users)."""
         with sa.orm.Session(self.engine) as session:
             session.query(Game).delete()
+            session.query(UserStats).delete()
+            session.query(RatingHistory).delete()
             session.commit()
 
+    def get_user_stats(self, user_id: int) -> UserStats:
+        """
+        Retrieves the game statistics of a user.
+
+        Args:
+            user_id: The ID of the user.
+
+        Returns:
+            The statistics (all zero if the user has not played yet).
+        """
+        with sa.orm.Session(self.engine) as session:
+            stats = session.get(UserStats, user_id)
+            if stats is None:
+                stats = UserStats(user_id=user_id)
+            return stats
+
 
 class UserData:
     """Represents a data access object for managing game data in a SQLite database."""
@@ -125,8 +292,7 @@ class UserData:
             db_path = get_config().database_path
 
         # connect to the database
-        db_url = f"sqlite:///{db_path}"
-        self.engine = sa.create_engine(db_url)
+        self.engine = get_engine(db_path)
 
     def add(
         self,
@@ -162,6 +328,8 @@ class UserData:
                 sigma=user_sigma,
             )
             session.add(user)
+            session.flush()
+            refresh_leaderboard(session)
             session.commit()
             session.refresh(user)
 
@@ -223,13 +391,290 @@ class UserData:
 
             user.mu = mu
             user.sigma = sigma
+            session.flush()
+            refresh_leaderboard(session)
             session.commit()
 
     def reset_all_matchmaking_parameters(self) -> None:
-        """Resets the matchmaking parameters of all users."""
+        """Resets the matchmaking parameters (and the rating history) of all users."""
         with sa.orm.Session(self.engine) as session:
             session.query(User).update({"mu": DEFAULT_MU, "sigma": DEFAULT_SIGMA})
+            session.query(RatingHistory).delete()
+            refresh_leaderboard(session)
+            session.commit()
+
+    def get_leaderboard(
+        self, limit: int | None = None, offset: int = 0
+    ) -> list[tuple[int, User]]:
+        """
+        Retrieves the ranked users.
+
+        Args:
+            limit: Maximum number of users (e.g. 10 for the top 10).
+            offset: Number of users to skip (for pagination).
+
+        Returns:
+            Rank and user, best first.
+        """
+        query = (
+            sa.select(LeaderboardEntry.rank, User)
+            .join(User, User.user_id == LeaderboardEntry.user_id)
+            .where(LeaderboardEntry.rank > offset)
+            .order_by(LeaderboardEntry.rank)
+        )
+        if limit is not None:
+            query = query.where(LeaderboardEntry.rank <= offset + limit)
+        with sa.orm.Session(self.engine) as session:
+            return [(rank, user) for rank, user in session.execute(query)]
+
+    def get_rank(self, user_id: int) -> int | None:
+        """
+        Retrieves the rank of a user (1 is the best).
+
+        Args:
+            user_id: The ID of the user.
+
+        Returns:
+            The rank or None if the user does not exist.
+        """
+        with sa.orm.Session(self.engine) as session:
+            rank = session.scalar(
+                sa.select(LeaderboardEntry.rank).where(
+                    LeaderboardEntry.user_id == user_id
+                )
+            )
+            if rank is not None:
+                return rank
+
+            # Users that were added without refreshing the leaderboard (e.g. by an
+            # older version of the web interface) are ranked now.
+            if session.get(User, user_id) is None:
+                return None
+            refresh_leaderboard(session)
             session.commit()
+            return session.scalar(
+                sa.select(LeaderboardEntry.rank).where(
+                    LeaderboardEntry.user_id == user_id
+                )
+            )
+
+
+class RatingHistoryData:
+    """Data access object for the rating history of the users."""
+
+    def __init__(self, db_path: str | os.PathLike) -> None:
+        self.engine = get_engine(db_path)
+
+    def add(self, entries: Sequence[RatingHistoryEntry]) -> None:
+        """
+        Appends entries to the rating history.
+
+        Args:
+            entries: The new entries.
+        """
+        with sa.orm.Session(self.engine) as session:
+            add_rating_history(session, entries)
+            session.commit()
+
+    def get(
+        self,
+        user_id: int,
+        limit: int | None = None,
+        bucket_seconds: int | None = None,
+        since: datetime.datetime | None = None,
+    ) -> list[RatingHistoryEntry]:
+        """
+        Retrieves the rating history of a user, optionally downsampled.
+
+        Args:
+            user_id: The ID of the user.
+            limit: Return only the most recent ``limit`` entries (or buckets).
+            bucket_seconds: If set, the time is divided into buckets of this length
+                and only the last entry of each bucket is returned (e.g. 3600 for
+                the rating at the end of each hour).
+            since: Only consider entries from this time on.
+
+        Returns:
+            The entries, oldest first.
+        """
+        condition = RatingHistory.user_id == user_id
+        if since is not None:
+            condition &= RatingHistory.ts >= since
+
+        query = sa.select(RatingHistory).where(condition)
+        if bucket_seconds is not None:
+            # the entries are appended in chronological order, so the entry with the
+            # highest ID is the last one of a bucket
+            bucket = (
+                sa.cast(sa.func.strftime("%s", RatingHistory.ts), sa.Integer)
+                // bucket_seconds
+            )
+            last_in_bucket = (
+                sa.select(sa.func.max(RatingHistory.id))
+                .where(condition)
+                .group_by(bucket)
+            )
+            query = query.where(RatingHistory.id.in_(last_in_bucket))
+        query = query.order_by(RatingHistory.ts.desc(), RatingHistory.id.desc())
+        if limit is not None:
+            query = query.limit(limit)
+
+        with sa.orm.Session(self.engine) as session:
+            entries = [row.to_entry() for row in session.scalars(query)]
+        entries.reverse()
+        return entries
+
+
+def update_user_stats(session: sa.orm.Session, games: Sequence[GameResult]) -> None:
+    """Adds the given games to the statistics of their users using the given session."""
+    deltas: dict[int, dict] = {}
+    for game in games:
+        for user_id in (game.user1_id, game.user2_id):
+            delta = deltas.setdefault(
+                user_id,
+                {
+                    "user_id": user_id,
+                    "played": 0,
+                    "won": 0,
+                    "lost": 0,
+                    "drawn": 0,
+                    "disconnected": 0,
+                    "last_game_at": game.start_time,
+                },
+            )
+            delta["played"] += 1
+            if game.winner_id is not None:
+                delta["won" if game.winner_id == user_id else "lost"] += 1
+            if game.end_state == GameEndState.DRAW:
+                delta["drawn"] += 1
+            if game.disconnected_id == user_id:
+                delta["disconnected"] += 1
+            delta["last_game_at"] = max(delta["last_game_at"], game.start_time)
+
+    if not deltas:
+        return
+    insert = sqlite_insert(UserStats)
+    counters = ("played", "won", "lost", "drawn", "disconnected")
+    session.execute(
+        insert.on_conflict_do_update(
+            index_elements=[UserStats.user_id],
+            set_={
+                **{
+                    name: getattr(UserStats, name) + getattr(insert.excluded, name)
+                    for name in counters
+                },
+                "last_game_at": sa.func.max(
+                    sa.func.coalesce(
+                        UserStats.last_game_at, insert.excluded.last_game_at
+                    ),
+                    insert.excluded.last_game_at,
+                ),
+            },
+        ),
+        list(deltas.values()),
+    )
+
+
+def refresh_leaderboard(connection: sa.orm.Session | sa.Connection) -> None:
+    """
+    Updates the ranks of all users (as part of the current transaction).
+
+    Only the entries whose rank changed are rewritten, so a rating update usually
+    touches a few rows instead of the whole table.
+    """
+    ranked_users = sa.select(
+        sa.func.row_number().over(order_by=RANKING_ORDER), User.user_id
+    )
+    # Remove the entries that are not in the new ranking.  The remaining entries
+    # are correct, so the missing ones can be inserted without conflicts.
+    connection.execute(
+        sa.delete(LeaderboardEntry)
+        .where(
+            sa.tuple_(LeaderboardEntry.rank, LeaderboardEntry.user_id).not_in(
+                ranked_users
+            )
+        )
+        .execution_options(synchronize_session=False)
+    )
+    connection.execute(
+        sa.insert(LeaderboardEntry).from_select(
+            ["rank", "user_id"],
+            sa.except_(
+                ranked_users, sa.select(LeaderboardEntry.rank, LeaderboardEntry.user_id)
+            ),
+        )
+    )
+
+
+def rebuild_user_stats(connection: sa.Connection) -> None:
+    """Recomputes the statistics of all users from the games table."""
+    participations = sa.union_all(
+        sa.select(
+            Game.user1.label("user_id"),
+            Game.winner,
+            Game.end_state,
+            Game.disconnected,
+            Game.start_time,
+        ),
+        sa.select(
+            Game.user2.label("user_id"),
+            Game.winner,
+            Game.end_state,
+            Game.disconnected,
+            Game.start_time,
+        ),
+    ).subquery()
+    user_id = participations.c.user_id
+    winner = participations.c.winner
+
+    def count(condition):
+        return sa.func.coalesce(sa.func.sum(sa.case((condition, 1), else_=0)), 0)
+
+    stats = sa.select(
+        user_id,
+        sa.func.count(),
+        count(winner == user_id),
+        count(winner.is_not(None) & (winner != user_id)),
+        count(participations.c.end_state == int(GameEndState.DRAW)),
+        count(participations.c.disconnected == user_id),
+        sa.func.max(participations.c.start_time),
+    ).group_by(user_id)
+
+    connection.execute(sa.delete(UserStats))
+    connection.execute(
+        sa.insert(UserStats).from_select(
+            [
+                "user_id",
+                "played",
+                "won",
+                "lost",
+                "drawn",
+                "disconnected",
+                "last_game_at",
+            ],
+            stats,
+        )
+    )
+
+
+def add_rating_history(
+    session: sa.orm.Session, entries: Sequence[RatingHistoryEntry]
+) -> None:
+    """Inserts rating history entries (as a bulk insert) using the given session."""
+    if entries:
+        session.execute(
+            sa.insert(RatingHistory),
+            [
+                {
+                    "game_id": entry.game_id,
+                    "user_id": entry.user_id,
+                    "mu": entry.mu,
+                    "sigma": entry.sigma,
+                    "ts": entry.timestamp,
+                }
+                for entry in entries
+            ],
+        )
 
 
 def hash_password(secret: str) -> bytes:
@@ -247,7 +692,55 @@ def hash_password(secret: str) -> bytes:
     )
 
 
-def create_database_tables(db_path: str) -> None:
+def create_database_tables(db_path: str | os.PathLike) -> None:
     """Create the database tables in the given SQLite database."""
-    engine = sa.create_engine(f"sqlite:///{db_path}")
-    Base.metadata.create_all(engine)
+    Base.metadata.create_all(get_engine(db_path))
+
+
+def upgrade_database(db_path: str | os.PathLike) -> list[str]:
+    """Upgrade an existing database in place to the current schema.
+
+    Missing tables and indexes are created, existing data is not modified.  Only
+    additive changes are supported (columns of existing tables are not altered).
+
+    Args:
+        db_path: Path to the sqlite database.
+
+    Returns:
+        Names of the tables and indexes that were created.
+    """
+    engine = get_engine(db_path)
+    created: list[str] = []
+    with engine.begin() as conn:
+        inspector = sa.inspect(conn)
+        existing_tables = set(inspector.get_table_names())
+        # the inspector does not report expression indexes, so ask SQLite directly
+        existing_indexes = set(
+            conn.exec_driver_sql(
+                "SELECT name FROM sqlite_master WHERE type = 'index'"
+            ).scalars()
+        )
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                # creates the indexes of the table as well
+                table.create(conn)
+                created.append(table.name)
+                created.extend(str(index.name) for index in table.indexes)
+                continue
+
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    index.create(conn)
+                    created.append(str(index.name))
+
+        if UserStats.__tablename__ in created:
+            # add the games played so far
+            rebuild_user_stats(conn)
+        if LeaderboardEntry.__tablename__ in created:
+            refresh_leaderboard(conn)
+
+        if created:
+            # update the statistics used by the query planner to choose indexes
+            conn.exec_driver_sql("ANALYZE")
+
+    return created
@@ -0,0 +1,360 @@
+"""
+Write-behind persistence of game results, rating updates and the rating history.
+
+Instead of committing every game result and rating update separately, they are
+buffered and written in a single transaction by a background thread.
+"""
+
+from __future__ import annotations
+
+import dataclasses
+import logging as log
+import os
+import threading
+import time
+
+import sqlalchemy as sa
+
+from comprl.server import metrics, profiling
+from comprl.server.config import get_config
+from comprl.server.data.interfaces import GameResult, RatingHistoryEntry
+from comprl.server.data.sql_backend import (
+    Game,
+    User,
+    add_rating_history,
+    get_engine,
+    refresh_leaderboard,
+    update_user_stats,
+)
+
+
+@dataclasses.dataclass
+class WriteBehindStats:
+    """Counters of the write-behind store."""
+
+    #: Number of transactions written
+    flushes: int = 0
+    #: Number of records (games, rating updates and history entries) written
+    records: int = 0
+    #: Number of records that could not be written
+    failed_records: int = 0
+    #: Number of records written in the last flush
+    last_flush_size: int = 0
+    #: Highest number of records written in one flush
+    max_flush_size: int = 0
+    #: Total time spent writing (in seconds)
+    total_flush_time: float = 0.0
+    #: Longest time needed for one flush (in seconds)
+    max_flush_time: float = 0.0
+
+
+class WriteBehindStore:
+    """
+    Buffers game results, rating updates and rating history entries and writes them in
+    batches.
+
+    Pending records are written in one transaction as soon as ``max_records`` are
+    buffered or ``flush_interval`` seconds have passed since the last flush.  Rating
+    updates of the same user are combined, only the latest values are written.
+
+    Call :meth:`close` on shutdown to write all remaining records.
+    """
+
+    def __init__(
+        self,
+        db_path: str | os.PathLike,
+        flush_interval: float = 0.5,
+        max_records: int = 100,
+    ) -> None:
+        """
+        Initializes the store and starts the writer thread.
+
+        Args:
+            db_path: Path to the sqlite database.
+            flush_interval: Maximum time (in seconds) records are buffered.
+            max_records: Number of buffered records that triggers a flush.
+        """
+        self.engine = get_engine(db_path)
+        self.flush_interval = flush_interval
+        self.max_records = max_records
+        self.stats = WriteBehindStats()
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        # ensures that only one flush is running at a time
+        self._flush_lock = threading.Lock()
+        self._games: list[GameResult] = []
+        self._ratings: dict[int, tuple[float, float]] = {}
+        # rating updates that are currently being written (not committed yet)
+        self._in_flight_ratings: dict[int, tuple[float, float]] = {}
+        #: Number of completed writes.  Data read from the database while this
+        #: changed may be outdated (see :meth:`pending_matchmaking_parameters`).
+        self.write_generation = 0
+        self._history: list[RatingHistoryEntry] = []
+        self._closed = False
+
+        self._thread = threading.Thread(
+            target=self._work, name="write-behind", daemon=True
+        )
+        self._thread.start()
+
+    @property
+    def num_pending(self) -> int:
+        """Number of records waiting to be written."""
+        with self._lock:
+            return len(self._games) + len(self._ratings) + len(self._history)
+
+    def add_game(self, game_result: GameResult) -> None:
+        """
+        Queues a game result for writing.
+
+        Args:
+            game_result: The result of the game.
+        """
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Write-behind store is already closed")
+            self._games.append(game_result)
+            self._notify_if_full()
+
+    def set_matchmaking_parameters(self, user_id: int, mu: float, sigma: float) -> None:
+        """
+        Queues an update of the matchmaking parameters of a user.
+
+        Args:
+            user_id (int): The ID of the user.
+            mu (float): The new mu value of the user.
+            sigma (float): The new sigma value of the user.
+        """
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Write-behind store is already closed")
+            self._ratings[user_id] = (mu, sigma)
+            self._notify_if_full()
+
+    def set_all_matchmaking_parameters(
+        self,
+        ratings: dict[int, tuple[float, float]],
+        history: list[RatingHistoryEntry] | None = None,
+        games: list[GameResult] | None = None,
+    ) -> None:
+        """
+        Queues updates of the matchmaking parameters of several users.
+
+        The updates are queued at once, so they are written in the same transaction.
+
+        Args:
+            ratings: The new mu and sigma values by user ID.
+            history: Entries appended to the rating history.
+            games: Results of the games that led to the updates.
+        """
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Write-behind store is already closed")
+            self._ratings.update(ratings)
+            if history:
+                self._history.extend(history)
+            if games:
+                self._games.extend(games)
+            self._notify_if_full()
+
+    def pending_matchmaking_parameters(
+        self, user_id: int
+    ) -> tuple[float, float] | None:
+        """
+        Returns the matchmaking parameters of a user that are not written yet.
+
+        This includes updates that are currently being written.  Values read from the
+        database before a write completed may be outdated even if this returns None,
+        so compare :attr:`write_generation` before and after reading.
+
+        Args:
+            user_id (int): The ID of the user.
+
+        Returns:
+            The pending mu and sigma values or None if there is no pending update.
+        """
+        with self._lock:
+            pending = self._ratings.get(user_id)
+            if pending is None:
+                pending = self._in_flight_ratings.get(user_id)
+            return pending
+
+    def flush(self) -> None:
+        """Writes all pending records (blocks until they are written)."""
+        with self._flush_lock:
+            with self._lock:
+                games, self._games = self._games, []
+                ratings, self._ratings = self._ratings, {}
+                history, self._history = self._history, []
+                self._in_flight_ratings = ratings
+            if not (games or ratings or history):
+                return
+            try:
+                self._write(games, ratings, history)
+            finally:
+                with self._lock:
+                    self._in_flight_ratings = {}
+                    self.write_generation += 1
+
+    def close(self) -> None:
+        """Writes all pending records and stops the writer thread."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._wakeup.notify()
+        self._thread.join()
+        self.flush()
+
+        log.info(
+            "Write-behind store stopped | flushes=%d records=%d failed=%d",
+            self.stats.flushes,
+            self.stats.records,
+            self.stats.failed_records,
+        )
+
+    def _notify_if_full(self) -> None:
+        # must be called with self._lock held
+        num_records = len(self._games) + len(self._ratings) + len(self._history)
+        if num_records >= self.max_records:
+            self._wakeup.notify()
+
+    def _work(self) -> None:
+        while True:
+            with self._lock:
+                if not self._closed:
+                    self._wakeup.wait(self.flush_interval)
+                if self._closed:
+                    return
+            try:
+                self.flush()
+            except Exception:
+                log.exception("Failed to write pending records to the database")
+
+    def _write(
+        self,
+        games: list[GameResult],
+        ratings: dict[int, tuple[float, float]],
+        history: list[RatingHistoryEntry],
+    ) -> None:
+        start = time.perf_counter()
+        num_records = len(games) + len(ratings) + len(history)
+        num_failed = num_requeued = 0
+        try:
+            with profiling.span("db_write"), sa.orm.Session(self.engine) as session:
+                session.add_all([Game.from_result(game) for game in games])
+                update_user_stats(session, games)
+                self._update_ratings(session, ratings)
+                add_rating_history(session, history)
+                session.commit()
+        except sa.exc.SQLAlchemyError:
+            log.exception(
+                "Failed to write batch of %d records, retry one by one", num_records
+            )
+            num_failed, num_requeued = self._write_individually(games, ratings, history)
+
+        duration = time.perf_counter() - start
+        metrics.DB_WRITE_DURATION.observe(duration)
+        self.stats.flushes += 1
+        self.stats.records += num_records - num_failed - num_requeued
+        self.stats.failed_records += num_failed
+        self.stats.last_flush_size = num_records
+        self.stats.max_flush_size = max(self.stats.max_flush_size, num_records)
+        self.stats.total_flush_time += duration
+        self.stats.max_flush_time = max(self.stats.max_flush_time, duration)
+        log.debug("Wrote %d records to the database (%.4fs)", num_records, duration)
+
+    def _write_individually(
+        self,
+        games: list[GameResult],
+        ratings: dict[int, tuple[float, float]],
+        history: list[RatingHistoryEntry],
+    ) -> tuple[int, int]:
+        """
+        Writes records in separate transactions.
+
+        Rating updates and history entries that cannot be written are queued again
+        for the next flush (unless the store is closed).
+
+        Returns:
+            Number of failed records and number of records queued again.
+        """
+        num_failed = 0
+        for game in games:
+            try:
+                with sa.orm.Session(self.engine) as session:
+                    session.add(Game.from_result(game))
+                    update_user_stats(session, [game])
+                    session.commit()
+            except sa.exc.SQLAlchemyError as e:
+                log.error("Failed to write result of game %s: %s", game.game_id, e)
+                num_failed += 1
+
+        failed_ratings: dict[int, tuple[float, float]] = {}
+        try:
+            with sa.orm.Session(self.engine) as session:
+                self._update_ratings(session, ratings)
+                session.commit()
+        except sa.exc.SQLAlchemyError as e:
+            log.error("Failed to write rating updates: %s", e)
+            failed_ratings = ratings
+
+        failed_history: list[RatingHistoryEntry] = []
+        try:
+            with sa.orm.Session(self.engine) as session:
+                add_rating_history(session, history)
+                session.commit()
+        except sa.exc.SQLAlchemyError as e:
+            log.error("Failed to write rating history: %s", e)
+            failed_history = history
+
+        num_requeued = len(failed_ratings) + len(failed_history)
+        if not num_requeued:
+            return num_failed, 0
+        with self._lock:
+            if self._closed:
+                return num_failed + num_requeued, 0
+            # newer updates of the same users take precedence
+            self._ratings = {**failed_ratings, **self._ratings}
+            self._history[:0] = failed_history
+        log.warning("Queued %d records again for the next flush", num_requeued)
+        return num_failed, num_requeued
+
+    @staticmethod
+    def _update_ratings(
+        session: sa.orm.Session, ratings: dict[int, tuple[float, float]]
+    ) -> None:
+        if ratings:
+            session.execute(
+                sa.update(User),
+                [
+                    {"user_id": user_id, "mu": mu, "sigma": sigma}
+                    for user_id, (mu, sigma) in ratings.items()
+                ],
+            )
+            refresh_leaderboard(session)
+
+
+_write_behind_store: WriteBehindStore | None = None
+
+
+def get_write_behind_store() -> WriteBehindStore:
+    """Get global write-behind store (created on first use based on the config)."""
+    global _write_behind_store
+    if _write_behind_store is None:
+        config = get_config()
+        _write_behind_store = WriteBehindStore(
+            config.database_path,
+            flush_interval=config.db_flush_interval,
+            max_records=config.db_flush_max_records,
+        )
+    return _write_behind_store
+
+
+def shutdown_write_behind_store() -> None:
+    """Write all pending records and stop the global store (if it exists)."""
+    global _write_behind_store
+    if _write_behind_store is not None:
+        _write_behind_store.close()
+        _write_behind_store = None
@@ -0,0 +1,511 @@
+"""
+Game worker processes.
+
+By default, all games are stepped in the server process, i.e. in the same thread as
+the networking.  With ``game_workers > 0``, the games are instead run in separate
+worker processes (shared-nothing, one pipe per worker):
+
+- For each game, the server process creates a :class:`RemoteGame`, which relays the
+  observations and actions between the players and the worker.
+- The worker creates the actual game instance and runs ``_validate_action``,
+  ``_update``, ``_get_observation``, etc.  When the game is over, it sends back the
+  result and the serialized replay, which is then written by the server process.
+
+Messages are pickled tuples ``(kind, game_id, payload)``, sent with a 4-byte length
+prefix over the stdin/stdout pipes of the worker.  Only the server process talks to
+its own workers, so unpickling them is safe.
+"""
+
+from __future__ import annotations
+
+import argparse
+import io
+import logging as log
+import os
+import pickle
+import signal
+import struct
+import sys
+from datetime import datetime
+from typing import Any, BinaryIO, Type
+
+import numpy as np
+from twisted.internet import reactor
+from twisted.internet.protocol import ProcessProtocol
+
+from comprl.server.config import get_config
+from comprl.server.interfaces import IGame, IPlayer
+from comprl.server.replays import get_replay_writer
+from comprl.server.util import load_class
+from comprl.shared.types import GameID, PlayerID
+
+_LENGTH = struct.Struct("!I")
+
+# A message: (kind, game_id, payload)
+_Message = tuple[str, GameID, Any]
+
+
+def _encode(message: _Message) -> bytes:
+    data = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+    return _LENGTH.pack(len(data)) + data
+
+
+class RemoteGame(IGame):
+    """
+    Server-side proxy of a game that is run in a worker process.
+
+    Collects the actions of the players (see :meth:`IGame._request_actions`) and
+    forwards them to the worker, which replies with the next observations or the
+    result of the game.
+    """
+
+    def __init__(self, players: list[IPlayer], worker: GameWorker) -> None:
+        """
+        Initializes the game.
+
+        Args:
+            players: The players participating in the game.
+            worker: The worker running the game.
+        """
+        super().__init__(players)
+        self.worker = worker
+        self._won: dict[PlayerID, bool] = {}
+        self._stats: dict[PlayerID, list[float]] = {}
+        self._replay: bytes | None = None
+        # the worker has been asked to end the game
+        self._ending = False
+        # the game could not be finished (error in the game or the worker process)
+        self._failed = False
+        # actions used for late players in the next step (see _default_action)
+        self._default_actions: dict[PlayerID, Any] = {}
+
+    def start(self):
+        """Starts the game in the worker and notifies the players."""
+        self.start_time = datetime.now()
+        self.worker.add_game(self)
+        self.worker.send(
+            ("start", self.id, [(p.id, p.user_id) for p in self.players.values()])
+        )
+        for player in self.players.values():
+            player.notify_start(self.id)
+
+    def force_end(self, player_id: PlayerID):
+        """Ends the game because the given player disconnected.
+
+        Args:
+            player_id (PlayerID): the player that caused the forced end
+        """
+        if self._ending:
+            return
+        self._ending = True
+        self.disconnected_player_id = player_id
+        self.worker.send(("end", self.id, player_id))
+
+    def get_result(self):
+        """Returns the result of the game (None if the game failed)."""
+        if self._failed:
+            return None
+        return super().get_result()
+
+    def on_worker_message(self, kind: str, payload: Any) -> None:
+        """Handles a message of the worker.
+
+        Args:
+            kind: Type of the message ("state" or "error").
+            payload: The state of the game or the error message.
+        """
+        if kind == "error":
+            log.error("Game %s failed in worker: %s", self.id, payload)
+            self.fail("Game error")
+            return
+
+        self.scores = payload["scores"]
+        if payload["finished"]:
+            self._won = payload["won"]
+            self._stats = payload["stats"]
+            self._replay = payload["replay"]
+            self._end("Player disconnected" if self._ending else "Player won")
+        elif payload["invalid"]:
+            # the game is ended once the disconnect is processed (see force_end)
+            for player_id in payload["invalid"]:
+                self.players[player_id].disconnect("Invalid action")
+        elif not self._ending:
+            self._default_actions = payload["default_actions"]
+            self._request_actions(payload["observations"])
+
+    def fail(self, reason: str) -> None:
+        """Ends the game without result (e.g. because the worker crashed)."""
+        self._failed = True
+        self._end(reason)
+
+    def _end(self, reason="unknown"):
+        self.worker.remove_game(self)
+        super()._end(reason)
+
+    def _save_replay(self) -> None:
+        if self._replay is not None:
+            replay = self._replay
+
+            def _write(f: BinaryIO) -> None:
+                f.write(replay)
+
+            get_replay_writer().submit(self._replay_path(), _write)
+
+    def _run(self):
+        # observations are sent by the worker
+        pass
+
+    def _advance(self, actions: dict[PlayerID, list[float]]) -> None:
+        self.worker.send(("step", self.id, actions))
+
+    def _update(self, actions: dict[PlayerID, list[float]]) -> bool:
+        raise NotImplementedError("RemoteGame is updated by the worker")
+
+    def _validate_action(self, action) -> bool:
+        # actions are validated by the worker
+        return True
+
+    def _get_observation(self, id: PlayerID) -> list[float]:
+        raise NotImplementedError("Observations are computed by the worker")
+
+    def _default_action(self, id: PlayerID) -> Any:
+        # computed by the game in the worker
+        return self._default_actions.get(id)
+
+    def _player_won(self, id: PlayerID) -> bool:
+        return self._won.get(id, False)
+
+    def _player_stats(self, id: PlayerID) -> list[float]:
+        return self._stats.get(id, [])
+
+
+class GameWorker(ProcessProtocol):
+    """Connection to a worker process (server side)."""
+
+    # the interface types of twisted are not understood by mypy
+    transport: Any
+
+    def __init__(self, pool: GameWorkerPool, index: int) -> None:
+        """
+        Initializes the connection.
+
+        Args:
+            pool: The pool the worker belongs to.
+            index: Index of the worker in the pool.
+        """
+        self.pool = pool
+        self.index = index
+        #: Games currently running in this worker
+        self.games: dict[GameID, RemoteGame] = {}
+        self._buffer = bytearray()
+
+    def add_game(self, game: RemoteGame) -> None:
+        """Registers a game running in this worker."""
+        self.games[game.id] = game
+
+    def remove_game(self, game: RemoteGame) -> None:
+        """Unregisters a game running in this worker."""
+        self.games.pop(game.id, None)
+
+    def send(self, message: _Message) -> None:
+        """Sends a message to the worker."""
+        self.transport.write(_encode(message))
+
+    def connectionMade(self):
+        """Called when the worker process is started."""
+        log.debug("Game worker %d started (pid %s)", self.index, self.transport.pid)
+
+    def childDataReceived(self, childFD, data):
+        """Called when the worker sends data."""
+        buffer = self._buffer
+        buffer += data
+        messages: list[_Message] = []
+        start = 0
+        with memoryview(buffer) as view:
+            while len(buffer) - start >= _LENGTH.size:
+                (length,) = _LENGTH.unpack_from(buffer, start)
+                end = start + _LENGTH.size + length
+                if len(buffer) < end:
+                    break
+                messages.append(pickle.loads(view[start + _LENGTH.size : end]))
+                start = end
+        # the view must be released before the buffer can be resized
+        del buffer[:start]
+
+        for kind, game_id, payload in messages:
+            game = self.games.get(game_id)
+            if game is None:
+                log.debug("Message for unknown game %s from worker", game_id)
+                continue
+            game.on_worker_message(kind, payload)
+
+    def processEnded(self, reason):
+        """Called when the worker process has exited."""
+        if not self.pool.closing:
+            log.error("Game worker %d exited unexpectedly: %s", self.index, reason)
+        for game in list(self.games.values()):
+            game.fail("Game worker failed")
+        self.pool.on_worker_ended(self)
+
+
+class GameWorkerPool:
+    """
+    Runs games in a fixed number of worker processes.
+
+    New games are placed in the worker with the least running games.  Workers that
+    exit unexpectedly are restarted (the games running in them are ended without
+    result).
+    """
+
+    def __init__(self, game_path: str, game_class: str, num_workers: int) -> None:
+        """
+        Initializes the pool.  Call :meth:`start` to start the workers.
+
+        Args:
+            game_path: File containing the game class (loaded by each worker).
+            game_class: Class name of the game.
+            num_workers: Number of worker processes.
+        """
+        self.game_path = game_path
+        self.game_class = game_class
+        self.num_workers = num_workers
+        self.workers: list[GameWorker] = []
+        self.closing = False
+
+    def start(self) -> None:
+        """Starts the worker processes."""
+        self.workers = [self._spawn(i) for i in range(self.num_workers)]
+        log.info("Started %d game workers", self.num_workers)
+
+    def close(self) -> None:
+        """Stops the worker processes (they exit once their input is closed)."""
+        self.closing = True
+        for worker in self.workers:
+            worker.transport.closeStdin()
+
+    def create_game(self, players: list[IPlayer]) -> RemoteGame:
+        """
+        Creates a game in the worker with the least running games.
+
+        Args:
+            players: The players participating in the game.
+
+        Returns:
+            The game.  Call ``start()`` to start it.
+        """
+        worker = min(self.workers, key=lambda w: len(w.games))
+        return RemoteGame(players, worker)
+
+    def on_worker_ended(self, worker: GameWorker) -> None:
+        """Replaces a worker that has exited."""
+        if self.closing:
+            return
+        self.workers[worker.index] = self._spawn(worker.index)
+
+    def _spawn(self, index: int) -> GameWorker:
+        worker = GameWorker(self, index)
+        args = [
+            sys.executable,
+            "-m",
+            "comprl.server.game_worker",
+            self.game_path,
+            self.game_class,
+            "--log-level",
+            str(get_config().log_level),
+        ]
+        reactor.spawnProcess(  # type: ignore[attr-defined]
+            worker,
+            sys.executable,
+            args,
+            env=os.environ,
+            # stdin/stdout are used for the messages, stderr (logs) is inherited
+            childFDs={0: "w", 1: "r", 2: 2},
+        )
+        return worker
+
+
+class _WorkerPlayer(IPlayer):
+    """Placeholder for a player in the worker process (only has the IDs)."""
+
+    def __init__(self, player_id: PlayerID, user_id: int | None) -> None:
+        super().__init__()
+        self.id = player_id
+        self.user_id = user_id
+
+    def authenticate(self, result_callback):
+        pass
+
+    def is_ready(self, result_callback) -> bool:
+        return True
+
+    def notify_start(self, game_id):
+        pass
+
+    def get_action(self, obv, result_callback):
+        pass
+
+    def notify_end(self, result, stats):
+        pass
+
+    def disconnect(self, reason: str):
+        pass
+
+    def notify_error(self, error: str):
+        pass
+
+    def notify_info(self, msg: str):
+        pass
+
+
+class _WorkerGame(IGame):
+    """
+    Mixin for games run in a worker.
+
+    Instead of requesting actions from the players and writing the replay, the
+    observations and the serialized replay are stored to be sent to the server.
+    """
+
+    _observations: dict[PlayerID, list[float] | np.ndarray] = {}
+    _replay: bytes | None = None
+    _finished = False
+
+    def _request_actions(
+        self, observations: dict[PlayerID, list[float] | np.ndarray]
+    ) -> None:
+        self._observations = observations
+
+    def _save_replay(self) -> None:
+        buffer = io.BytesIO()
+        self._write_replay(buffer)
+        self._replay = buffer.getvalue()
+
+    def _end(self, reason="unknown"):
+        super()._end(reason)
+        self._finished = True
+
+
+class WorkerGames:
+    """Games run by a worker process (worker side)."""
+
+    def __init__(self, game_type: Type[IGame]) -> None:
+        """
+        Initializes the worker.
+
+        Args:
+            game_type: The game class.
+        """
+        self.game_type: Type[_WorkerGame] = type(
+            game_type.__name__, (_WorkerGame, game_type), {}
+        )
+        self.games: dict[GameID, _WorkerGame] = {}
+
+    def handle(self, message: _Message) -> _Message | None:
+        """
+        Handles a message of the server.
+
+        Args:
+            message: The message.
+
+        Returns:
+            The reply to send to the server (if any).
+        """
+        kind, game_id, payload = message
+        try:
+            if kind == "start":
+                players: list[IPlayer] = [_WorkerPlayer(*ids) for ids in payload]
+                new_game = self.game_type(players)
+                new_game.id = game_id
+                self.games[game_id] = new_game
+                new_game.start()
+                return self._state(new_game)
+
+            game = self.games.get(game_id)
+            if game is None:
+                # e.g. the game ended in the same step in which a player disconnected
+                return None
+
+            if kind == "step":
+                invalid = [
+                    p for p, a in payload.items() if not game._validate_action(a)
+                ]
+                if not invalid:
+                    # the default actions of the game may depend on these (by
+                    # default, late players repeat their previous action)
+                    game._last_actions.update(payload)
+                    game._advance(payload)
+                return self._state(game, invalid)
+            elif kind == "end":
+                game.force_end(payload)
+                return self._state(game)
+            else:
+                raise ValueError(f"Unknown message type '{kind}'")
+        except Exception as e:
+            log.exception("Error in game %s", game_id)
+            self.games.pop(game_id, None)
+            return ("error", game_id, f"{type(e).__name__}: {e}")
+
+    def _state(self, game: _WorkerGame, invalid: list[PlayerID] | None = None):
+        state: dict[str, Any] = {
+            "scores": dict(game.scores),
+            "invalid": invalid or [],
+            "finished": game._finished,
+        }
+        if game._finished:
+            del self.games[game.id]
+            state["won"] = {p: game._player_won(p) for p in game.players}
+            state["stats"] = {p: list(game._player_stats(p)) for p in game.players}
+            state["replay"] = game._replay
+        else:
+            state["observations"] = game._observations
+            state["default_actions"] = {
+                p: game._default_action(p) for p in game.players
+            }
+        return ("state", game.id, state)
+
+
+def _read_message(stream: BinaryIO) -> _Message | None:
+    header = stream.read(_LENGTH.size)
+    if len(header) < _LENGTH.size:
+        return None
+    (length,) = _LENGTH.unpack(header)
+    return pickle.loads(stream.read(length))
+
+
+def main() -> None:
+    """Entry point of the worker processes."""
+    parser = argparse.ArgumentParser(description="comprl game worker")
+    parser.add_argument("game_path", type=str, help="File containing the game class")
+    parser.add_argument("game_class", type=str, help="Class name of the game")
+    parser.add_argument("--log-level", type=str, default="INFO")
+    args = parser.parse_args()
+
+    log.basicConfig(
+        level=args.log_level,
+        format=f"%(levelname)s:game-worker-{os.getpid()}:%(message)s",
+    )
+
+    # Ctrl+C is sent to the whole process group.  Ignore it, the worker exits once the
+    # server closes the pipe.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    # stdout is used for the messages, so redirect everything printed by the game to
+    # stderr
+    output = os.fdopen(os.dup(sys.stdout.fileno()), "wb")
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    game_type = load_class(args.game_path, args.game_class)
+    if game_type is None:
+        log.error("Could not load game class from %s", args.game_path)
+        sys.exit(1)
+    worker = WorkerGames(game_type)
+
+    stdin = sys.stdin.buffer
+    while (message := _read_message(stdin)) is not None:
+        reply = worker.handle(message)
+        if reply is not None:
+            output.write(_encode(reply))
+            output.flush()
+
+
+if __name__ == "__main__":
+    main()
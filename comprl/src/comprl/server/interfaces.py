@@ -3,16 +3,20 @@ This module contains the interfaces for the non-networking logic.
 """
 
 import abc
-from typing import Callable, Optional
+import functools
+import logging as log
+import pathlib
+from typing import Any, BinaryIO, Callable, Optional
 from datetime import datetime
 import numpy as np
-import pickle
-import logging
+from twisted.internet import reactor
 
 from comprl.shared.types import GameID, PlayerID
 from comprl.server.util import IDGenerator
 from comprl.server.data.interfaces import GameResult, GameEndState
 from comprl.server.config import get_config
+from comprl.server import profiling
+from comprl.server.replays import REPLAY_SUFFIX, get_replay_writer, write_replay
 
 
 class IAction:
@@ -99,6 +103,13 @@ class IGame(abc.ABC):
             The start time of the game.
         finish_callbacks (list[Callable[["IGame"], None]]):
             A list of callbacks to be executed when the game ends.
+        step_deadline_ms (float):
+            If > 0, the game does not wait longer than this for the actions of the
+            players.  Late players get their :meth:`_default_action` instead (they
+            are only disconnected after ``timeout``).  Defaults to the
+            ``step_deadline_ms`` config option.
+        late_actions (dict[PlayerID, int]):
+            Number of steps in which each player was too late.
     """
 
     @abc.abstractmethod
@@ -118,10 +129,25 @@ class IGame(abc.ABC):
         # dict storing all actions and possible more to be saved later.
         # "actions" is a list of all actions in the game
         self.game_info: dict[str, list[np.ndarray]] = {}
-        self.all_actions: list[np.ndarray] = []
+        self.all_actions: list[list] = []
         # When writing a game class you can fill the dict game_info with more
         # information
 
+        self.step_deadline_ms = get_config().step_deadline_ms
+        self.late_actions: dict[PlayerID, int] = {p.id: 0 for p in players}
+
+        # State of the current tick (see _request_actions).  The callbacks and the
+        # action buffer are reused in every tick.
+        self._action_callbacks = {
+            p.id: functools.partial(self._on_action, p.id) for p in players
+        }
+        self._actions: dict[PlayerID, Any] = {}
+        self._waiting: set[PlayerID] = set()
+        self._deadline: Any = None
+        # players with an unanswered request and the time it was sent
+        self._request_times: dict[PlayerID, float] = {}
+        self._last_actions: dict[PlayerID, Any] = {}
+
     def add_finish_callback(self, callback: Callable[["IGame"], None]) -> None:
         """
         Adds a callback function to be executed when the game ends.
@@ -149,57 +175,198 @@ class IGame(abc.ABC):
         Args:
             reason (str): The reason why the game has ended. Defaults to "unknown".
         """
-
-        # store actions:
-        # TODO: maybe add multithreading here to ease the load on the main server thread
-        # as storing the actions can take a while
-        self.game_info["actions"] = np.array(self.all_actions)
-
+        with profiling.span("game_end"):
+            self._waiting.clear()
+            if self._deadline is not None and self._deadline.active():
+                self._deadline.cancel()
+            self._deadline = None
+            if any(self.late_actions.values()):
+                log.debug(
+                    "Game %s: number of late actions %s",
+                    self.id,
+                    {str(p): n for p, n in self.late_actions.items()},
+                )
+
+            self._save_replay()
+
+            # notify end
+            for callback in self.finish_callbacks:
+                callback(self)
+
+            for player in self.players.values():
+                if player.id == self.disconnected_player_id:
+                    continue
+                player.notify_end(
+                    self._player_won(player.id), self._player_stats(player.id)
+                )
+
+    def _replay_path(self) -> pathlib.Path:
+        """Returns the path of the replay file of this game."""
         data_dir = get_config().data_dir
         # should already be checked during config loading but just to be sure
         assert data_dir.is_dir(), f"data_dir '{data_dir}' is not a directory"
         game_actions_dir = data_dir / "game_actions"
         game_actions_dir.mkdir(exist_ok=True)
-        output_file = game_actions_dir / f"{self.id}.pkl"
+        return game_actions_dir / f"{self.id}{REPLAY_SUFFIX}"
+
+    def _write_replay(self, file: BinaryIO) -> None:
+        """Writes the replay (actions and ``game_info``) of the game to a file."""
+        write_replay(file, {**self.game_info, "actions": np.array(self.all_actions)})
+
+    def _save_replay(self) -> None:
+        """Stores the actions of the game."""
+        # this is done in a background thread, as converting and writing the data can
+        # take a while
+        get_replay_writer().submit(self._replay_path(), self._write_replay)
+
+    def _run(self):
+        """
+        Requests the actions of all players for the current observations.
+        """
+        self._request_actions({p: self._get_observation(p) for p in self.players})
+
+    def _request_actions(
+        self, observations: dict[PlayerID, list[float] | np.ndarray]
+    ) -> None:
+        """
+        Sends the observations to the players and collects their actions.
 
-        logging.debug("Save game actions to %s", output_file)
-        with open(output_file, "wb") as f:
-            pickle.dump(self.game_info, f)
+        Once all players have submitted their actions, :meth:`_advance` is called
+        with them.  Players that do not answer within ``timeout`` seconds (see config)
+        are disconnected.  A single timer is used for this, which is moved forward
+        in every tick.
 
-        # notify end
-        for callback in self.finish_callbacks:
-            callback(self)
+        If ``step_deadline_ms`` is set, the game is advanced after the deadline with
+        the :meth:`_default_action` of late players.  Players that have not answered
+        an earlier request yet don't get a new observation (their answer is used
+        for the current step if it arrives in time).
 
+        Args:
+            observations: The observation of each player.
+        """
+        self._actions.clear()
+        self._waiting.update(self.players)
+        now = reactor.seconds()  # type: ignore[attr-defined]
         for player in self.players.values():
-            if player.id == self.disconnected_player_id:
+            if player.id in self._request_times:
+                # still busy with an earlier observation
                 continue
-            player.notify_end(
-                self._player_won(player.id), self._player_stats(player.id)
+            self._request_times[player.id] = now
+            player.get_action(
+                observations[player.id], self._action_callbacks[player.id]
             )
 
-    def _run(self):
-        """
-        Collects all actions and puts them in the current_actions list.
+        # players might answer immediately, which may even end the game
+        if self._waiting:
+            if self.step_deadline_ms > 0:
+                self._set_deadline(self.step_deadline_ms / 1000)
+            else:
+                self._set_deadline(get_config().timeout)
+
+    def _set_deadline(self, delay: float) -> None:
+        if self._deadline is not None and self._deadline.active():
+            self._deadline.reset(delay)
+        else:
+            self._deadline = reactor.callLater(  # type: ignore[attr-defined]
+                delay, self._on_deadline
+            )
+
+    def _on_action(self, player_id: PlayerID, action) -> None:
+        """Stores the action of a player and advances once all actions are there."""
+        self._request_times.pop(player_id, None)
+        if player_id not in self._waiting:
+            # answer after the deadline
+            return
+        self._waiting.discard(player_id)
+
+        if not self._validate_action(action):
+            self.players[player_id].disconnect("Invalid action")
+        self._actions[player_id] = action
+        self._last_actions[player_id] = action
+
+        if not self._waiting:
+            self._complete_step()
+
+    def _complete_step(self) -> None:
+        # all players have submitted their actions
+        if self.disconnected_player_id is not None:
+            return
+        # the timer is not cancelled but moved forward in the next tick
+        self._advance(self._actions)
+
+    def _on_deadline(self) -> None:
+        """
+        Uses the default actions of late players (if ``step_deadline_ms`` is set) and
+        disconnects players that did not answer within ``timeout``.
+        """
+        self._deadline = None
+        if not self._waiting:
+            # all answers arrived in time
+            return
+        timeout = get_config().timeout
+        now = reactor.seconds()  # type: ignore[attr-defined]
+
+        timed_out = []
+        for player_id in list(self._waiting):
+            waiting_time = now - self._request_times.get(player_id, now)
+            if waiting_time >= timeout:
+                timed_out.append(player_id)
+                continue
+            if self.step_deadline_ms > 0:
+                action = self._default_action(player_id)
+                if action is not None:
+                    self._waiting.discard(player_id)
+                    self._actions[player_id] = action
+                    self.late_actions[player_id] += 1
+
+        for player_id in timed_out:
+            log.debug("Player %s did not send an action in time", player_id)
+            self._waiting.discard(player_id)
+            self.players[player_id].disconnect(f"Timeout after {timeout}s")
+        if timed_out:
+            # the answers of the other players are dropped, the game is ended once
+            # the disconnect is processed
+            self._waiting.clear()
+            return
+
+        if self._waiting:
+            # no default action available, wait until the timeout
+            first_request = min(self._request_times[p] for p in self._waiting)
+            self._set_deadline(first_request + timeout - now)
+        else:
+            self._complete_step()
+
+    def _default_action(self, id: PlayerID) -> Any:
+        """
+        Returns the action used for a player that did not answer within
+        ``step_deadline_ms``.
+
+        By default, this is the previous action of the player.  Override this to
+        use a game-specific action (e.g. "do nothing").
+
+        Args:
+            id (PlayerID): The ID of the player.
+
+        Returns:
+            The action or None to wait for the player (until ``timeout``).
         """
-        actions = {}
-        for p in self.players.values():
+        return self._last_actions.get(id)
 
-            def _res(value, id=p.id):
-                if not self._validate_action(value):
-                    self.players[id].disconnect("Invalid action")
-                actions[id] = value
-                if len(actions) == len(self.players):
-                    # all players have submitted their actions
-                    # update the game, and if the game is over, end it
-                    if self.disconnected_player_id is not None:
-                        return
-                    self.all_actions.append([actions[p] for p in actions])
-                    if not self._update(actions):
-                        self._run()
-                    else:
-                        self._end(reason="Player won")
+    def _advance(self, actions: dict[PlayerID, list[float]]) -> None:
+        """
+        Updates the game with the actions of all players and continues or ends it.
 
-            p.get_action(self._get_observation(p.id), _res)
+        Args:
+            actions: The action of each player.  The dictionary is reused in the next
+                tick, so it must not be stored.
+        """
+        self.all_actions.append([actions[p] for p in self.players])
+        with profiling.span("game_update"):
+            finished = self._update(actions)
+        if not finished:
+            self._run()
+        else:
+            self._end(reason="Player won")
 
     def force_end(self, player_id: PlayerID):
         """forces the end of the game. Should be used when a player disconnects.
@@ -248,6 +415,10 @@ class IGame(abc.ABC):
         """
         Updates the game with the players' actions.
 
+        Args:
+            actions: The action of each player.  The dictionary is reused in the next
+                tick, so copy it if you need to keep it.
+
         Returns:
             bool: True if the game is over, False otherwise.
         """
@@ -267,7 +438,7 @@ class IGame(abc.ABC):
         ...
 
     @abc.abstractmethod
-    def _get_observation(self, id: PlayerID) -> list[float]:
+    def _get_observation(self, id: PlayerID) -> list[float] | np.ndarray:
         """
         Returns the observation for the player.
 
@@ -275,7 +446,9 @@ class IGame(abc.ABC):
             id (PlayerID): The ID of the player for which the observation is requested.
 
         Returns:
-            list[float]: The observation for the player.
+            list[float] | np.ndarray: The observation for the player.  Arrays are sent
+            to the client without conversion (see
+            :class:`comprl.shared.commands.PackedStep`).
         """
         ...
 
@@ -3,15 +3,29 @@ This module contains classes that manage game instances and players.
 """
 
 import logging as log
+import math
+import time
 from datetime import datetime
+
+import numpy as np
 from openskill.models import PlackettLuce
-from typing import Type, NamedTuple
+from twisted.internet import reactor
+from twisted.internet.interfaces import IDelayedCall
+from typing import Callable, Type, NamedTuple
 
+from comprl.server import matchmaking, metrics, profiling, rating
+from comprl.server.game_worker import GameWorkerPool
 from comprl.server.interfaces import IGame, IPlayer
 from comprl.shared.types import GameID, PlayerID
-from comprl.server.data import GameData, UserData
+from comprl.server.data import UserData
+from comprl.server.data.write_behind import get_write_behind_store
 from comprl.server.data.sql_backend import User
-from comprl.server.data.interfaces import UserRole
+from comprl.server.data.interfaces import (
+    GameResult,
+    RatingHistoryEntry,
+    UserRole,
+    UserSnapshot,
+)
 from comprl.server.config import get_config
 
 
@@ -22,24 +36,42 @@ class GameManager:
     Attributes:
         games (dict[GameID, IGame]): A dictionary that stores active game instances.
         game_type (Type[IGame]): The type of game to be managed.
+        worker_pool (GameWorkerPool | None): If set, games are run in the worker
+            processes of the pool instead of in the server process.
     """
 
-    def __init__(self, game_type: Type[IGame]) -> None:
+    def __init__(
+        self, game_type: Type[IGame], worker_pool: GameWorkerPool | None = None
+    ) -> None:
         self.games: dict[GameID, IGame] = {}
         self.game_type = game_type
+        self.worker_pool = worker_pool
+        # IDs of the running games of each player
+        self._games_by_player: dict[PlayerID, set[GameID]] = {}
+        # games whose results are written by the caller of start_game
+        self._results_written_by_caller: set[GameID] = set()
 
-    def start_game(self, players: list[IPlayer]) -> IGame:
+    def start_game(self, players: list[IPlayer], store_result: bool = True) -> IGame:
         """
         Starts a new game instance with the given players.
 
         Args:
             players (list[IPlayer]): A list of players participating in the game.
+            store_result (bool): Whether the result is written to the database when
+                the game ends.  False if the caller writes it (e.g. together with the
+                rating updates).
 
         Returns:
             GameID: The ID of the newly started game.
         """
-        game = self.game_type(players)
-        self.games[game.id] = game
+        game: IGame
+        if self.worker_pool is not None:
+            game = self.worker_pool.create_game(players)
+        else:
+            game = self.game_type(players)
+        self._add_game(game)
+        if not store_result:
+            self._results_written_by_caller.add(game.id)
 
         log.debug("Game started with players: " + str([p.id for p in players]))
 
@@ -59,10 +91,31 @@ class GameManager:
         if game.id in self.games:
             game_result = game.get_result()
             if game_result is not None:
-                GameData(get_config().database_path).add(game_result)
+                if game.id not in self._results_written_by_caller:
+                    get_write_behind_store().add_game(game_result)
+                metrics.GAMES_FINISHED.inc(label=game_result.end_state.name.lower())
             else:
                 log.error(f"Game had no valid result. Game-ID: {game.id}")
-            del self.games[game.id]
+                metrics.GAMES_FINISHED.inc(label="failed")
+            self._remove_game(game)
+
+    def _add_game(self, game: IGame) -> None:
+        """Adds a running game (and indexes it by its players)."""
+        self.games[game.id] = game
+        for player_id in game.players:
+            self._games_by_player.setdefault(player_id, set()).add(game.id)
+
+    def _remove_game(self, game: IGame) -> None:
+        """Removes a game (if it is still running)."""
+        if self.games.pop(game.id, None) is None:
+            return
+        self._results_written_by_caller.discard(game.id)
+        for player_id in game.players:
+            game_ids = self._games_by_player.get(player_id)
+            if game_ids is not None:
+                game_ids.discard(game.id)
+                if not game_ids:
+                    del self._games_by_player[player_id]
 
     def force_game_end(self, player_id: PlayerID):
         """Forces all games, that a player is currently playing, to end.
@@ -70,15 +123,12 @@ class GameManager:
         Args:
             player_id (PlayerID): id of the player
         """
-        involved_games: list[IGame] = []
-        for _, game in self.games.items():
-            for game_player_id in game.players:
-                if player_id == game_player_id:
-                    involved_games.append(game)
-                    break
-        for game in involved_games:
-            log.debug("Game was forced to end because of a disconnected player")
-            game.force_end(player_id=player_id)
+        # the games remove themselves from the index when they end
+        for game_id in list(self._games_by_player.get(player_id, ())):
+            game = self.games.get(game_id)
+            if game is not None:
+                log.debug("Game was forced to end because of a disconnected player")
+                game.force_end(player_id=player_id)
 
     def get(self, game_id: GameID) -> IGame | None:
         """
@@ -102,6 +152,14 @@ class PlayerManager:
         self.auth_players: dict[PlayerID, tuple[IPlayer, int]] = {}
         self.connected_players: dict[PlayerID, IPlayer] = {}
 
+        # Write-through cache of the user data, so that authentication, matchmaking
+        # and rating updates don't need to query the database every time.
+        # Entries are reloaded after `user_cache_ttl` seconds to pick up changes that
+        # are made to the database while the server is running.
+        self._user_cache: dict[int, tuple[UserSnapshot, str, float]] = {}
+        self._user_ids_by_token: dict[str, int] = {}
+        self._user_cache_ttl = get_config().user_cache_ttl
+
     def add(self, player: IPlayer) -> None:
         """
         Adds a player to the manager.
@@ -130,7 +188,7 @@ class PlayerManager:
         if player is None:
             return False
 
-        user = UserData(get_config().database_path).get_user_by_token(token)
+        user = self._get_user_by_token(token)
 
         if user is not None:
             # add player to authenticated players
@@ -147,6 +205,19 @@ class PlayerManager:
 
         return False
 
+    def add_authenticated(self, player: IPlayer, user_id: int) -> None:
+        """
+        Adds a player that has been authenticated elsewhere (e.g. by another server
+        process).
+
+        Args:
+            player (IPlayer): The player object to be added.
+            user_id (int): The ID of the user.
+        """
+        self.connected_players[player.id] = player
+        self.auth_players[player.id] = (player, user_id)
+        player.user_id = user_id
+
     def remove(self, player: IPlayer) -> None:
         """
         Removes a player from the manager.
@@ -163,7 +234,7 @@ class PlayerManager:
             if player.id in self.auth_players:
                 del self.auth_players[player.id]
 
-    def get_user(self, user_id: int) -> User | None:
+    def get_user(self, user_id: int) -> UserSnapshot | None:
         """
         Retrieves a user based on their ID.
 
@@ -171,9 +242,93 @@ class PlayerManager:
             user_id (int): The ID of the user.
 
         Returns:
-            Optional[User]: The user object if found, None otherwise.
+            Optional[UserSnapshot]: The user data if found, None otherwise.
+        """
+        cached = self._user_cache.get(user_id)
+        if cached is not None and not self._is_expired(cached[2]):
+            return cached[0]
+
+        try:
+            with profiling.span("db_get_user"):
+                user = self._load_user(
+                    lambda: UserData(get_config().database_path).get(user_id)
+                )
+        except ValueError:
+            self.invalidate_user(user_id)
+            return None
+        if user is None:
+            return None
+        return self._cache_user(user)
+
+    def _get_user_by_token(self, token: str) -> UserSnapshot | None:
         """
-        return UserData(get_config().database_path).get(user_id)
+        Retrieves a user based on their access token.
+
+        Args:
+            token (str): The access token of the user.
+
+        Returns:
+            Optional[UserSnapshot]: The user data if found, None otherwise.
+        """
+        user_id = self._user_ids_by_token.get(token)
+        if user_id is not None:
+            cached = self._user_cache.get(user_id)
+            if cached is not None and not self._is_expired(cached[2]):
+                return cached[0]
+
+        with profiling.span("db_get_user_by_token"):
+            user = self._load_user(
+                lambda: UserData(get_config().database_path).get_user_by_token(token)
+            )
+        if user is None:
+            return None
+        return self._cache_user(user)
+
+    @staticmethod
+    def _load_user(load: Callable[[], User | None]) -> User | None:
+        """
+        Loads a user from the database, consistent with the write-behind store.
+
+        If a write completed while loading, the loaded rating may be outdated but is
+        not pending anymore, so the user is loaded again.
+        """
+        store = get_write_behind_store()
+        while True:
+            generation = store.write_generation
+            user = load()
+            if store.write_generation == generation:
+                return user
+
+    def _cache_user(self, user: User) -> UserSnapshot:
+        """Adds/updates the user in the cache and returns the cached snapshot."""
+        self.invalidate_user(user.user_id)
+        snapshot = UserSnapshot.from_user(user)
+        # rating updates that are not written yet are newer than the database entry
+        pending = get_write_behind_store().pending_matchmaking_parameters(user.user_id)
+        if pending is not None:
+            snapshot = snapshot._replace(mu=pending[0], sigma=pending[1])
+        self._user_cache[user.user_id] = (snapshot, user.token, time.monotonic())
+        self._user_ids_by_token[user.token] = user.user_id
+        return snapshot
+
+    def _is_expired(self, cache_time: float) -> bool:
+        return time.monotonic() - cache_time > self._user_cache_ttl
+
+    def invalidate_user(self, user_id: int) -> None:
+        """
+        Removes a user from the cache, so that it is reloaded on next access.
+
+        Args:
+            user_id (int): The ID of the user.
+        """
+        cached = self._user_cache.pop(user_id, None)
+        if cached is not None:
+            self._user_ids_by_token.pop(cached[1], None)
+
+    def clear_user_cache(self) -> None:
+        """Removes all users from the cache."""
+        self._user_cache.clear()
+        self._user_ids_by_token.clear()
 
     def get_user_id(self, player_id: PlayerID) -> int | None:
         """
@@ -242,7 +397,10 @@ class PlayerManager:
         Returns:
             tuple[float, float]: The mu and sigma values of the user.
         """
-        return UserData(get_config().database_path).get_matchmaking_parameters(user_id)
+        user = self.get_user(user_id)
+        if user is None:
+            raise ValueError(f"User with ID {user_id} not found.")
+        return user.mu, user.sigma
 
     def update_matchmaking_parameters(
         self, user_id: int, new_mu: float, new_sigma: float
@@ -254,10 +412,49 @@ class PlayerManager:
             user_id (int): The ID of the user.
             new_mu (float): The new mu value of the user.
             new_sigma (float): The new sigma value of the user.
+
+        The cache is updated immediately, the database asynchronously (see
+        :class:`~comprl.server.data.write_behind.WriteBehindStore`).
         """
-        UserData(get_config().database_path).set_matchmaking_parameters(
-            user_id, new_mu, new_sigma
-        )
+        get_write_behind_store().set_matchmaking_parameters(user_id, new_mu, new_sigma)
+
+        cached = self._user_cache.get(user_id)
+        if cached is not None:
+            snapshot, token, cache_time = cached
+            self._user_cache[user_id] = (
+                snapshot._replace(mu=new_mu, sigma=new_sigma),
+                token,
+                cache_time,
+            )
+
+    def update_all_matchmaking_parameters(
+        self,
+        ratings: dict[int, tuple[float, float]],
+        history: list[RatingHistoryEntry] | None = None,
+        games: list[GameResult] | None = None,
+    ) -> None:
+        """
+        Updates the matchmaking parameters of several users.
+
+        Args:
+            ratings: The new mu and sigma values by user ID.
+            history: Entries appended to the rating history.
+            games: Results of the games that led to the updates.
+
+        The updates are passed to the write-behind store at once, so they are written
+        in the same transaction.
+        """
+        get_write_behind_store().set_all_matchmaking_parameters(ratings, history, games)
+
+        for user_id, (new_mu, new_sigma) in ratings.items():
+            cached = self._user_cache.get(user_id)
+            if cached is not None:
+                snapshot, token, cache_time = cached
+                self._user_cache[user_id] = (
+                    snapshot._replace(mu=new_mu, sigma=new_sigma),
+                    token,
+                    cache_time,
+                )
 
 
 # Type of a player entry in the queue, containing the player ID, user ID, mu, sigma
@@ -266,7 +463,7 @@ class QueueEntry(NamedTuple):
     """Represents an entry in the matchmaking queue."""
 
     player_id: PlayerID
-    user: User
+    user: UserSnapshot
     in_queue_since: datetime
 
     def __str__(self) -> str:
@@ -280,7 +477,10 @@ class MatchmakingManager:
     """handles matchmaking between players and starts the game"""
 
     def __init__(
-        self, player_manager: PlayerManager, game_manager: GameManager
+        self,
+        player_manager: PlayerManager,
+        game_manager: GameManager,
+        store_results: bool = True,
     ) -> None:
         """
         Initializes a MatchmakingManager object.
@@ -288,19 +488,43 @@ class MatchmakingManager:
         Args:
             player_manager (PlayerManager): The player manager object.
             game_manager (GameManager): The game manager object.
+            store_results (bool): Whether the results of the games are written
+                together with their rating updates.  False if the results are
+                written elsewhere (e.g. by the shards, see :mod:`sharding`).
         """
         self.player_manager = player_manager
         self.game_manager = game_manager
+        self._store_results = store_results
 
         config = get_config()
 
-        # queue storing player info and time they joined the queue
-        self._queue: list[QueueEntry] = []
+        # queue storing player info and time they joined the queue (in the order in
+        # which the players joined)
+        self._queue: dict[PlayerID, QueueEntry] = {}
         # The model used for matchmaking
         self.model = PlackettLuce()
         self._match_quality_threshold = config.match_quality_threshold
         self._percentage_min_players_waiting = config.percentage_min_players_waiting
         self._percental_time_bonus = config.percental_time_bonus
+        self._strategy = matchmaking.MatchingStrategy(config.matchmaking_strategy)
+        # match qualities of the queued players (updated incrementally)
+        self._pair_cache = matchmaking.PairQualityCache(self.model.beta)
+        # if no pair is matchable, the next time one becomes matchable (unless the
+        # queue changes)
+        self._idle_until = -math.inf
+        # queued players sorted by rating (used instead of the pair cache for large
+        # queues)
+        self._rating_index = matchmaking.RatingIndex(self.model.beta)
+        self._index_min_queue_length = config.matchmaking_index_min_queue_length
+        self._use_rating_index = False
+        # results of finished games, rated together after the reactor iteration
+        self._finished_games = rating.RatingBatch(self.model)
+        # results of the finished games, written together with the rating updates
+        self._finished_results: list[GameResult] = []
+        # players of finished games, queued again after the rating update
+        self._finished_players: list[PlayerID] = []
+        # scheduled call of _requeue_finished_players (one per reactor iteration)
+        self._requeue_call: IDelayedCall | None = None
 
     def try_match(self, player_id: PlayerID) -> None:
         """
@@ -346,8 +570,11 @@ class MatchmakingManager:
             )
             return
 
-        # check if enough players are waiting
-        self._queue.append(QueueEntry(player_id, user, datetime.now()))
+        if player_id in self._queue:
+            log.debug("Player is already in the queue | player_id=%s", player_id)
+            return
+
+        self._queue[player_id] = QueueEntry(player_id, user, datetime.now())
 
         log.debug(
             "Player was added to the queue | user=%s role=%s player_id=%s",
@@ -365,166 +592,304 @@ class MatchmakingManager:
         Args:
             player_id (PlayerID): The ID of the player to be removed.
         """
-        self._queue = [entry for entry in self._queue if (entry.player_id != player_id)]
+        self._queue.pop(player_id, None)
 
-    def _update(self) -> None:
-        self._match_quality_scores: list[tuple[str, str, float]] = []
+    def queue_length(self) -> int:
+        """Returns the number of players in the queue."""
+        return len(self._queue)
 
+    def _update(self) -> None:
         # TODO: don't print to stdout but to shared memory file?
         # print("Players in queue:")
-        # for entry in self._queue:
+        # for entry in self._queue.values():
         #     print(entry)
 
-        self._search_for_matches()
-
-        # print("Match quality scores:")
-        # for u1, u2, score in self._match_quality_scores:
-        #     print(f"{u1} vs {u2}: {score}")
+        start = time.perf_counter()
+        with profiling.span("search_for_matches"):
+            self._search_for_matches()
+        metrics.MATCHMAKING_DURATION.observe(time.perf_counter() - start)
 
-    def _search_for_matches(self, start_index: int = 0) -> None:
+    def _search_for_matches(self) -> None:
         """
-        Updates the matchmaking manager.
+        Searches for matches among the queued players and starts the games.
 
-        start_index (int, optional): The position in queue to start matching from.
-        Used for recursion. Defaults to 0.
+        Only pairs with a match quality above the threshold are considered.  With the
+        default strategy, players are matched greedily in queue order: each player is
+        matched with the first player behind them in the queue.  We could search for
+        the best match but using the first adds a bit of diversity and the players in
+        front of the queue are waiting longer, so its fairer for them.
+        Alternatively, the matches can be selected to maximize the total match quality
+        (see ``matchmaking_strategy`` in the config).
         """
         if len(self._queue) < self._min_players_waiting():
             return
 
-        for i in range(start_index, len(self._queue)):
-            for j in range(i + 1, len(self._queue)):
-                # try to match all players against each other
-                if self._try_start_game(self._queue[i], self._queue[j]):
-                    # Players are matched and removed from queue. Continue searching.
-                    self._search_for_matches(i)
-                    return
-        return
+        # drop players that are not connected anymore
+        for entry in list(self._queue.values()):
+            if self.player_manager.get_player_by_id(entry.player_id) is None:
+                log.error("Player was in queue but not in player manager")
+                self.remove(entry.player_id)
 
-    def _min_players_waiting(self) -> int:
+        entries = list(self._queue.values())
+        if len(entries) < 2:
+            return
+
+        now = datetime.now().timestamp()
+        if self._update_index_mode(len(entries)):
+            matches = self._matches_from_rating_index(entries, now)
+        else:
+            matches = self._matches_from_pair_cache(entries, now)
+
+        for i, j in matches:
+            self._start_game(entries[i], entries[j])
+
+    def _update_index_mode(self, queue_length: int) -> bool:
         """
-        Returns the minimum number of players that need to be waiting in the queue.
+        Decides whether the rating index or the pair cache is used.
+
+        The index is used from ``matchmaking_index_min_queue_length`` players on and
+        until the queue is half as long again (so that the structures are not rebuilt
+        all the time if the queue length is around the limit).
 
         Returns:
-            int: The minimum number of players.
-        """
-        return int(
-            len(self.player_manager.auth_players) * self._percentage_min_players_waiting
+            Whether the rating index is used.
+        """
+        limit = self._index_min_queue_length
+        if self._use_rating_index:
+            use_index = queue_length >= limit // 2
+        else:
+            use_index = limit > 0 and queue_length >= limit
+
+        if use_index != self._use_rating_index:
+            log.debug("Rating index %s", "enabled" if use_index else "disabled")
+            # drop the data of the unused structure
+            unused = self._pair_cache if use_index else self._rating_index
+            unused.keep(np.zeros(len(unused), dtype=bool))
+            self._idle_until = -math.inf
+            self._use_rating_index = use_index
+        return use_index
+
+    def _matches_from_pair_cache(
+        self, entries: list[QueueEntry], now: float
+    ) -> list[tuple[int, int]]:
+        """Selects matches by rating all pairs (see :class:`PairQualityCache`)."""
+        if not self._update_pair_cache(entries) and now < self._idle_until:
+            # nothing has changed and no pair has become matchable yet
+            return []
+
+        matchable = self._pair_cache.matchable(now)
+        if not matchable.any():
+            self._idle_until = self._pair_cache.next_eligible_at()
+            return []
+        self._idle_until = -math.inf
+
+        # only the matchable pairs are rated (and only if the strategy needs it)
+        rows, cols = np.nonzero(np.triu(matchable, k=1))
+        quality = None
+        if self._strategy == matchmaking.MatchingStrategy.MAX_WEIGHT:
+            quality = self._pair_cache.pair_match_quality(rows, cols, now)
+
+        return matchmaking.select_matches_from_pairs(
+            self._strategy,
+            rows,
+            cols,
+            quality,
+            len(entries),
+            self._min_players_waiting(),
+        )
+
+    def _matches_from_rating_index(
+        self, entries: list[QueueEntry], now: float
+    ) -> list[tuple[int, int]]:
+        """Selects matches by rating only opponents with a similar rating."""
+        index = self._rating_index
+        self._sync_entries(index, entries)
+
+        i, j, quality = index.matchable_pairs(
+            now, self._match_quality_threshold, self._percental_time_bonus
+        )
+        # positions in the index -> positions in the queue
+        queue_position = {entry.player_id: k for k, entry in enumerate(entries)}
+        positions = np.array([queue_position[key.player_id] for key in index.keys])
+        rows = np.minimum(positions[i], positions[j])
+        cols = np.maximum(positions[i], positions[j])
+
+        return matchmaking.select_matches_from_pairs(
+            self._strategy,
+            rows,
+            cols,
+            quality,
+            len(entries),
+            self._min_players_waiting(),
         )
 
-    def _try_start_game(self, player1: QueueEntry, player2: QueueEntry) -> bool:
+    def _update_pair_cache(self, entries: list[QueueEntry]) -> bool:
         """
-        Tries to start a game with the given players.
+        Updates the match qualities to the current queue.
+
+        Only players that joined the queue since the last update are rated.  A player
+        that queues again (e.g. after a game) gets a new entry, so the cached
+        qualities are never based on an outdated rating.
 
         Args:
-            player1: The first player.
-            player2: The second player.
+            entries: The queued players.
 
         Returns:
-            bool: True if the game was started, False otherwise.
+            Whether anything changed since the last update.
         """
-        # prevent the user from playing against himself
-        if player1.user.user_id == player2.user.user_id:
-            return False
-
-        # do not match if both players are bots
-        if (
-            UserRole(player1.user.role) == UserRole.BOT
-            and UserRole(player2.user.role) == UserRole.BOT
-        ):
-            return False
-
-        match_quality = self._rate_match_quality(player1, player2)
-        self._match_quality_scores.append(
-            (player1.user.username, player2.user.username, match_quality)
+        cache = self._pair_cache
+        changed = cache.set_parameters(
+            self._match_quality_threshold, self._percental_time_bonus
         )
+        changed |= self._sync_entries(cache, entries)
 
-        if match_quality > self._match_quality_threshold:
-            # match the players. We could search for best match but using the first adds
-            # a bit of diversity and the players in front of the queue are waiting
-            # longer, so its fairer for them.
-
-            players = [
-                self.player_manager.get_player_by_id(player1.player_id),
-                self.player_manager.get_player_by_id(player2.player_id),
-            ]
+        if any(
+            key is not entry for key, entry in zip(cache.keys, entries, strict=True)
+        ):
+            # the queue was reordered, which doesn't happen in normal operation
+            cache.keep(np.zeros(len(cache), dtype=bool))
+            self._sync_entries(cache, entries)
+            changed = True
+        return changed
 
-            filtered_players = [player for player in players if player is not None]
+    @staticmethod
+    def _sync_entries(
+        store: matchmaking.PairQualityCache | matchmaking.RatingIndex,
+        entries: list[QueueEntry],
+    ) -> bool:
+        """
+        Removes entries that left the queue from the store and adds the new ones.
 
-            if len(filtered_players) != 2:
-                log.error("Player was in queue but not in player manager")
-                if players[0] is None:
-                    self.remove(player1.player_id)
-                if players[1] is None:
-                    self.remove(player2.player_id)
-                return False
+        Returns:
+            Whether anything changed.
+        """
+        changed = False
+        queued = {entry.player_id: entry for entry in entries}
+        keep = np.array(
+            [queued.get(key.player_id) is key for key in store.keys], dtype=bool
+        )
+        if not keep.all():
+            store.keep(keep)
+            changed = True
+
+        stored = {key.player_id for key in store.keys}
+        new_entries = [entry for entry in entries if entry.player_id not in stored]
+        if new_entries:
+            store.add(
+                new_entries,
+                mu=np.array([entry.user.mu for entry in new_entries]),
+                sigma=np.array([entry.user.sigma for entry in new_entries]),
+                queued_at=np.array(
+                    [entry.in_queue_since.timestamp() for entry in new_entries]
+                ),
+                user_ids=np.array([entry.user.user_id for entry in new_entries]),
+                is_bot=np.array(
+                    [UserRole(entry.user.role) == UserRole.BOT for entry in new_entries]
+                ),
+            )
+            changed = True
+        return changed
 
-            self.remove(player1.player_id)
-            self.remove(player2.player_id)
+    def _min_players_waiting(self) -> int:
+        """
+        Returns the minimum number of players that need to be waiting in the queue.
 
-            game = self.game_manager.start_game(filtered_players)
-            game.add_finish_callback(self._end_game)
-            return True
-        return False
+        Returns:
+            int: The minimum number of players.
+        """
+        return int(
+            len(self.player_manager.auth_players) * self._percentage_min_players_waiting
+        )
 
-    def _rate_match_quality(self, player1: QueueEntry, player2: QueueEntry) -> float:
+    def _start_game(self, player1: QueueEntry, player2: QueueEntry) -> None:
         """
-        Rates the match quality between two players.
+        Removes the given players from the queue and starts a game with them.
 
         Args:
             player1: The first player.
             player2: The second player.
+        """
+        players = [
+            self.player_manager.get_player_by_id(player1.player_id),
+            self.player_manager.get_player_by_id(player2.player_id),
+        ]
+        filtered_players = [player for player in players if player is not None]
 
-        Returns:
-            float: The match quality.
-        """
-        now = datetime.now()
-        waiting_time_p1 = (now - player1.in_queue_since).total_seconds()
-        waiting_time_p2 = (now - player2.in_queue_since).total_seconds()
-        combined_waiting_time = waiting_time_p1 + waiting_time_p2
-        # calculate a bonus if the players waited a long time
-        waiting_bonus = max(
-            0.0, (combined_waiting_time / 60 - 1) * self._percental_time_bonus
-        )
-        # TODO play with this function. Maybe even use polynomial or exponential growth,
-        # depending on waiting time
+        self.remove(player1.player_id)
+        self.remove(player2.player_id)
 
-        rating_p1 = self.model.create_rating(
-            [player1.user.mu, player1.user.sigma], "player1"
-        )
-        rating_p2 = self.model.create_rating(
-            [player2.user.mu, player2.user.sigma], "player2"
+        if len(filtered_players) != 2:
+            log.error("Player was in queue but not in player manager")
+            return
+
+        # the result is written with the rating updates (see update_ratings)
+        game = self.game_manager.start_game(
+            filtered_players, store_result=not self._store_results
         )
-        draw_prob = self.model.predict_draw([[rating_p1], [rating_p2]])
-        return draw_prob + waiting_bonus
+        game.add_finish_callback(self._end_game)
 
     def _end_game(self, game: IGame) -> None:
         """
-        Readds players to queue after game has ended.
+        Collects the result of a finished game.
+
+        The ratings are updated and the players are queued again right after the
+        current reactor iteration, together with all other games that finished in
+        it (see :meth:`update_ratings`).
 
         Args:
             game (IGame): The game to be ended.
         """
-        # update elo values
         result = game.get_result()
         if result is not None:
-            mu_p1, sigma_p1 = self.player_manager.get_matchmaking_parameters(
-                result.user1_id
+            self._finished_games.add(
+                rating.GameOutcome(
+                    result.user1_id,
+                    result.user2_id,
+                    result.score_user_1,
+                    result.score_user_2,
+                    str(result.game_id),
+                )
             )
-            mu_p2, sigma_p2 = self.player_manager.get_matchmaking_parameters(
-                result.user2_id
+            if self._store_results:
+                self._finished_results.append(result)
+        self._finished_players.extend(p.id for p in game.players.values())
+        if self._requeue_call is None:
+            self._requeue_call = reactor.callLater(  # type: ignore[attr-defined]
+                0, self._requeue_finished_players
             )
-            rating_p1 = self.model.create_rating([mu_p1, sigma_p1], "player1")
-            rating_p2 = self.model.create_rating([mu_p2, sigma_p2], "player2")
-            [[p1], [p2]] = self.model.rate(
-                [[rating_p1], [rating_p2]],
-                scores=[result.score_user_1, result.score_user_2],
-            )
-            self.player_manager.update_matchmaking_parameters(
-                result.user1_id, p1.mu, p1.sigma
-            )
-            self.player_manager.update_matchmaking_parameters(
-                result.user2_id, p2.mu, p2.sigma
+
+    def update_ratings(self) -> None:
+        """
+        Updates the ratings of the players of all games finished since last call.
+
+        The game results, rating updates and rating history entries are written in
+        the same transaction.
+        """
+        if not (self._finished_games or self._finished_results):
+            return
+        results, self._finished_results = self._finished_results, []
+        ratings: dict[int, tuple[float, float]] = {}
+        history: list[RatingHistoryEntry] = []
+        try:
+            with profiling.span("rating_updates"):
+                ratings, history = self._finished_games.apply(
+                    self.player_manager.get_matchmaking_parameters
+                )
+        finally:
+            # If the rating fails, the results are written anyway and the games are
+            # rated in the next update.
+            self.player_manager.update_all_matchmaking_parameters(
+                ratings, history, results
             )
 
-        for _, p in game.players.items():
-            self.try_match(p.id)
+    def _requeue_finished_players(self) -> None:
+        """Updates the ratings and readds the players of finished games to the queue."""
+        self._requeue_call = None
+        try:
+            self.update_ratings()
+        except Exception:
+            # the players are queued anyway, the games are rated in the next update
+            log.exception("Failed to update the ratings")
+        players, self._finished_players = self._finished_players, []
+        for player_id in players:
+            self.try_match(player_id)
@@ -0,0 +1,706 @@
+"""
+Vectorized computation of match qualities for the matchmaking.
+
+Instead of rating every pair of queued players individually, the match quality of all
+pairs is computed at once as a matrix.
+"""
+
+from __future__ import annotations
+
+import enum
+import math
+from statistics import NormalDist
+
+import numpy as np
+
+# The inverse normal CDF is only needed once per player and update, so the
+# element-wise function of the standard library is fast enough.
+ndtri = np.vectorize(NormalDist().inv_cdf, otypes=[float])
+
+# Coefficients of the Chebyshev approximation of erfc (Numerical Recipes, erfcc)
+_ERFC_COEFFICIENTS = (
+    -1.26551223,
+    1.00002368,
+    0.37409196,
+    0.09678418,
+    -0.18628806,
+    0.27886807,
+    -1.13520398,
+    1.48851587,
+    -0.82215223,
+    0.17087277,
+)
+
+
+def erf(x: np.ndarray) -> np.ndarray:
+    """
+    Element-wise error function.
+
+    Unlike :func:`math.erf`, this works on whole arrays.  The absolute error is below
+    1e-7.
+    """
+    z = np.abs(x)
+    t = 1 / (1 + 0.5 * z)
+    poly = np.full_like(t, _ERFC_COEFFICIENTS[-1])
+    for coefficient in reversed(_ERFC_COEFFICIENTS[:-1]):
+        poly = poly * t + coefficient
+    erfc = t * np.exp(-z * z + poly)
+    return np.where(x >= 0, 1 - erfc, erfc - 1)
+
+
+class MatchingStrategy(enum.Enum):
+    """
+    Strategies for selecting matches from the queue.
+
+    Attributes:
+        FIRST_FIT: Match each player (in queue order) with the first possible opponent.
+            Fast and fair to players waiting at the front of the queue.
+        MAX_WEIGHT: Select the matches such that the total match quality is maximized
+            (approximately, by greedily taking the best remaining pair).  Leads to
+            better matches but players waiting longer are not preferred directly (only
+            via the waiting bonus).
+    """
+
+    FIRST_FIT = "first_fit"
+    MAX_WEIGHT = "max_weight"
+
+
+def draw_probability(
+    mu1: np.ndarray,
+    sigma1: np.ndarray,
+    mu2: np.ndarray,
+    sigma2: np.ndarray,
+    beta: float,
+) -> np.ndarray:
+    """
+    Computes the draw probability of all pairs of players from two groups.
+
+    This is the closed form of ``PlackettLuce.predict_draw`` of openskill for two
+    teams with one player each.
+
+    Args:
+        mu1: Mean rating of the players of the first group (shape ``(n,)``).
+        sigma1: Rating uncertainty of the players of the first group (shape ``(n,)``).
+        mu2: Mean rating of the players of the second group (shape ``(m,)``).
+        sigma2: Rating uncertainty of the players of the second group (shape
+            ``(m,)``).
+        beta: The ``beta`` parameter of the PlackettLuce model.
+
+    Returns:
+        Matrix of shape ``(n, m)`` with the draw probability of player i of the first
+        and player j of the second group at position (i, j).
+    """
+    c = np.sqrt(2 * beta**2 + sigma1[:, np.newaxis] ** 2 + sigma2[np.newaxis, :] ** 2)
+    return _draw_probability(mu1[:, np.newaxis] - mu2[np.newaxis, :], c, beta)
+
+
+def _draw_margin(beta: float) -> float:
+    # For two players, openskill uses a draw margin of sqrt(2) * beta * Phi^-1(3/4)
+    return math.sqrt(2) * beta * NormalDist().inv_cdf(0.75)
+
+
+def _draw_probability(delta: np.ndarray, c: np.ndarray, beta: float) -> np.ndarray:
+    """Element-wise draw probability given the mu difference and combined deviation."""
+    draw_margin = _draw_margin(beta)
+    # Phi(x) - Phi(-x) = erf(x / sqrt(2)), summed over both orders of the players
+    scale = c * math.sqrt(2)
+    return np.abs(
+        erf((draw_margin - delta) / scale) + erf((draw_margin + delta) / scale)
+    )
+
+
+def draw_probability_matrix(
+    mu: np.ndarray, sigma: np.ndarray, beta: float
+) -> np.ndarray:
+    """
+    Computes the draw probability of all pairs of players.
+
+    Args:
+        mu: Mean rating of the players (shape ``(n,)``).
+        sigma: Rating uncertainty of the players (shape ``(n,)``).
+        beta: The ``beta`` parameter of the PlackettLuce model.
+
+    Returns:
+        Matrix of shape ``(n, n)`` with the draw probability of players i and j at
+        position (i, j).
+    """
+    return draw_probability(mu, sigma, mu, sigma, beta)
+
+
+def waiting_bonus_matrix(
+    waiting_time: np.ndarray, percental_time_bonus: float
+) -> np.ndarray:
+    """
+    Computes the bonus that is added to the match quality of players waiting long.
+
+    Args:
+        waiting_time: Time the players are waiting in the queue in seconds (shape
+            ``(n,)``).
+        percental_time_bonus: Bonus per minute of combined waiting time (after the
+            first minute).
+
+    Returns:
+        Matrix of shape ``(n, n)`` with the bonus of players i and j at (i, j).
+    """
+    combined_waiting_time = waiting_time[:, np.newaxis] + waiting_time[np.newaxis, :]
+    return np.maximum(0.0, (combined_waiting_time / 60 - 1) * percental_time_bonus)
+
+
+def allowed_pairs_mask(user_ids: np.ndarray, is_bot: np.ndarray) -> np.ndarray:
+    """
+    Computes which players are allowed to play against each other.
+
+    Users are not matched against themselves and bots are not matched against bots.
+
+    Args:
+        user_ids: User IDs of the players (shape ``(n,)``).
+        is_bot: Whether the player is a bot (shape ``(n,)``).
+
+    Returns:
+        Boolean matrix of shape ``(n, n)``.
+    """
+    same_user = user_ids[:, np.newaxis] == user_ids[np.newaxis, :]
+    both_bots = is_bot[:, np.newaxis] & is_bot[np.newaxis, :]
+    return ~(same_user | both_bots)
+
+
+def eligible_at(
+    draw_prob: np.ndarray,
+    queued_at_sum: np.ndarray,
+    threshold: float,
+    percental_time_bonus: float,
+) -> np.ndarray:
+    """
+    Computes from when on the match quality of pairs of players is above a threshold.
+
+    The match quality ``draw_prob + max(0, (waiting_time / 60 - 1) * bonus)`` (see
+    :func:`waiting_bonus_matrix`) only increases with time, so a pair is matchable
+    at ``now`` if and only if ``now > eligible_at``.
+
+    Args:
+        draw_prob: Draw probability of the pairs.
+        queued_at_sum: Sum of the times the two players joined the queue (in
+            seconds, same shape as ``draw_prob``).
+        threshold: Match quality threshold.
+        percental_time_bonus: Bonus per minute of combined waiting time (after the
+            first minute).
+
+    Returns:
+        Time from which on the pairs are matchable (-inf if they are matchable right
+        away, inf if never).
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # combined waiting time 2 * now - queued_at_sum has to be larger than this
+        min_waiting_time = 60 * (1 + (threshold - draw_prob) / percental_time_bonus)
+    if percental_time_bonus <= 0:
+        min_waiting_time = np.full_like(draw_prob, np.inf)
+    result = (queued_at_sum + min_waiting_time) / 2
+    return np.where(draw_prob > threshold, -np.inf, result)
+
+
+class PairQualityCache:
+    """
+    Match qualities of the queued players, updated incrementally.
+
+    The draw probability of two players only depends on their ratings, which don't
+    change while they are in the queue, and the waiting bonus only depends on when
+    they joined the queue.  So instead of rating all pairs in every update, only the
+    pairs of newly queued players are rated (``O(new * queue)``) and for each pair,
+    the time from which on it is matchable is computed once (see
+    :func:`eligible_at`).
+
+    The rows/columns of the matrices are in the order in which the players were
+    added.
+    """
+
+    def __init__(self, beta: float) -> None:
+        """
+        Initializes an empty cache.
+
+        Args:
+            beta: The ``beta`` parameter of the PlackettLuce model.
+        """
+        self.beta = beta
+        #: Keys identifying the queue entries (in the order of the rows)
+        self.keys: list = []
+        self.mu = np.zeros(0)
+        self.sigma = np.zeros(0)
+        #: Time the players joined the queue (in seconds)
+        self.queued_at = np.zeros(0)
+        self.draw_prob = np.zeros((0, 0))
+        self.allowed = np.zeros((0, 0), dtype=bool)
+        self.eligible_at = np.zeros((0, 0))
+        self._user_ids = np.zeros(0, dtype=int)
+        self._is_bot = np.zeros(0, dtype=bool)
+        self._threshold = 0.0
+        self._percental_time_bonus = 0.0
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def set_parameters(self, threshold: float, percental_time_bonus: float) -> bool:
+        """
+        Sets the matchmaking parameters (and updates the eligibility if they changed).
+
+        Returns:
+            Whether the parameters changed.
+        """
+        if (threshold, percental_time_bonus) == (
+            self._threshold,
+            self._percental_time_bonus,
+        ):
+            return False
+        self._threshold = threshold
+        self._percental_time_bonus = percental_time_bonus
+        self.eligible_at = eligible_at(
+            self.draw_prob,
+            self.queued_at[:, np.newaxis] + self.queued_at[np.newaxis, :],
+            threshold,
+            percental_time_bonus,
+        )
+        return True
+
+    def keep(self, mask: np.ndarray) -> None:
+        """Removes the players for which ``mask`` is False."""
+        self.keys = [key for key, keep in zip(self.keys, mask, strict=True) if keep]
+        self.mu = self.mu[mask]
+        self.sigma = self.sigma[mask]
+        self.queued_at = self.queued_at[mask]
+        self._user_ids = self._user_ids[mask]
+        self._is_bot = self._is_bot[mask]
+        index = np.ix_(mask, mask)
+        self.draw_prob = self.draw_prob[index]
+        self.allowed = self.allowed[index]
+        self.eligible_at = self.eligible_at[index]
+
+    def add(
+        self,
+        keys: list,
+        mu: np.ndarray,
+        sigma: np.ndarray,
+        queued_at: np.ndarray,
+        user_ids: np.ndarray,
+        is_bot: np.ndarray,
+    ) -> None:
+        """
+        Adds players (behind the players already in the cache).
+
+        Args:
+            keys: Keys identifying the players.
+            mu: Mean rating of the players.
+            sigma: Rating uncertainty of the players.
+            queued_at: Time the players joined the queue (in seconds).
+            user_ids: User IDs of the players.
+            is_bot: Whether the players are bots.
+        """
+        if not keys:
+            return
+        self.keys = self.keys + list(keys)
+        self.mu = np.concatenate([self.mu, mu])
+        self.sigma = np.concatenate([self.sigma, sigma])
+        self.queued_at = np.concatenate([self.queued_at, queued_at])
+        self._user_ids = np.concatenate([self._user_ids, user_ids])
+        self._is_bot = np.concatenate([self._is_bot, is_bot])
+
+        # rows of the new players (against all players, including themselves)
+        draw_prob = draw_probability(mu, sigma, self.mu, self.sigma, self.beta)
+        allowed = ~(
+            (user_ids[:, np.newaxis] == self._user_ids[np.newaxis, :])
+            | (is_bot[:, np.newaxis] & self._is_bot[np.newaxis, :])
+        )
+        rows_eligible_at = eligible_at(
+            draw_prob,
+            queued_at[:, np.newaxis] + self.queued_at[np.newaxis, :],
+            self._threshold,
+            self._percental_time_bonus,
+        )
+
+        self.draw_prob = self._extend(self.draw_prob, draw_prob)
+        self.allowed = self._extend(self.allowed, allowed)
+        self.eligible_at = self._extend(self.eligible_at, rows_eligible_at)
+
+    @staticmethod
+    def _extend(matrix: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        # all matrices are symmetric, so the new columns are the transposed rows
+        n = matrix.shape[0]
+        result = np.empty((rows.shape[1], rows.shape[1]), dtype=matrix.dtype)
+        result[:n, :n] = matrix
+        result[n:, :] = rows
+        result[:n, n:] = rows[:, :n].T
+        return result
+
+    def matchable(self, now: float) -> np.ndarray:
+        """Returns which pairs can be matched at the given time."""
+        return (self.eligible_at < now) & self.allowed
+
+    def next_eligible_at(self) -> float:
+        """Returns the earliest time at which an allowed pair becomes matchable."""
+        if not self.allowed.any():
+            return np.inf
+        return float(self.eligible_at[self.allowed].min())
+
+    def match_quality(self, now: float) -> np.ndarray:
+        """Returns the match quality of all pairs at the given time."""
+        return self.draw_prob + waiting_bonus_matrix(
+            now - self.queued_at, self._percental_time_bonus
+        )
+
+    def pair_match_quality(
+        self, rows: np.ndarray, cols: np.ndarray, now: float
+    ) -> np.ndarray:
+        """Returns the match quality of the pairs (rows[k], cols[k]) at a given time."""
+        waiting_time = now - self.queued_at
+        return self.draw_prob[rows, cols] + np.maximum(
+            0.0,
+            ((waiting_time[rows] + waiting_time[cols]) / 60 - 1)
+            * self._percental_time_bonus,
+        )
+
+
+def rating_window(
+    sigma: np.ndarray,
+    sigma_range: tuple[float, float],
+    required_draw_prob: np.ndarray,
+    beta: float,
+    iterations: int = 20,
+) -> np.ndarray:
+    """
+    Computes how much the mu of a possible opponent may differ at most.
+
+    The draw probability ``2 * (Phi((d + m) / c) - Phi((d - m) / c))`` (with mu
+    difference ``d``, draw margin ``m`` and ``c = sqrt(2 * beta^2 + sigma1^2 +
+    sigma2^2)``) decreases with ``d``.  As a function of ``c``, it has a single
+    maximum at ``c* = sqrt(2 * d * m / ln((d + m) / (d - m)))`` (for ``d > m``,
+    otherwise it decreases with ``c``), so its maximum over all possible opponents
+    is known in closed form and the window is found by bisection.  The window is
+    conservative: no opponent outside of it can have a draw probability above
+    ``required_draw_prob``.
+
+    Args:
+        sigma: Rating uncertainty of the players (shape ``(n,)``).
+        sigma_range: Smallest and largest rating uncertainty of the opponents.
+        required_draw_prob: Draw probability a match needs to exceed (shape
+            ``(n,)``).
+        beta: The ``beta`` parameter of the PlackettLuce model.
+        iterations: Number of bisection steps.
+
+    Returns:
+        Maximal mu difference (inf if every opponent is possible, negative if no
+        opponent is possible).
+    """
+    margin = _draw_margin(beta)
+    window = np.full(len(sigma), np.inf)
+    limited = required_draw_prob > 0
+    # the draw probability of two players is at most 1 (as c >= sqrt(2) * beta)
+    required = np.minimum(required_draw_prob[limited], 1.0)
+    c_min = np.sqrt(2 * beta**2 + sigma[limited] ** 2 + sigma_range[0] ** 2)
+    c_max = np.sqrt(2 * beta**2 + sigma[limited] ** 2 + sigma_range[1] ** 2)
+
+    def max_draw_probability(d: np.ndarray) -> np.ndarray:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            c_peak = np.sqrt(2 * d * margin / np.log((d + margin) / (d - margin)))
+        c = np.clip(np.where(d > margin, c_peak, c_min), c_min, c_max)
+        return _draw_probability(d, c, beta)
+
+    # Start with the tail bound 2 * P(c * Z > d - m) of the draw probability.
+    # Invariant: no mu difference >= high is possible.
+    low = np.zeros_like(required)
+    high = margin + c_max * ndtri(1 - required / 2)
+    for _ in range(iterations):
+        middle = (low + high) / 2
+        possible = max_draw_probability(middle) > required
+        low = np.where(possible, middle, low)
+        high = np.where(possible, high, middle)
+
+    # small tolerance for rounding errors
+    window[limited] = high * (1 + 1e-9) + 1e-9
+    window[required_draw_prob >= 1] = -1.0
+    return window
+
+
+class RatingIndex:
+    """
+    Queued players sorted by their rating, for large queues.
+
+    Instead of rating all pairs of players, only opponents with a similar mu are
+    rated (see :func:`rating_window`).  The window around each player is chosen
+    conservatively, so exactly the same pairs are found as by rating all pairs, and
+    widens as the players wait longer (due to the waiting bonus).
+
+    The arrays are sorted by mu.
+    """
+
+    def __init__(self, beta: float) -> None:
+        """
+        Initializes an empty index.
+
+        Args:
+            beta: The ``beta`` parameter of the PlackettLuce model.
+        """
+        self.beta = beta
+        #: Keys identifying the queue entries (sorted by mu)
+        self.keys: list = []
+        self.mu = np.zeros(0)
+        self.sigma = np.zeros(0)
+        #: Time the players joined the queue (in seconds)
+        self.queued_at = np.zeros(0)
+        self._user_ids = np.zeros(0, dtype=int)
+        self._is_bot = np.zeros(0, dtype=bool)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def keep(self, mask: np.ndarray) -> None:
+        """Removes the players for which ``mask`` is False."""
+        self.keys = [key for key, keep in zip(self.keys, mask, strict=True) if keep]
+        self.mu = self.mu[mask]
+        self.sigma = self.sigma[mask]
+        self.queued_at = self.queued_at[mask]
+        self._user_ids = self._user_ids[mask]
+        self._is_bot = self._is_bot[mask]
+
+    def add(
+        self,
+        keys: list,
+        mu: np.ndarray,
+        sigma: np.ndarray,
+        queued_at: np.ndarray,
+        user_ids: np.ndarray,
+        is_bot: np.ndarray,
+    ) -> None:
+        """
+        Adds players.
+
+        Args:
+            keys: Keys identifying the players.
+            mu: Mean rating of the players.
+            sigma: Rating uncertainty of the players.
+            queued_at: Time the players joined the queue (in seconds).
+            user_ids: User IDs of the players.
+            is_bot: Whether the players are bots.
+        """
+        if not keys:
+            return
+        order = np.argsort(mu, kind="stable")
+        positions = np.searchsorted(self.mu, mu[order], side="right")
+        keys_sorted = [keys[i] for i in order]
+        merged: list = []
+        start = 0
+        for position, key in zip(positions.tolist(), keys_sorted, strict=True):
+            merged.extend(self.keys[start:position])
+            merged.append(key)
+            start = position
+        merged.extend(self.keys[start:])
+        self.keys = merged
+
+        self.mu = np.insert(self.mu, positions, mu[order])
+        self.sigma = np.insert(self.sigma, positions, sigma[order])
+        self.queued_at = np.insert(self.queued_at, positions, queued_at[order])
+        self._user_ids = np.insert(self._user_ids, positions, user_ids[order])
+        self._is_bot = np.insert(self._is_bot, positions, is_bot[order])
+
+    def matchable_pairs(
+        self, now: float, threshold: float, percental_time_bonus: float
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Finds all pairs of players whose match quality is above the threshold.
+
+        Args:
+            now: Current time (in seconds).
+            threshold: Match quality threshold.
+            percental_time_bonus: Bonus per minute of combined waiting time (after the
+                first minute).
+
+        Returns:
+            Positions (in the index) ``i < j`` of the players of each pair and the
+            match quality of the pairs.
+        """
+        n = len(self)
+        if n < 2:
+            empty = np.zeros(0, dtype=int)
+            return empty, empty, np.zeros(0)
+
+        # the largest bonus a player can get is with the longest waiting opponent
+        waiting_time = now - self.queued_at
+        max_bonus = np.maximum(
+            0.0,
+            ((waiting_time + waiting_time.max()) / 60 - 1) * percental_time_bonus,
+        )
+        window = rating_window(
+            self.sigma,
+            (float(self.sigma.min()), float(self.sigma.max())),
+            threshold - max_bonus,
+            self.beta,
+        )
+        # the window of a player contains all possible opponents, so it is enough to
+        # look at the opponents with a higher mu (i.e. behind the player in the index)
+        start = np.arange(n) + 1
+        end = np.searchsorted(self.mu, self.mu + window, side="right")
+        counts = np.maximum(end - start, 0)
+
+        i = np.repeat(np.arange(n), counts)
+        # j runs from start[i] to end[i] - 1 for each i
+        offsets = np.arange(len(i)) - np.repeat(np.cumsum(counts) - counts, counts)
+        j = np.repeat(start, counts) + offsets
+
+        # only rate the allowed pairs
+        allowed = (self._user_ids[i] != self._user_ids[j]) & ~(
+            self._is_bot[i] & self._is_bot[j]
+        )
+        i, j = i[allowed], j[allowed]
+
+        c = np.sqrt(2 * self.beta**2 + self.sigma[i] ** 2 + self.sigma[j] ** 2)
+        quality = _draw_probability(self.mu[i] - self.mu[j], c, self.beta)
+        quality += np.maximum(
+            0.0, ((waiting_time[i] + waiting_time[j]) / 60 - 1) * percental_time_bonus
+        )
+        matchable = quality > threshold
+        return i[matchable], j[matchable], quality[matchable]
+
+
+def first_fit_matches(
+    matchable: np.ndarray, min_queue_length: int = 0
+) -> list[tuple[int, int]]:
+    """
+    Selects matches greedily in queue order.
+
+    Each player (in queue order) is matched with the first player behind them in the
+    queue that is not yet matched and with whom a match is possible.
+
+    Args:
+        matchable: Boolean matrix of shape ``(n, n)`` indicating which pairs can be
+            matched.  Only the upper triangle (i < j) is used.
+        min_queue_length: Stop matching as soon as less players than this are left in
+            the queue.
+
+    Returns:
+        List of matched pairs of indices (i, j) with i < j.
+    """
+    n = matchable.shape[0]
+    candidates = np.triu(matchable, k=1)
+    available = np.ones(n, dtype=bool)
+    matches: list[tuple[int, int]] = []
+
+    # only rows that have any candidate at all need to be looked at
+    for i in np.flatnonzero(candidates.any(axis=1)):
+        if not available[i]:
+            continue
+        js = np.flatnonzero(candidates[i] & available)
+        if js.size == 0:
+            continue
+
+        j = int(js[0])
+        available[i] = available[j] = False
+        matches.append((int(i), j))
+
+        if n - 2 * len(matches) < min_queue_length:
+            break
+
+    return matches
+
+
+def max_weight_matches(
+    match_quality: np.ndarray, matchable: np.ndarray, min_queue_length: int = 0
+) -> list[tuple[int, int]]:
+    """
+    Selects matches such that the total match quality is high.
+
+    Pairs are selected greedily by descending match quality, which results in a
+    matching with at least half the weight of a maximum-weight matching.
+
+    Args:
+        match_quality: Matrix of shape ``(n, n)`` with the match quality of all pairs.
+        matchable: Boolean matrix of shape ``(n, n)`` indicating which pairs can be
+            matched.  Only the upper triangle (i < j) is used.
+        min_queue_length: Stop matching as soon as less players than this are left in
+            the queue.
+
+    Returns:
+        List of matched pairs of indices (i, j) with i < j.
+    """
+    rows, cols = np.nonzero(np.triu(matchable, k=1))
+    # stable sort, so that for equal quality, pairs earlier in the queue are preferred
+    order = np.argsort(-match_quality[rows, cols], kind="stable")
+    return _greedy_matches(
+        rows[order], cols[order], matchable.shape[0], min_queue_length
+    )
+
+
+def _greedy_matches(
+    rows: np.ndarray, cols: np.ndarray, n: int, min_queue_length: int
+) -> list[tuple[int, int]]:
+    """Takes the given pairs in order, skipping pairs with already matched players."""
+    available = np.ones(n, dtype=bool)
+    matches: list[tuple[int, int]] = []
+
+    for i, j in zip(rows.tolist(), cols.tolist(), strict=True):
+        if not (available[i] and available[j]):
+            continue
+
+        available[i] = available[j] = False
+        matches.append((i, j))
+
+        if n - 2 * len(matches) < min_queue_length:
+            break
+
+    return matches
+
+
+def select_matches(
+    strategy: MatchingStrategy,
+    match_quality: np.ndarray,
+    matchable: np.ndarray,
+    min_queue_length: int = 0,
+) -> list[tuple[int, int]]:
+    """
+    Selects matches using the given strategy.
+
+    Args:
+        strategy: The strategy to use.
+        match_quality: Matrix of shape ``(n, n)`` with the match quality of all pairs.
+        matchable: Boolean matrix of shape ``(n, n)`` indicating which pairs can be
+            matched.
+        min_queue_length: Stop matching as soon as less players than this are left in
+            the queue.
+
+    Returns:
+        List of matched pairs of indices (i, j) with i < j.
+    """
+    if strategy == MatchingStrategy.MAX_WEIGHT:
+        return max_weight_matches(match_quality, matchable, min_queue_length)
+    return first_fit_matches(matchable, min_queue_length)
+
+
+def select_matches_from_pairs(
+    strategy: MatchingStrategy,
+    rows: np.ndarray,
+    cols: np.ndarray,
+    match_quality: np.ndarray | None,
+    n: int,
+    min_queue_length: int = 0,
+) -> list[tuple[int, int]]:
+    """
+    Selects matches from a list of matchable pairs using the given strategy.
+
+    Gives the same result as :func:`select_matches` with the corresponding matrices
+    but does not need all pairs to be rated (see :class:`RatingIndex`).
+
+    Args:
+        strategy: The strategy to use.
+        rows: Queue position of the first player of each pair.
+        cols: Queue position of the second player of each pair (``rows < cols``).
+        match_quality: Match quality of the pairs (only needed for
+            ``MatchingStrategy.MAX_WEIGHT``).
+        n: Length of the queue.
+        min_queue_length: Stop matching as soon as less players than this are left in
+            the queue.
+
+    Returns:
+        List of matched pairs of indices (i, j) with i < j.
+    """
+    # in queue order (the order of the pairs in the upper triangle of the matrix)
+    order = np.lexsort((cols, rows))
+    if strategy == MatchingStrategy.MAX_WEIGHT:
+        assert match_quality is not None
+        order = order[np.argsort(-match_quality[order], kind="stable")]
+    return _greedy_matches(rows[order], cols[order], n, min_queue_length)
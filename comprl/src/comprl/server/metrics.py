@@ -0,0 +1,383 @@
+"""
+Server metrics in the Prometheus text format.
+
+The metrics are collected in a global :data:`REGISTRY` and are served over HTTP (from
+the reactor of the server) if ``metrics_port`` is set in the config::
+
+    curl http://localhost:<metrics_port>/metrics
+
+Only what is needed by the server is implemented (counters with at most one label,
+gauges and histograms), so there is no dependency on ``prometheus_client``.
+Counters and histograms may be updated from any thread.
+"""
+
+from __future__ import annotations
+
+import bisect
+import logging as log
+import math
+import threading
+from typing import Callable, Iterable
+
+from twisted.internet import reactor
+from twisted.internet.task import LoopingCall
+from twisted.web.resource import Resource
+from twisted.web.server import Site
+
+#: Default histogram buckets (in seconds)
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+def _format_labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        k
+        + '="'
+        + v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        + '"'
+        for k, v in labels.items()
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+class Metric:
+    """Base class of the metrics."""
+
+    type_name = ""
+
+    def __init__(self, name: str, help: str) -> None:
+        """
+        Initializes the metric.
+
+        Args:
+            name: Name of the metric.
+            help: Description of the metric.
+        """
+        self.name = name
+        self.help = help
+        self._lock = threading.Lock()
+
+    def samples(self) -> Iterable[tuple[str, dict[str, str], float]]:
+        """Returns the samples (name, labels, value) of the metric."""
+        raise NotImplementedError
+
+    def render(self) -> str:
+        """Returns the metric in the Prometheus text format."""
+        lines = [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+class Counter(Metric):
+    """A value that only increases, optionally split by the value of one label."""
+
+    type_name = "counter"
+
+    def __init__(self, name: str, help: str, label: str | None = None) -> None:
+        """
+        Initializes the counter.
+
+        Args:
+            name: Name of the metric.
+            help: Description of the metric.
+            label: Name of the label (if any).
+        """
+        super().__init__(name, help)
+        self.label = label
+        self._values: dict[str, float] = {} if label else {"": 0.0}
+
+    def inc(self, amount: float = 1.0, label: str = "") -> None:
+        """Increases the counter (of the given label value)."""
+        with self._lock:
+            self._values[label] = self._values.get(label, 0.0) + amount
+
+    def get(self, label: str = "") -> float:
+        """Returns the value of the counter (of the given label value)."""
+        with self._lock:
+            return self._values.get(label, 0.0)
+
+    def samples(self):
+        """Returns the samples (name, labels, value) of the metric."""
+        with self._lock:
+            values = dict(self._values)
+        for label, value in sorted(values.items()):
+            yield (
+                f"{self.name}_total",
+                {self.label: label} if self.label else {},
+                value,
+            )
+
+
+class Gauge(Metric):
+    """A value that can go up and down, or is computed when the metrics are read."""
+
+    type_name = "gauge"
+
+    def __init__(self, name: str, help: str) -> None:
+        """
+        Initializes the gauge.
+
+        Args:
+            name: Name of the metric.
+            help: Description of the metric.
+        """
+        super().__init__(name, help)
+        self._value = 0.0
+        self._function: Callable[[], float] | None = None
+
+    def set(self, value: float) -> None:
+        """Sets the value."""
+        self._value = value
+
+    def set_function(self, function: Callable[[], float] | None) -> None:
+        """Computes the value with the given function when the metrics are read."""
+        self._function = function
+
+    def get(self) -> float:
+        """Returns the current value."""
+        if self._function is not None:
+            return float(self._function())
+        return self._value
+
+    def samples(self):
+        """Returns the samples (name, labels, value) of the metric."""
+        yield self.name, {}, self.get()
+
+
+class Histogram(Metric):
+    """Distribution of observed values (e.g. durations) in cumulative buckets."""
+
+    type_name = "histogram"
+
+    def __init__(
+        self, name: str, help: str, buckets: Iterable[float] = LATENCY_BUCKETS
+    ) -> None:
+        """
+        Initializes the histogram.
+
+        Args:
+            name: Name of the metric.
+            help: Description of the metric.
+            buckets: Upper bounds of the buckets.
+        """
+        super().__init__(name, help)
+        self.buckets = sorted(buckets)
+        # the last bucket is +Inf
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+
+    def observe(self, value: float) -> None:
+        """Adds an observation."""
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    @property
+    def count(self) -> int:
+        """Number of observations."""
+        with self._lock:
+            return sum(self._counts)
+
+    def samples(self):
+        """Returns the samples (name, labels, value) of the metric."""
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        cumulative = 0
+        for bound, count in zip([*self.buckets, math.inf], counts, strict=True):
+            cumulative += count
+            yield f"{self.name}_bucket", {"le": _format_value(bound)}, cumulative
+        yield f"{self.name}_sum", {}, total
+        yield f"{self.name}_count", {}, cumulative
+
+
+class Registry:
+    """Collection of metrics."""
+
+    def __init__(self) -> None:
+        self.metrics: dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        """Adds a metric.
+
+        Raises:
+            ValueError: If a metric with the same name is already registered.
+        """
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, label: str | None = None) -> Counter:
+        """Creates and registers a counter."""
+        metric = Counter(name, help, label)
+        self.register(metric)
+        return metric
+
+    def gauge(self, name: str, help: str) -> Gauge:
+        """Creates and registers a gauge."""
+        metric = Gauge(name, help)
+        self.register(metric)
+        return metric
+
+    def histogram(
+        self, name: str, help: str, buckets: Iterable[float] = LATENCY_BUCKETS
+    ) -> Histogram:
+        """Creates and registers a histogram."""
+        metric = Histogram(name, help, buckets)
+        self.register(metric)
+        return metric
+
+    def render(self) -> str:
+        """Returns all metrics in the Prometheus text format."""
+        return "".join(metric.render() for metric in self.metrics.values())
+
+
+#: Metrics of the server
+REGISTRY = Registry()
+
+CONNECTED_PLAYERS = REGISTRY.gauge(
+    "comprl_connected_players", "Number of connected players."
+)
+AUTHENTICATED_PLAYERS = REGISTRY.gauge(
+    "comprl_authenticated_players", "Number of authenticated players."
+)
+QUEUE_LENGTH = REGISTRY.gauge(
+    "comprl_queue_length", "Number of players in the matchmaking queue."
+)
+ACTIVE_GAMES = REGISTRY.gauge("comprl_active_games", "Number of running games.")
+GAMES_FINISHED = REGISTRY.counter(
+    "comprl_games_finished",
+    "Number of finished games by end state.",
+    label="end_state",
+)
+STEP_LATENCY = REGISTRY.histogram(
+    "comprl_step_latency_seconds",
+    "Round-trip time of step requests (observation sent until action received).",
+)
+MATCHMAKING_DURATION = REGISTRY.histogram(
+    "comprl_matchmaking_duration_seconds", "Duration of a matchmaking update."
+)
+DB_WRITE_DURATION = REGISTRY.histogram(
+    "comprl_db_write_duration_seconds",
+    "Duration of writing a batch of game results and rating updates.",
+)
+REPLAY_WRITE_DURATION = REGISTRY.histogram(
+    "comprl_replay_write_duration_seconds", "Duration of writing a replay file."
+)
+REACTOR_LAG = REGISTRY.histogram(
+    "comprl_reactor_lag_seconds",
+    "Delay of timed calls in the reactor (i.e. how long the event loop is blocked).",
+)
+
+
+class MetricsResource(Resource):
+    """HTTP resource serving the metrics."""
+
+    isLeaf = True
+
+    def __init__(self, registry: Registry) -> None:
+        super().__init__()
+        self.registry = registry
+
+    def render_GET(self, request):
+        """Returns the metrics."""
+        request.setHeader(b"Content-Type", b"text/plain; version=0.0.4; charset=utf-8")
+        return self.registry.render().encode()
+
+
+class ReactorLagMonitor:
+    """Measures how much later than scheduled a periodic call is run."""
+
+    def __init__(
+        self,
+        histogram: Histogram,
+        interval: float = 0.5,
+        warn_threshold: float | None = None,
+    ) -> None:
+        """
+        Initializes the monitor.
+
+        Args:
+            histogram: Histogram to record the lag in.
+            interval: Interval of the measurements in seconds.
+            warn_threshold: If set, a warning is logged when the lag exceeds this
+                value (in seconds).
+        """
+        self.histogram = histogram
+        self.interval = interval
+        self.warn_threshold = warn_threshold
+        self._expected = 0.0
+        self._loop = LoopingCall(self._measure)
+
+    def start(self) -> None:
+        """Starts the measurements."""
+        self._expected = reactor.seconds() + self.interval  # type: ignore[attr-defined]
+        self._loop.start(self.interval, now=False)
+
+    def _measure(self) -> None:
+        now = reactor.seconds()  # type: ignore[attr-defined]
+        lag = max(0.0, now - self._expected)
+        self.histogram.observe(lag)
+        if self.warn_threshold is not None and lag > self.warn_threshold:
+            log.warning("Reactor was blocked for %.3fs", lag)
+        self._expected = now + self.interval
+
+
+_reactor_lag_monitor: ReactorLagMonitor | None = None
+
+
+def start_reactor_lag_monitor(warn_threshold: float | None = None) -> None:
+    """Starts measuring the reactor lag (if it is not running yet).
+
+    Args:
+        warn_threshold: If set, a warning is logged when the lag exceeds this value
+            (in seconds).
+    """
+    global _reactor_lag_monitor
+    if _reactor_lag_monitor is None:
+        _reactor_lag_monitor = ReactorLagMonitor(REACTOR_LAG)
+        _reactor_lag_monitor.start()
+    if warn_threshold is not None:
+        _reactor_lag_monitor.warn_threshold = warn_threshold
+
+
+def listen(port: int, registry: Registry = REGISTRY) -> None:
+    """Serves the metrics over HTTP and starts measuring the reactor lag.
+
+    Args:
+        port: Port of the HTTP server.
+        registry: The metrics to serve.
+    """
+    root = Resource()
+    root.putChild(b"metrics", MetricsResource(registry))  # type: ignore[arg-type]
+    reactor.listenTCP(port, Site(root))  # type: ignore[attr-defined]
+    start_reactor_lag_monitor()
+    log.info("Serving metrics on http://localhost:%d/metrics", port)
@@ -1,20 +1,45 @@
 """contains the networking components of the server"""
 
 import logging as log
+import socket
+import time
 from typing import Callable, Any
 
+import numpy as np
 from twisted.internet.interfaces import IAddress
 from twisted.internet.protocol import Protocol, ServerFactory
 from twisted.protocols import amp
 from twisted.internet import reactor
 from twisted.internet.task import LoopingCall
 
+from comprl.server import metrics
 from comprl.server.interfaces import IPlayer, IServer
 from comprl.server.config import get_config
-from comprl.shared.commands import Auth, EndGame, Error, Ready, StartGame, Step, Message
+from comprl.server.data.write_behind import shutdown_write_behind_store
+from comprl.server.replays import shutdown_replay_writer
+from comprl.shared.commands import (
+    Auth,
+    EndGame,
+    Error,
+    Ready,
+    StartGame,
+    Step,
+    PackedStep,
+    Message,
+)
 from comprl.shared.types import GameID
 
-VERSION: int = 1
+VERSION: int = 2
+#: Client versions that are still supported by the server.  Clients with version 1 do
+#: not support binary encoding of observations/actions and get the `Step` command.
+COMPATIBLE_VERSIONS: tuple[int, ...] = (1, 2)
+
+
+def _return_action(
+    response: dict, return_callback: Callable[[Any], None], start_time: float
+) -> None:
+    metrics.STEP_LATENCY.observe(time.perf_counter() - start_time)
+    return_callback(response["action"])
 
 
 class COMPServerProtocol(amp.AMP):
@@ -39,6 +64,9 @@ class COMPServerProtocol(amp.AMP):
         self.connection_timeout_callbacks: list[Callable[[Any, Any], None]] = []
         self.connection_error_callbacks: list[Callable[[Any], None]] = []
 
+        #: Protocol version of the client (set during authentication)
+        self.client_version: int | None = None
+
     def add_connection_made_callback(self, callback: Callable[[], None]):
         """adds callback that is executed, when the connection is made
 
@@ -153,7 +181,8 @@ class COMPServerProtocol(amp.AMP):
         """
 
         def callback(res):
-            if res["version"] == VERSION:
+            if res["version"] in COMPATIBLE_VERSIONS:
+                self.client_version = res["version"]
                 return_callback(res["token"].decode())
             else:
                 log.error("Client with wrong version tried to authenticate.")
@@ -195,26 +224,38 @@ class COMPServerProtocol(amp.AMP):
         return self.callRemote(StartGame, game_id=game_id.bytes)
 
     def get_step(
-        self, obv: list[float], return_callback: Callable[[list], None]
+        self, obv: list[float] | np.ndarray, return_callback: Callable[[Any], None]
     ) -> None:
         """
         Sends an observation to the remote client and retrieves the corresponding
         action.
 
+        For clients supporting it, observation and action are sent in binary
+        encoding, in which case the action is passed to ``return_callback`` as NumPy
+        array.  Older clients get the observation as list of floats and return the
+        action as list.
+
+        The answer is not timed out here, this is done by the game (see
+        :meth:`IGame._request_actions`).
+
         Args:
-            obv (list[float]): The observation to send to the client.
-            return_callback (Callable[[list], None]): The callback function to be
+            obv (list[float] | np.ndarray): The observation to send to the client.
+            return_callback (Callable[[Any], None]): The callback function to be
                 called with the retrieved action.
 
         Returns:
             None
         """
-        return (
-            self.callRemote(Step, obv=obv)
-            .addCallback(callback=lambda res: return_callback(res["action"]))
-            .addTimeout(get_config().timeout, reactor, self.connectionTimeout)
-            .addErrback(self.connection_error)
-        )
+        if self.client_version is not None and self.client_version >= 2:
+            d = self.callRemote(PackedStep, obv=obv)
+        else:
+            if isinstance(obv, np.ndarray):
+                obv = obv.tolist()
+            d = self.callRemote(Step, obv=obv)
+
+        return d.addCallback(
+            _return_action, return_callback, time.perf_counter()
+        ).addErrback(self.connection_error)
 
     def notify_end(self, result, stats) -> None:
         """
@@ -400,6 +441,9 @@ class COMPFactory(ServerFactory):
     def stopFactory(self) -> None:
         """Stop the server factory."""
         self.server.on_stop()
+        # make sure all pending data is written before the process exits
+        shutdown_replay_writer()
+        shutdown_write_behind_store()
         super().stopFactory()
 
     def buildProtocol(self, addr: IAddress) -> Protocol | None:
@@ -434,6 +478,33 @@ class COMPFactory(ServerFactory):
         return protocol
 
 
+def listen(server: IServer, port: int, reuse_port: bool = False) -> None:
+    """Listen for client connections.
+
+    Args:
+        server: The server instance handling the connections.
+        port: The port number of the server.
+        reuse_port: Open the port with ``SO_REUSEPORT``, so that several processes can
+            listen on it (the kernel distributes the connections among them).
+    """
+    factory = COMPFactory(server)
+    if not reuse_port:
+        reactor.listenTCP(port, factory)  # type: ignore[attr-defined]
+        return
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind(("", port))
+    sock.listen(50)
+    sock.setblocking(False)
+    reactor.adoptStreamPort(  # type: ignore[attr-defined]
+        sock.fileno(), socket.AF_INET, factory
+    )
+    # the reactor uses a duplicate of the socket
+    sock.close()
+
+
 def launch_server(
     server: IServer, port: int = 65335, update_interval: float = 1.0
 ) -> None:
@@ -448,7 +519,7 @@ def launch_server(
     """
     log.info(f"Launching server on port {port}")
 
-    reactor.listenTCP(port, COMPFactory(server))  # type: ignore[attr-defined]
+    listen(server, port)
 
     # setup and link the on_update event
     LoopingCall(server.on_update).start(update_interval)
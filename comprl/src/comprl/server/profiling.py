@@ -0,0 +1,222 @@
+"""
+Opt-in profiling of the server (enabled with ``profiling = true`` in the config).
+
+When enabled:
+
+- The hot paths of the server (matchmaking, game updates, database access, ...) are
+  wrapped in timing :func:`span` s.  Their durations are recorded as metrics
+  (``comprl_span_<name>_seconds``, see :mod:`comprl.server.metrics`) and spans that
+  take longer than ``profiling_slow_ms`` are logged as warnings.
+- The reactor lag is measured and logged if it exceeds ``profiling_slow_ms``.
+- A sampling profiler of the reactor thread can be switched on and off at runtime by
+  sending ``SIGUSR1`` to the server process.  When it is switched off, the sampled
+  stacks are written to ``<data_dir>/profiles/`` in the "folded" format, which can be
+  turned into a flame graph, e.g. with ``flamegraph.pl`` or speedscope::
+
+      kill -USR1 <pid>   # start sampling
+      kill -USR1 <pid>   # stop sampling and write the profile
+"""
+
+from __future__ import annotations
+
+import collections
+import datetime
+import logging as log
+import os
+import pathlib
+import signal
+import sys
+import threading
+import time
+from types import FrameType
+
+from comprl.server import metrics
+
+_enabled = False
+_slow_threshold = 0.1
+_span_histograms: dict[str, metrics.Histogram] = {}
+
+
+class _Span:
+    """Measures the duration of a block (see :func:`span`)."""
+
+    __slots__ = ("name", "start")
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self) -> None:
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info) -> None:
+        duration = time.perf_counter() - self.start
+        _span_histogram(self.name).observe(duration)
+        if duration > _slow_threshold:
+            log.warning("Slow %s: %.3fs", self.name, duration)
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self) -> None:
+        pass
+
+    def __exit__(self, *exc_info) -> None:
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name: str) -> _Span | _NoSpan:
+    """Returns a context manager measuring the duration of a block.
+
+    Does nothing if profiling is disabled.
+
+    Args:
+        name: Name of the span (used in the metric name).
+    """
+    if not _enabled:
+        return _NO_SPAN
+    return _Span(name)
+
+
+def _span_histogram(name: str) -> metrics.Histogram:
+    histogram = _span_histograms.get(name)
+    if histogram is None:
+        histogram = metrics.REGISTRY.histogram(
+            f"comprl_span_{name}_seconds", f"Duration of {name} (profiling span)."
+        )
+        _span_histograms[name] = histogram
+    return histogram
+
+
+def _frame_name(frame: FrameType) -> str:
+    code = frame.f_code
+    return (
+        f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    )
+
+
+class SamplingProfiler:
+    """
+    Periodically samples the stack of a thread (by default the calling thread).
+
+    The stacks are counted in the "folded" format (``root;caller;callee count``) used
+    by flame graph tools.
+    """
+
+    def __init__(self, interval: float = 0.005, thread_id: int | None = None) -> None:
+        """
+        Initializes the profiler.
+
+        Args:
+            interval: Time between samples in seconds.
+            thread_id: Identifier of the thread to sample (default: current thread).
+        """
+        self.interval = interval
+        self.thread_id = thread_id or threading.get_ident()
+        self.stacks: collections.Counter[str] = collections.Counter()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    @property
+    def running(self) -> bool:
+        """Whether the profiler is sampling."""
+        return self._thread is not None
+
+    def start(self) -> None:
+        """Starts sampling in a background thread."""
+        if self._thread is not None:
+            return
+        self.stacks.clear()
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._sample, name="sampling-profiler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stops sampling."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def folded(self) -> str:
+        """Returns the sampled stacks in the folded format."""
+        return "".join(
+            f"{stack} {count}\n" for stack, count in self.stacks.most_common()
+        )
+
+    def _sample(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame: FrameType | None = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                names.append(_frame_name(frame))
+                frame = frame.f_back
+            if names:
+                self.stacks[";".join(reversed(names))] += 1
+
+
+class ProfilerToggle:
+    """Starts/stops a :class:`SamplingProfiler` and writes the profile when stopped."""
+
+    def __init__(self, output_dir: pathlib.Path, interval: float) -> None:
+        """
+        Initializes the toggle.
+
+        Args:
+            output_dir: Directory the profiles are written to.
+            interval: Time between samples in seconds.
+        """
+        self.output_dir = output_dir
+        self.profiler = SamplingProfiler(interval)
+
+    def toggle(self) -> pathlib.Path | None:
+        """Starts or stops the profiler.
+
+        Returns:
+            The path of the written profile (if the profiler was stopped).
+        """
+        if not self.profiler.running:
+            log.info("Sampling profiler started")
+            self.profiler.start()
+            return None
+
+        self.profiler.stop()
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        timestamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        path = self.output_dir / f"profile-{timestamp}-{os.getpid()}.folded"
+        path.write_text(self.profiler.folded())
+        log.info(
+            "Sampling profiler stopped, wrote %d samples to %s",
+            self.profiler.stacks.total(),
+            path,
+        )
+        return path
+
+
+def setup(data_dir: pathlib.Path, slow_ms: float, sample_interval_ms: float) -> None:
+    """Enables profiling in this process.
+
+    Must be called from the reactor thread (the thread sampled by the profiler).
+
+    Args:
+        data_dir: Data directory of the server (profiles are written to a
+            ``profiles`` subdirectory).
+        slow_ms: Spans and reactor lags longer than this (in milliseconds) are logged.
+        sample_interval_ms: Time between samples of the profiler in milliseconds.
+    """
+    global _enabled, _slow_threshold
+    _enabled = True
+    _slow_threshold = slow_ms / 1000
+
+    metrics.start_reactor_lag_monitor(warn_threshold=_slow_threshold)
+
+    toggle = ProfilerToggle(data_dir / "profiles", sample_interval_ms / 1000)
+    signal.signal(signal.SIGUSR1, lambda signum, frame: toggle.toggle())
+    log.info("Profiling enabled, send SIGUSR1 to toggle the sampling profiler")
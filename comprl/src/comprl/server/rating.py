@@ -0,0 +1,268 @@
+"""
+Vectorized rating updates for two-player games.
+
+Implements the update of openskill's ``PlackettLuce.rate`` for two teams with one
+player each for many games at once.  The results are exactly (bit for bit) the same
+as those of openskill, called the way the server does::
+
+    model.rate([[rating_1], [rating_2]], scores=[score_1, score_2])
+
+The server collects the games finished between two matchmaking updates in a
+:class:`RatingBatch`.  :func:`apply_games` can also be used offline to replay the
+results of all games (e.g. from the ``games`` table) in chunks.
+
+Note that for float scores (as stored in the database), openskill does not treat
+equal scores as a tie, but ranks the first player higher.
+"""
+
+from __future__ import annotations
+
+import logging as log
+import math
+from datetime import datetime
+from typing import Callable, Iterable, NamedTuple, Optional
+
+import numpy as np
+from openskill.models import PlackettLuce
+
+from comprl.server.data.interfaces import RatingHistoryEntry
+
+# The exponential and squares of numpy may differ from the standard library in the
+# last bit, so use the same functions as openskill for these.
+_exp = np.vectorize(math.exp, otypes=[float])
+_square = np.vectorize(lambda x: x**2, otypes=[float])
+
+
+class GameOutcome(NamedTuple):
+    """The users and scores of a finished game (as needed for the rating update)."""
+
+    user1_id: int
+    user2_id: int
+    score_user_1: float
+    score_user_2: float
+    game_id: Optional[str] = None
+
+
+def rate(
+    model: PlackettLuce,
+    mu1: np.ndarray,
+    sigma1: np.ndarray,
+    mu2: np.ndarray,
+    sigma2: np.ndarray,
+    score1: np.ndarray,
+    score2: np.ndarray,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Computes the new ratings of the players of independent two-player games.
+
+    Args:
+        model: The model (its ``beta``, ``kappa`` and ``tau`` are used).
+        mu1: Mean rating of the first players.
+        sigma1: Rating uncertainty of the first players.
+        mu2: Mean rating of the second players.
+        sigma2: Rating uncertainty of the second players.
+        score1: Scores of the first players.
+        score2: Scores of the second players.
+
+    Returns:
+        New mu1, sigma1, mu2 and sigma2.
+    """
+    # The operations (and their order) are the same as in openskill, so that the
+    # rounding is the same.
+    tau_squared = model.tau * model.tau
+    sigma1 = np.sqrt(sigma1 * sigma1 + tau_squared)
+    sigma2 = np.sqrt(sigma2 * sigma2 + tau_squared)
+
+    # the players are sorted by score (stable, i.e. player 1 first if equal)
+    first = ~(score2 > score1)
+    winner_mu = np.where(first, mu1, mu2)
+    winner_sigma = np.where(first, sigma1, sigma2)
+    loser_mu = np.where(first, mu2, mu1)
+    loser_sigma = np.where(first, sigma2, sigma1)
+
+    winner_sigma_sq = _square(winner_sigma)
+    loser_sigma_sq = _square(loser_sigma)
+    beta_squared = model.beta**2
+    c = np.sqrt((winner_sigma_sq + beta_squared) + (loser_sigma_sq + beta_squared))
+    c_squared = _square(c)
+
+    winner_exp = _exp(winner_mu / c)
+    loser_exp = _exp(loser_mu / c)
+    sum_exp = winner_exp + loser_exp
+
+    p_winner = winner_exp / sum_exp
+    winner_omega = (1 - p_winner) * (winner_sigma_sq / c)
+    winner_delta = (p_winner * (1 - p_winner)) * (winner_sigma_sq / c_squared)
+    winner_delta *= np.sqrt(winner_sigma_sq) / c
+
+    p_loser = loser_exp / sum_exp
+    loser_omega = -p_loser * (loser_sigma_sq / c)
+    loser_delta = (p_loser * (1 - p_loser)) * (loser_sigma_sq / c_squared)
+    loser_delta *= np.sqrt(loser_sigma_sq) / c
+
+    winner_mu = winner_mu + winner_omega
+    winner_sigma = winner_sigma * np.sqrt(np.maximum(1 - winner_delta, model.kappa))
+    loser_mu = loser_mu + loser_omega
+    loser_sigma = loser_sigma * np.sqrt(np.maximum(1 - loser_delta, model.kappa))
+
+    return (
+        np.where(first, winner_mu, loser_mu),
+        np.where(first, winner_sigma, loser_sigma),
+        np.where(first, loser_mu, winner_mu),
+        np.where(first, loser_sigma, winner_sigma),
+    )
+
+
+def _rounds(games: list[GameOutcome]) -> list[list[int]]:
+    """
+    Splits the games into rounds in which every user plays at most once.
+
+    A game is in a later round than all previous games of its users, so applying the
+    rounds one after the other gives the same result as applying the games one by
+    one.
+    """
+    last_round: dict[int, int] = {}
+    rounds: list[list[int]] = []
+    for index, game in enumerate(games):
+        round_index = (
+            max(
+                last_round.get(game.user1_id, -1),
+                last_round.get(game.user2_id, -1),
+            )
+            + 1
+        )
+        last_round[game.user1_id] = last_round[game.user2_id] = round_index
+        if round_index == len(rounds):
+            rounds.append([])
+        rounds[round_index].append(index)
+    return rounds
+
+
+def apply_games(
+    model: PlackettLuce,
+    games: Iterable[GameOutcome],
+    ratings: dict[int, tuple[float, float]],
+    get_rating: Callable[[int], tuple[float, float]] | None = None,
+    history: list[RatingHistoryEntry] | None = None,
+    timestamp: datetime | None = None,
+) -> set[int]:
+    """
+    Updates the ratings with the results of the given games (in the given order).
+
+    Args:
+        model: The rating model.
+        games: The finished games.
+        ratings: (mu, sigma) by user ID.  Updated in place.
+        get_rating: Returns the rating of users that are not in ``ratings`` yet
+            (default: the initial rating of the model).
+        history: If given, the ratings of both users after each game are appended.
+            The entries of a user are in the order of the games.
+        timestamp: Time of the history entries (default: now).
+
+    Returns:
+        The IDs of the users whose rating changed.
+    """
+    games = list(games)
+    if timestamp is None:
+        timestamp = datetime.now()
+    for user_id in {u for game in games for u in (game.user1_id, game.user2_id)}:
+        if user_id not in ratings:
+            ratings[user_id] = (
+                get_rating(user_id) if get_rating else (model.mu, model.sigma)
+            )
+
+    for round_indices in _rounds(games):
+        batch = [games[i] for i in round_indices]
+        user1 = [game.user1_id for game in batch]
+        user2 = [game.user2_id for game in batch]
+        mu1, sigma1 = np.array([ratings[u] for u in user1]).reshape(-1, 2).T
+        mu2, sigma2 = np.array([ratings[u] for u in user2]).reshape(-1, 2).T
+        new_mu1, new_sigma1, new_mu2, new_sigma2 = rate(
+            model,
+            mu1,
+            sigma1,
+            mu2,
+            sigma2,
+            np.array([game.score_user_1 for game in batch], dtype=float),
+            np.array([game.score_user_2 for game in batch], dtype=float),
+        )
+        new_ratings = list(
+            zip(
+                user1 + user2,
+                new_mu1.tolist() + new_mu2.tolist(),
+                new_sigma1.tolist() + new_sigma2.tolist(),
+                strict=True,
+            )
+        )
+        for user_id, mu, sigma in new_ratings:
+            ratings[user_id] = (mu, sigma)
+
+        if history is not None:
+            history.extend(
+                RatingHistoryEntry(game.game_id, user_id, mu, sigma, timestamp)
+                for game, (user_id, mu, sigma) in zip(
+                    batch + batch, new_ratings, strict=True
+                )
+            )
+
+    return {u for game in games for u in (game.user1_id, game.user2_id)}
+
+
+class RatingBatch:
+    """Collects finished games, so that their rating updates are computed together."""
+
+    def __init__(self, model: PlackettLuce) -> None:
+        """
+        Initializes an empty batch.
+
+        Args:
+            model: The rating model.
+        """
+        self.model = model
+        self._games: list[GameOutcome] = []
+
+    def __len__(self) -> int:
+        return len(self._games)
+
+    def add(self, game: GameOutcome) -> None:
+        """Adds a finished game."""
+        self._games.append(game)
+
+    def apply(
+        self, get_rating: Callable[[int], tuple[float, float]]
+    ) -> tuple[dict[int, tuple[float, float]], list[RatingHistoryEntry]]:
+        """
+        Computes the rating updates of all collected games and clears the batch.
+
+        Games with a user that doesn't exist anymore (``get_rating`` raises a
+        ``ValueError``) are skipped.  If the computation fails otherwise, the games
+        are kept in the batch.
+
+        Args:
+            get_rating: Returns the current (mu, sigma) of a user.
+
+        Returns:
+            The new (mu, sigma) of all users that played and the rating history
+            entries of the games.
+        """
+        current: dict[int, tuple[float, float]] = {}
+        games = []
+        for game in self._games:
+            try:
+                for user_id in (game.user1_id, game.user2_id):
+                    if user_id not in current:
+                        current[user_id] = get_rating(user_id)
+            except ValueError as e:
+                log.warning("Game %s is not rated: %s", game.game_id, e)
+                continue
+            games.append(game)
+
+        ratings = {
+            user_id: current[user_id]
+            for game in games
+            for user_id in (game.user1_id, game.user2_id)
+        }
+        history: list[RatingHistoryEntry] = []
+        apply_games(self.model, games, ratings, history=history)
+        self._games = []
+        return ratings, history
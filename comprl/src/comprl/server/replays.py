@@ -0,0 +1,409 @@
+"""
+This module contains the file format and the background writer for game replays
+(actions/observations).
+
+Replays are stored as compressed ``.npz`` archives (zip files with one ``.npy`` member
+per array).  Each entry of the game's ``game_info`` dictionary is stored as a separate
+array, so a single entry (e.g. the observations of one round) can be loaded without
+reading the rest of the file.  A small JSON header (``__header__``) lists the entries
+with their shape and dtype.
+"""
+
+from __future__ import annotations
+
+import dataclasses
+import enum
+import json
+import logging as log
+import os
+import pathlib
+import pickle
+import queue
+import re
+import threading
+import time
+from typing import IO, Any, BinaryIO, Callable, Iterator, Mapping
+
+import numpy as np
+import numpy.typing as npt
+
+from comprl.server import metrics
+from comprl.server.config import get_config
+
+#: File extension of replay files
+REPLAY_SUFFIX = ".npz"
+#: Version of the replay format
+REPLAY_FORMAT_VERSION = 1
+
+_HEADER_KEY = "__header__"
+_ROUND_KEY_PATTERN = re.compile(r"^(.+)_round_(\d+)$")
+
+
+def write_replay(
+    file: str | os.PathLike | IO[bytes],
+    game_info: Mapping[str, Any],
+    float_dtype: npt.DTypeLike = np.float32,
+    compress: bool = True,
+) -> None:
+    """
+    Writes a replay file.
+
+    Args:
+        file: Output file (path or binary file object).
+        game_info: Data of the game.  Each value has to be convertible to a
+            (non-ragged) NumPy array, e.g. a list of equally shaped arrays.
+        float_dtype: dtype to which floating point arrays are converted.
+        compress: Whether to compress the arrays (zlib).
+    """
+    arrays: dict[str, np.ndarray] = {}
+    entries: dict[str, dict[str, Any]] = {}
+    for key, value in game_info.items():
+        try:
+            array = np.asarray(value)
+        except ValueError:
+            log.warning("Replay entry '%s' is ragged and can't be stored. Skip.", key)
+            continue
+        if array.dtype == object:
+            log.warning("Replay entry '%s' has unsupported type. Skip.", key)
+            continue
+        if np.issubdtype(array.dtype, np.floating):
+            array = array.astype(float_dtype, copy=False)
+
+        arrays[key] = array
+        entries[key] = {"shape": list(array.shape), "dtype": array.dtype.str}
+
+    header = {"format_version": REPLAY_FORMAT_VERSION, "entries": entries}
+    arrays[_HEADER_KEY] = np.frombuffer(json.dumps(header).encode(), dtype=np.uint8)
+
+    if compress:
+        np.savez_compressed(file, **arrays)  # type: ignore[arg-type]
+    else:
+        np.savez(file, **arrays)  # type: ignore[arg-type]
+
+
+class Replay:
+    """
+    Reader for replay files.
+
+    Entries are only loaded from the file when they are accessed.  Use as context
+    manager or call :meth:`close` to close the file.
+
+    Example:
+        >>> with Replay(path) as replay:
+        ...     for i in range(replay.num_rounds):
+        ...         observations = replay.round(i)["observations"]
+    """
+
+    def __init__(self, path: str | os.PathLike) -> None:
+        """
+        Opens a replay file.
+
+        Args:
+            path: Path to the replay file.
+        """
+        # pickle is disabled, so loading untrusted files is safe
+        self._npz = np.load(path, allow_pickle=False)
+        header = json.loads(self._npz[_HEADER_KEY].tobytes())
+        if header["format_version"] > REPLAY_FORMAT_VERSION:
+            self._npz.close()
+            raise ValueError(
+                f"Unsupported replay format version {header['format_version']}"
+            )
+        self._entries: dict[str, dict[str, Any]] = header["entries"]
+
+    def __enter__(self) -> Replay:
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Closes the file."""
+        self._npz.close()
+
+    def keys(self) -> list[str]:
+        """Names of all entries in the replay."""
+        return list(self._entries)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._entries)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._entries
+
+    def __getitem__(self, key: str) -> np.ndarray:
+        """Loads a single entry."""
+        if key not in self._entries:
+            raise KeyError(key)
+        return self._npz[key]
+
+    def shape(self, key: str) -> tuple[int, ...]:
+        """Shape of an entry (without loading it)."""
+        return tuple(self._entries[key]["shape"])
+
+    def dtype(self, key: str) -> np.dtype:
+        """dtype of an entry (without loading it)."""
+        return np.dtype(self._entries[key]["dtype"])
+
+    @property
+    def num_rounds(self) -> int:
+        """Number of rounds (based on entries named like ``<name>_round_<i>``)."""
+        rounds = [
+            int(m.group(2))
+            for key in self._entries
+            if (m := _ROUND_KEY_PATTERN.match(key))
+        ]
+        return max(rounds) + 1 if rounds else 0
+
+    def round(self, index: int) -> dict[str, np.ndarray]:
+        """
+        Loads all entries of one round.
+
+        Args:
+            index: Index of the round.
+
+        Returns:
+            Entries ``<name>_round_<index>`` of the replay with keys ``<name>``.
+        """
+        result = {}
+        for key in self._entries:
+            m = _ROUND_KEY_PATTERN.match(key)
+            if m and int(m.group(2)) == index:
+                result[m.group(1)] = self[key]
+        if not result:
+            raise IndexError(f"Replay has no round {index}")
+        return result
+
+
+def convert_pickle_replay(
+    pkl_path: str | os.PathLike, output_path: str | os.PathLike | None = None
+) -> pathlib.Path:
+    """
+    Converts a replay from the old pickle format to the current format.
+
+    Warning: Unpickling can execute arbitrary code, so only convert trusted files.
+
+    Args:
+        pkl_path: Path to the ``.pkl`` file.
+        output_path: Output file.  Defaults to ``pkl_path`` with suffix ``.npz``.
+
+    Returns:
+        Path of the written file.
+    """
+    pkl_path = pathlib.Path(pkl_path)
+    if output_path is None:
+        output_path = pkl_path.with_suffix(REPLAY_SUFFIX)
+    output_path = pathlib.Path(output_path)
+
+    with open(pkl_path, "rb") as f:
+        game_info = pickle.load(f)
+
+    # write to temporary file first, so that no partial files are left on error
+    tmp_path = output_path.with_name(output_path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        write_replay(f, game_info)
+    os.replace(tmp_path, output_path)
+
+    return output_path
+
+
+class FsyncPolicy(enum.Enum):
+    """
+    Defines when written replay files are synced to disk.
+
+    Attributes:
+        NONE: Don't sync, leave it to the operating system.
+        FILE: Sync the content of each replay file.
+        FULL: Sync the content of each file and the directory entry.
+    """
+
+    NONE = "none"
+    FILE = "file"
+    FULL = "full"
+
+
+@dataclasses.dataclass
+class ReplayWriterStats:
+    """Counters of the replay writer."""
+
+    #: Number of replays submitted for writing
+    submitted: int = 0
+    #: Number of replays written successfully
+    written: int = 0
+    #: Number of replays that could not be written
+    failed: int = 0
+    #: Number of times ``submit`` had to wait because the queue was full
+    blocked: int = 0
+    #: Highest number of replays that were waiting in the queue at the same time
+    max_queue_depth: int = 0
+    #: Total time spent writing replays (in seconds)
+    total_write_time: float = 0.0
+    #: Longest time needed to write a single replay (in seconds)
+    max_write_time: float = 0.0
+
+
+# A write job: output file and the function that writes the data to an opened file
+_Job = tuple[pathlib.Path, Callable[[BinaryIO], None]]
+
+
+class ReplayWriter:
+    """
+    Writes replay files in background threads.
+
+    Jobs are fed to the threads via a bounded queue.  If the queue is full,
+    :meth:`submit` blocks until there is space again, so the server slows down instead
+    of accumulating an unbounded amount of unwritten replays in memory.
+
+    Files are first written to a temporary file, which is renamed once complete, so
+    readers never see partially written replays.
+    """
+
+    def __init__(
+        self,
+        num_threads: int = 1,
+        max_queue_size: int = 64,
+        fsync: FsyncPolicy = FsyncPolicy.NONE,
+    ) -> None:
+        """
+        Initializes the writer and starts the worker threads.
+
+        Args:
+            num_threads: Number of threads writing files.
+            max_queue_size: Maximum number of replays waiting to be written.
+            fsync: When to sync written files to disk.
+        """
+        self.fsync = fsync
+        self.stats = ReplayWriterStats()
+        self._stats_lock = threading.Lock()
+        self._queue: queue.Queue[_Job | None] = queue.Queue(maxsize=max_queue_size)
+        self._closed = False
+        self._threads = [
+            threading.Thread(target=self._work, name=f"replay-writer-{i}", daemon=True)
+            for i in range(num_threads)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of replays waiting to be written."""
+        return self._queue.qsize()
+
+    def submit(self, path: pathlib.Path, write: Callable[[BinaryIO], None]) -> None:
+        """
+        Queues a replay for writing.
+
+        Blocks if the queue is full.
+
+        Args:
+            path: Output file.
+            write: Function that writes the replay to the given (binary) file object.
+                It is called in a worker thread.
+        """
+        if self._closed:
+            raise RuntimeError("Replay writer is already closed")
+
+        with self._stats_lock:
+            self.stats.submitted += 1
+
+        try:
+            self._queue.put_nowait((path, write))
+        except queue.Full:
+            log.warning(
+                "Replay queue is full (%d entries), waiting for writer",
+                self._queue.maxsize,
+            )
+            with self._stats_lock:
+                self.stats.blocked += 1
+            self._queue.put((path, write))
+
+        depth = self._queue.qsize()
+        with self._stats_lock:
+            self.stats.max_queue_depth = max(self.stats.max_queue_depth, depth)
+
+    def flush(self) -> None:
+        """Blocks until all queued replays are written."""
+        self._queue.join()
+
+    def close(self) -> None:
+        """Writes all queued replays and stops the worker threads."""
+        if self._closed:
+            return
+        self._closed = True
+
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+        log.info(
+            "Replay writer stopped | written=%d failed=%d avg_write_time=%.4fs",
+            self.stats.written,
+            self.stats.failed,
+            self.stats.total_write_time / max(self.stats.written, 1),
+        )
+
+    def _work(self) -> None:
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                self._write(*job)
+            finally:
+                self._queue.task_done()
+
+    def _write(self, path: pathlib.Path, write: Callable[[BinaryIO], None]) -> None:
+        start = time.perf_counter()
+        tmp_path = path.with_name(path.name + ".tmp")
+        try:
+            with open(tmp_path, "wb") as f:
+                write(f)
+                if self.fsync != FsyncPolicy.NONE:
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+            if self.fsync == FsyncPolicy.FULL:
+                dir_fd = os.open(path.parent, os.O_RDONLY)
+                try:
+                    os.fsync(dir_fd)
+                finally:
+                    os.close(dir_fd)
+        except Exception:
+            log.exception("Failed to write replay %s", path)
+            tmp_path.unlink(missing_ok=True)
+            with self._stats_lock:
+                self.stats.failed += 1
+            return
+
+        duration = time.perf_counter() - start
+        metrics.REPLAY_WRITE_DURATION.observe(duration)
+        with self._stats_lock:
+            self.stats.written += 1
+            self.stats.total_write_time += duration
+            self.stats.max_write_time = max(self.stats.max_write_time, duration)
+        log.debug("Saved replay to %s (%.4fs)", path, duration)
+
+
+_replay_writer: ReplayWriter | None = None
+
+
+def get_replay_writer() -> ReplayWriter:
+    """Get global replay writer instance (created on first use based on the config)."""
+    global _replay_writer
+    if _replay_writer is None:
+        config = get_config()
+        _replay_writer = ReplayWriter(
+            num_threads=config.replay_writer_threads,
+            max_queue_size=config.replay_queue_size,
+            fsync=FsyncPolicy(config.replay_fsync),
+        )
+    return _replay_writer
+
+
+def shutdown_replay_writer() -> None:
+    """Write all pending replays and stop the global replay writer (if it exists)."""
+    global _replay_writer
+    if _replay_writer is not None:
+        _replay_writer.close()
+        _replay_writer = None
@@ -0,0 +1,916 @@
+"""
+Sharded server mode.
+
+With ``shards > 1``, the server is split into several processes, so that networking
+and game logic of many concurrent clients are distributed over multiple CPU cores:
+
+- The main process becomes the *coordinator*.  It does not accept clients but owns the
+  matchmaking queue and the ratings.  It listens on a local (unix) socket for the
+  shards.
+- Each *shard* is a full server process listening on the server port.  The port is
+  opened with ``SO_REUSEPORT``, so the kernel distributes incoming connections among
+  the shards.  A shard authenticates its clients and forwards them to the
+  coordinator's queue (:class:`ShardMatchmaking`).
+
+When the coordinator matches two players, the game is run by the shard of the first
+player (the *host*), which also stores its result.  If the second player is connected
+to a different shard, its messages are relayed through the coordinator (see
+:class:`RelayedPlayer`).  When the game ends, the host reports the result to the
+coordinator, which updates the ratings and puts the players back into the queue.
+When the server stops, the coordinator asks the shards to end their games (see
+:class:`StopShard`), so that the results are rated before the shards exit.
+
+The shards are started as new processes instead of being forked from the coordinator,
+as the Twisted reactor (created on import) must not be shared between processes.
+"""
+
+from __future__ import annotations
+
+import logging as log
+import os
+import shutil
+import signal
+import sys
+import tempfile
+from typing import Any, Callable
+
+from twisted.internet import defer, reactor
+from twisted.internet.endpoints import UNIXClientEndpoint, connectProtocol
+from twisted.internet.protocol import ProcessProtocol, ServerFactory
+from twisted.internet.task import LoopingCall
+from twisted.protocols import amp
+
+from comprl.server import metrics, networking
+from comprl.server.config import get_config
+from comprl.server.data.write_behind import shutdown_write_behind_store
+from comprl.server.interfaces import IGame, IPlayer, IServer
+from comprl.server.managers import GameManager, MatchmakingManager, PlayerManager
+from comprl.shared.commands import NumpyArray
+from comprl.shared.types import GameID, PlayerID
+
+
+class RelayError(Exception):
+    """A relayed message could not be delivered to the player."""
+
+
+# Commands sent by a shard to the coordinator
+
+
+class RegisterShard(amp.Command):
+    """Registers a shard after connecting to the coordinator."""
+
+    arguments = [(b"shard", amp.Integer())]
+    response = []
+
+
+class Enqueue(amp.Command):
+    """Adds an authenticated player of the shard to the matchmaking queue."""
+
+    arguments = [(b"player_id", amp.String()), (b"user_id", amp.Integer())]
+    response = []
+
+
+class Dequeue(amp.Command):
+    """Removes a player that disconnected from the shard."""
+
+    arguments = [(b"player_id", amp.String())]
+    response = []
+
+
+class GameEnded(amp.Command):
+    """Reports the result of a match run by the (host) shard.
+
+    Scores and ``won`` are given in the order of the players in :class:`StartMatch`.
+    """
+
+    arguments = [
+        (b"match_id", amp.String()),
+        (b"failed", amp.Boolean()),
+        (b"scores", amp.ListOf(amp.Float())),
+        (b"won", amp.ListOf(amp.Boolean())),
+        (b"disconnected", amp.String(optional=True)),
+    ]
+    response = []
+
+
+# Commands sent by the coordinator to a shard
+
+
+class StartMatch(amp.Command):
+    """Asks the shard to host a game with the given players."""
+
+    arguments = [
+        (b"match_id", amp.String()),
+        (
+            b"players",
+            amp.AmpList(
+                [
+                    (b"player_id", amp.String()),
+                    (b"user_id", amp.Integer()),
+                    (b"shard", amp.Integer()),
+                ]
+            ),
+        ),
+    ]
+    response = []
+
+
+class PlayerDisconnected(amp.Command):
+    """Notifies the host shard that a player of one of its games disconnected."""
+
+    arguments = [(b"player_id", amp.String())]
+    response = []
+
+
+class StopShard(amp.Command):
+    """Asks the shard to end its games because the server is stopping.
+
+    The shard answers once the results of the games have been reported.
+    """
+
+    arguments = []
+    response = []
+
+
+# Messages to a player, sent from the host shard to the coordinator and forwarded by the
+# coordinator to the shard the player is connected to.
+
+
+class RelayReady(amp.Command):
+    """See :meth:`IPlayer.is_ready`."""
+
+    arguments = [(b"player_id", amp.String())]
+    response = [(b"ready", amp.Boolean())]
+    errors = {RelayError: b"RELAY_ERROR"}
+
+
+class RelayStart(amp.Command):
+    """See :meth:`IPlayer.notify_start`."""
+
+    arguments = [(b"player_id", amp.String()), (b"game_id", amp.String())]
+    response = []
+    errors = {RelayError: b"RELAY_ERROR"}
+
+
+class RelayStep(amp.Command):
+    """See :meth:`IPlayer.get_action`."""
+
+    arguments = [(b"player_id", amp.String()), (b"obv", NumpyArray())]
+    response = [(b"action", NumpyArray())]
+    errors = {RelayError: b"RELAY_ERROR"}
+
+
+class RelayEnd(amp.Command):
+    """See :meth:`IPlayer.notify_end`."""
+
+    arguments = [
+        (b"player_id", amp.String()),
+        (b"result", amp.Boolean()),
+        (b"stats", amp.ListOf(amp.Float())),
+    ]
+    response = []
+    errors = {RelayError: b"RELAY_ERROR"}
+
+
+class RelayDisconnect(amp.Command):
+    """See :meth:`IPlayer.disconnect`."""
+
+    arguments = [(b"player_id", amp.String()), (b"reason", amp.Unicode())]
+    response = []
+    errors = {RelayError: b"RELAY_ERROR"}
+
+
+class RelayMessage(amp.Command):
+    """See :meth:`IPlayer.notify_info` and :meth:`IPlayer.notify_error`."""
+
+    arguments = [
+        (b"player_id", amp.String()),
+        (b"msg", amp.Unicode()),
+        (b"error", amp.Boolean()),
+    ]
+    response = []
+    errors = {RelayError: b"RELAY_ERROR"}
+
+
+def _relay_failed(failure) -> None:
+    raise RelayError(failure.getErrorMessage())
+
+
+class RelayedPlayer(IPlayer):
+    """
+    A player that is connected to another process.
+
+    All calls are sent as relay commands over the given connection (from the
+    coordinator directly to the shard of the player, from a host shard to the
+    coordinator, which forwards them).
+    """
+
+    def __init__(self, connection: Any, player_id: PlayerID, user_id: int) -> None:
+        """
+        Initializes the player.
+
+        Args:
+            connection: AMP connection over which the calls are sent.
+            player_id: ID of the player (assigned by its shard).
+            user_id: ID of the user.
+        """
+        super().__init__()
+        self.connection = connection
+        self.id = player_id
+        self.user_id = user_id
+
+    def authenticate(self, result_callback):
+        """Players are authenticated by their shard."""
+        raise NotImplementedError("Relayed players are authenticated by their shard")
+
+    def is_ready(self, result_callback) -> bool:
+        """Checks if the player is ready to play."""
+        self._relay(RelayReady, lambda res: result_callback(res["ready"]))
+        return True
+
+    def notify_start(self, game_id: GameID):
+        """Notifies the player about the start of the game."""
+        self._relay(RelayStart, game_id=game_id.bytes)
+
+    def get_action(self, obv, result_callback):
+        """Requests the action of the player."""
+        self._relay(RelayStep, lambda res: result_callback(res["action"]), obv=obv)
+
+    def notify_end(self, result, stats):
+        """Notifies the player about the end of the game."""
+        self._relay(RelayEnd, result=result, stats=list(stats))
+
+    def disconnect(self, reason: str):
+        """Disconnects the player."""
+        self._relay(RelayDisconnect, reason=reason)
+
+    def notify_error(self, error: str):
+        """Notifies the player of an error."""
+        self._relay(RelayMessage, msg=error, error=True)
+
+    def notify_info(self, msg: str):
+        """Notifies the player of an information."""
+        self._relay(RelayMessage, msg=msg, error=False)
+
+    def _relay(
+        self,
+        command: type[amp.Command],
+        callback: Callable[[dict], Any] | None = None,
+        **kwargs,
+    ) -> None:
+        d = self.connection.callRemote(command, player_id=self.id.bytes, **kwargs)
+        if callback is not None:
+            d.addCallback(callback)
+        # the player has disconnected (this is handled by its shard) or timed out
+        d.addErrback(
+            lambda failure: log.debug(
+                "Relaying %s to player %s failed: %s",
+                command.__name__,
+                self.id,
+                failure.getErrorMessage(),
+            )
+        )
+
+
+class ShardMatch(IGame):
+    """
+    Coordinator-side proxy of a game that is run by the shard of the first player.
+
+    The result is reported by the host shard with :class:`GameEnded`.
+    """
+
+    def __init__(self, players: list[IPlayer]) -> None:
+        super().__init__(players)
+        self.relayed_players: list[RelayedPlayer] = []
+        for player in players:
+            assert isinstance(player, RelayedPlayer)
+            self.relayed_players.append(player)
+        self.host = self.relayed_players[0].connection
+        self._won: dict[PlayerID, bool] = {}
+        self._failed = False
+        self._finished = False
+
+    def start(self):
+        """Asks the host shard to start the game."""
+        self.host.callRemote(
+            StartMatch,
+            match_id=self.id.bytes,
+            players=[
+                {
+                    "player_id": p.id.bytes,
+                    "user_id": p.user_id,
+                    "shard": p.connection.index,
+                }
+                for p in self.relayed_players
+            ],
+        ).addErrback(
+            lambda failure: self.finish(
+                failed=True, scores=[], won=[], disconnected=None
+            )
+        )
+
+    def force_end(self, player_id: PlayerID):
+        """Notifies the host shard that a player disconnected."""
+        self.host.callRemote(PlayerDisconnected, player_id=player_id.bytes).addErrback(
+            lambda failure: log.debug("Could not reach host of match %s", self.id)
+        )
+
+    def finish(
+        self,
+        failed: bool,
+        scores: list[float],
+        won: list[bool],
+        disconnected: PlayerID | None,
+    ) -> None:
+        """Ends the match with the result reported by the host shard.
+
+        Args:
+            failed: The game could not be finished (no result).
+            scores: Scores of the players (in the order of the players).
+            won: Whether each player won (in the order of the players).
+            disconnected: The player that disconnected (if any).
+        """
+        if self._finished:
+            return
+        self._finished = True
+        self._failed = failed
+        if not failed:
+            self.scores = dict(zip(self.players, scores, strict=True))
+            self._won = dict(zip(self.players, won, strict=True))
+            self.disconnected_player_id = disconnected
+        self._end("Game failed" if failed else "Game ended")
+
+    def get_result(self):
+        """Returns the result of the game (None if the game failed)."""
+        if self._failed:
+            return None
+        return super().get_result()
+
+    def _end(self, reason="unknown"):
+        # the players are notified and the replay is written by the host shard
+        for callback in self.finish_callbacks:
+            callback(self)
+
+    def _update(self, actions: dict[PlayerID, list[float]]) -> bool:
+        raise NotImplementedError("ShardMatch is run by the host shard")
+
+    def _validate_action(self, action) -> bool:
+        raise NotImplementedError("ShardMatch is run by the host shard")
+
+    def _get_observation(self, id: PlayerID) -> list[float]:
+        raise NotImplementedError("ShardMatch is run by the host shard")
+
+    def _player_won(self, id: PlayerID) -> bool:
+        return self._won.get(id, False)
+
+    def _player_stats(self, id: PlayerID) -> list[float]:
+        return []
+
+
+class ShardGameManager(GameManager):
+    """Game manager of the coordinator (games are run and stored by the shards)."""
+
+    def __init__(self) -> None:
+        super().__init__(ShardMatch)
+
+    def end_game(self, game: IGame) -> None:
+        """Removes the finished match (the result is stored by the host shard)."""
+        self._remove_game(game)
+
+
+class Coordinator:
+    """Owns the matchmaking queue of all shards."""
+
+    def __init__(self) -> None:
+        self.player_manager = PlayerManager()
+        self.game_manager = ShardGameManager()
+        # the results are written by the host shards
+        self.matchmaking = MatchmakingManager(
+            self.player_manager, self.game_manager, store_results=False
+        )
+        #: Connections to the shards by shard index
+        self.shards: dict[int, ShardConnection] = {}
+        #: Connection to the shard of each player
+        self.owners: dict[PlayerID, ShardConnection] = {}
+
+        # players and games are counted by the shards
+        metrics.QUEUE_LENGTH.set_function(lambda: self.matchmaking.queue_length())
+
+    def enqueue(self, shard: ShardConnection, player_id: PlayerID, user_id: int):
+        """Adds a player of the given shard to the queue."""
+        if self.player_manager.get_player_by_id(player_id) is None:
+            self.player_manager.add_authenticated(
+                RelayedPlayer(shard, player_id, user_id), user_id
+            )
+            self.owners[player_id] = shard
+        self.matchmaking.try_match(player_id)
+
+    def dequeue(self, player_id: PlayerID) -> None:
+        """Removes a player that disconnected and ends its game."""
+        self.matchmaking.remove(player_id)
+        player = self.player_manager.get_player_by_id(player_id)
+        if player is not None:
+            self.player_manager.remove(player)
+        self.owners.pop(player_id, None)
+        self.game_manager.force_game_end(player_id)
+
+    def game_ended(
+        self,
+        match_id: GameID,
+        failed: bool,
+        scores: list[float],
+        won: list[bool],
+        disconnected: PlayerID | None,
+    ) -> None:
+        """Ends a match with the result reported by its host."""
+        match = self.game_manager.get(match_id)
+        if isinstance(match, ShardMatch):
+            match.finish(failed, scores, won, disconnected)
+
+    def shard_lost(self, shard: ShardConnection) -> None:
+        """Removes the players of a shard that has disconnected."""
+        if shard.index is not None and self.shards.get(shard.index) is shard:
+            del self.shards[shard.index]
+        for player_id, owner in list(self.owners.items()):
+            if owner is shard:
+                self.dequeue(player_id)
+
+
+class ShardConnection(amp.AMP):
+    """Connection to a shard (coordinator side)."""
+
+    # the interface types of twisted are not understood by mypy
+    transport: Any
+
+    def __init__(self, coordinator: Coordinator) -> None:
+        super().__init__()
+        self.coordinator = coordinator
+        #: Index of the shard (set on registration)
+        self.index: int | None = None
+
+    @RegisterShard.responder
+    def register(self, shard: int):
+        """Registers the shard."""
+        log.debug("Shard %d connected", shard)
+        self.index = shard
+        self.coordinator.shards[shard] = self
+        return {}
+
+    @Enqueue.responder
+    def enqueue(self, player_id: bytes, user_id: int):
+        """Adds a player of the shard to the queue."""
+        self.coordinator.enqueue(self, PlayerID(bytes=player_id), user_id)
+        return {}
+
+    @Dequeue.responder
+    def dequeue(self, player_id: bytes):
+        """Removes a player that disconnected from the shard."""
+        self.coordinator.dequeue(PlayerID(bytes=player_id))
+        return {}
+
+    @GameEnded.responder
+    def game_ended(
+        self,
+        match_id: bytes,
+        failed: bool,
+        scores: list[float],
+        won: list[bool],
+        disconnected: bytes | None = None,
+    ):
+        """Ends a match hosted by the shard."""
+        self.coordinator.game_ended(
+            GameID(bytes=match_id),
+            failed,
+            scores,
+            won,
+            None if disconnected is None else PlayerID(bytes=disconnected),
+        )
+        return {}
+
+    def _forward(self, command: type[amp.Command], player_id: bytes, **kwargs):
+        owner = self.coordinator.owners.get(PlayerID(bytes=player_id))
+        if owner is None:
+            raise RelayError("Unknown player")
+        return owner.callRemote(command, player_id=player_id, **kwargs).addErrback(
+            _relay_failed
+        )
+
+    @RelayReady.responder
+    def relay_ready(self, player_id: bytes):
+        """Forwards the message to the shard of the player."""
+        return self._forward(RelayReady, player_id)
+
+    @RelayStart.responder
+    def relay_start(self, player_id: bytes, game_id: bytes):
+        """Forwards the message to the shard of the player."""
+        return self._forward(RelayStart, player_id, game_id=game_id)
+
+    @RelayStep.responder
+    def relay_step(self, player_id: bytes, obv):
+        """Forwards the message to the shard of the player."""
+        return self._forward(RelayStep, player_id, obv=obv)
+
+    @RelayEnd.responder
+    def relay_end(self, player_id: bytes, result: bool, stats: list[float]):
+        """Forwards the message to the shard of the player."""
+        return self._forward(RelayEnd, player_id, result=result, stats=stats)
+
+    @RelayDisconnect.responder
+    def relay_disconnect(self, player_id: bytes, reason: str):
+        """Forwards the message to the shard of the player."""
+        return self._forward(RelayDisconnect, player_id, reason=reason)
+
+    @RelayMessage.responder
+    def relay_message(self, player_id: bytes, msg: str, error: bool):
+        """Forwards the message to the shard of the player."""
+        return self._forward(RelayMessage, player_id, msg=msg, error=error)
+
+    def connectionLost(self, reason):
+        """Called when the connection to the shard is lost."""
+        log.debug("Shard %s disconnected", self.index)
+        self.coordinator.shard_lost(self)
+        super().connectionLost(reason)
+
+
+class Shard:
+    """State of a shard process (hosts games and relays messages to its players)."""
+
+    def __init__(
+        self, player_manager: PlayerManager, game_manager: GameManager, index: int
+    ) -> None:
+        """
+        Initializes the shard.
+
+        Args:
+            player_manager: Player manager of the shard's server.
+            game_manager: Game manager of the shard's server.
+            index: Index of the shard.
+        """
+        self.player_manager = player_manager
+        self.game_manager = game_manager
+        self.index = index
+        #: Connection to the coordinator (set once connected)
+        self.coordinator: Any = None
+        #: Set when the server is stopping (no new games are started)
+        self.stopping = False
+        #: Results that have been sent, but not confirmed by the coordinator yet
+        self._pending_reports: set[defer.Deferred] = set()
+
+    def start_match(self, match_id: GameID, players: list[dict]) -> None:
+        """Starts a game assigned by the coordinator.
+
+        Args:
+            match_id: ID of the match in the coordinator.
+            players: Player ID, user ID and shard index of each player.
+        """
+        if self.stopping:
+            self._report(match_id, None)
+            return
+
+        game_players: list[IPlayer] = []
+        for entry in players:
+            player_id = PlayerID(bytes=entry["player_id"])
+            player: IPlayer | None
+            if entry["shard"] == self.index:
+                player = self.player_manager.get_player_by_id(player_id)
+            else:
+                player = RelayedPlayer(self.coordinator, player_id, entry["user_id"])
+            if player is None:
+                # disconnected in the meantime
+                self._report(match_id, None)
+                return
+            game_players.append(player)
+
+        game = self.game_manager.start_game(game_players)
+        game.add_finish_callback(lambda game: self._report(match_id, game))
+
+    def _report(self, match_id: GameID, game: IGame | None) -> None:
+        if game is None or game.get_result() is None:
+            kwargs: dict[str, Any] = dict(failed=True, scores=[], won=[])
+        else:
+            kwargs = dict(
+                failed=False,
+                scores=[game.scores[p] for p in game.players],
+                won=[game._player_won(p) for p in game.players],
+            )
+            if game.disconnected_player_id is not None:
+                kwargs["disconnected"] = game.disconnected_player_id.bytes
+        d = self.coordinator.callRemote(GameEnded, match_id=match_id.bytes, **kwargs)
+        d.addErrback(lambda failure: log.error("Could not report result of game"))
+        self._pending_reports.add(d)
+        d.addBoth(lambda _: self._pending_reports.discard(d))
+
+    def stop(self) -> defer.Deferred:
+        """Ends the running games because the server is stopping.
+
+        The games end with their current scores, so they are rated like finished
+        games.
+
+        Returns:
+            Fires once the coordinator has confirmed all results.
+        """
+        self.stopping = True
+        for game in list(self.game_manager.games.values()):
+            game._end(reason="Server stopped")
+        return defer.DeferredList(list(self._pending_reports))
+
+    def player(self, player_id: bytes) -> IPlayer:
+        """Returns the (local) player with the given ID.
+
+        Raises:
+            RelayError: If the player is not connected to this shard.
+        """
+        player = self.player_manager.get_player_by_id(PlayerID(bytes=player_id))
+        if player is None:
+            raise RelayError("Player is not connected")
+        return player
+
+
+class CoordinatorClient(amp.AMP):
+    """Connection to the coordinator (shard side)."""
+
+    def __init__(self, shard: Shard) -> None:
+        super().__init__()
+        self.shard = shard
+
+    @StartMatch.responder
+    def start_match(self, match_id: bytes, players: list[dict]):
+        """Hosts a match assigned by the coordinator."""
+        self.shard.start_match(GameID(bytes=match_id), players)
+        return {}
+
+    @PlayerDisconnected.responder
+    def player_disconnected(self, player_id: bytes):
+        """Ends the games of a player that disconnected."""
+        self.shard.game_manager.force_game_end(PlayerID(bytes=player_id))
+        return {}
+
+    @StopShard.responder
+    def stop(self):
+        """Ends the games of the shard and waits until their results are reported."""
+        return self.shard.stop().addCallback(lambda _: {})
+
+    def _request(self, player_id: bytes, request: Callable[[IPlayer, Callable], Any]):
+        """Passes a request to the player and waits for the answer."""
+        player = self.shard.player(player_id)
+        d: defer.Deferred = defer.Deferred()
+        request(player, d.callback)
+        # timeouts are handled by the player's connection or the game on the host, this
+        # is just to make sure that the request is not kept forever
+        d.addTimeout(get_config().timeout + 1, reactor)  # type: ignore[arg-type]
+        return d.addErrback(_relay_failed)
+
+    @RelayReady.responder
+    def relay_ready(self, player_id: bytes):
+        """Checks if the local player is ready."""
+        return self._request(
+            player_id, lambda p, cb: p.is_ready(lambda ready: cb({"ready": ready}))
+        )
+
+    @RelayStep.responder
+    def relay_step(self, player_id: bytes, obv):
+        """Requests the action of the local player."""
+        return self._request(
+            player_id,
+            lambda p, cb: p.get_action(obv, lambda action: cb({"action": action})),
+        )
+
+    @RelayStart.responder
+    def relay_start(self, player_id: bytes, game_id: bytes):
+        """Notifies the local player about the start of the game."""
+        self.shard.player(player_id).notify_start(GameID(bytes=game_id))
+        return {}
+
+    @RelayEnd.responder
+    def relay_end(self, player_id: bytes, result: bool, stats: list[float]):
+        """Notifies the local player about the end of the game."""
+        self.shard.player(player_id).notify_end(result, stats)
+        return {}
+
+    @RelayDisconnect.responder
+    def relay_disconnect(self, player_id: bytes, reason: str):
+        """Disconnects the local player."""
+        self.shard.player(player_id).disconnect(reason)
+        return {}
+
+    @RelayMessage.responder
+    def relay_message(self, player_id: bytes, msg: str, error: bool):
+        """Sends a message to the local player."""
+        player = self.shard.player(player_id)
+        if error:
+            player.notify_error(msg)
+        else:
+            player.notify_info(msg)
+        return {}
+
+    def connectionLost(self, reason):
+        """Stops the shard when the coordinator is gone."""
+        log.info(
+            "Connection to coordinator closed, stopping shard %d", self.shard.index
+        )
+        super().connectionLost(reason)
+        if reactor.running:  # type: ignore[attr-defined]
+            reactor.stop()  # type: ignore[attr-defined]
+
+
+class ShardMatchmaking(MatchmakingManager):
+    """Matchmaking of a shard: players are queued in the coordinator."""
+
+    def __init__(
+        self, player_manager: PlayerManager, game_manager: GameManager, shard: Shard
+    ) -> None:
+        super().__init__(player_manager, game_manager)
+        self.shard = shard
+
+    def try_match(self, player_id: PlayerID) -> None:
+        """Adds the player to the queue of the coordinator."""
+        user_id = self.player_manager.get_user_id(player_id)
+        if user_id is not None:
+            self.shard.coordinator.callRemote(
+                Enqueue, player_id=player_id.bytes, user_id=user_id
+            )
+
+    def remove(self, player_id: PlayerID) -> None:
+        """Notifies the coordinator that the player is gone."""
+        # the players are disconnected when the shard stops (after the connection to
+        # the coordinator has been closed)
+        transport = self.shard.coordinator.transport
+        if transport is not None and transport.connected:
+            self.shard.coordinator.callRemote(Dequeue, player_id=player_id.bytes)
+
+    def _update(self) -> None:
+        # matches are made by the coordinator
+        pass
+
+
+class _CoordinatorFactory(ServerFactory):
+    def __init__(self, coordinator: Coordinator) -> None:
+        self.coordinator = coordinator
+
+    def buildProtocol(self, addr):
+        return ShardConnection(self.coordinator)
+
+    def stopFactory(self) -> None:
+        # make sure all rating updates are written before the process exits
+        self.coordinator.matchmaking.update_ratings()
+        shutdown_write_behind_store()
+        super().stopFactory()
+
+
+class _ShardProcess(ProcessProtocol):
+    """A shard process (coordinator side)."""
+
+    # the interface types of twisted are not understood by mypy
+    transport: Any
+
+    def __init__(self, launcher: _ShardLauncher, index: int) -> None:
+        self.launcher = launcher
+        self.index = index
+        self.ended: defer.Deferred = defer.Deferred()
+
+    def processEnded(self, reason):
+        """Called when the shard has exited."""
+        self.ended.callback(None)
+        self.launcher.on_shard_ended(self, reason)
+
+
+class _ShardLauncher:
+    """Starts the shard processes and restarts them if they exit unexpectedly."""
+
+    def __init__(self, args: list[str], num_shards: int) -> None:
+        self.args = args
+        self.stopping = False
+        self.processes = [self._spawn(i) for i in range(num_shards)]
+
+    def signal(self, signal_name: str) -> None:
+        """Sends a signal to all shards."""
+        for process in self.processes:
+            if process.transport.pid is not None:
+                process.transport.signalProcess(signal_name)
+
+    def on_shard_ended(self, process: _ShardProcess, reason) -> None:
+        """Restarts a shard that has exited (unless the server is stopping)."""
+        if self.stopping:
+            return
+        log.error("Shard %d exited unexpectedly: %s", process.index, reason.value)
+        self.processes[process.index] = self._spawn(process.index)
+
+    def _spawn(self, index: int) -> _ShardProcess:
+        process = _ShardProcess(self, index)
+        args = [sys.executable, "-m", "comprl.server", *self.args]
+        args += ["--shard-index", str(index)]
+        reactor.spawnProcess(  # type: ignore[attr-defined]
+            process, sys.executable, args, env=os.environ, childFDs={0: 0, 1: 1, 2: 2}
+        )
+        return process
+
+
+def launch_coordinator(shard_args: list[str], num_shards: int) -> None:
+    """Runs the coordinator and starts the shards.
+
+    Args:
+        shard_args: Command line arguments for the shards (the socket of the
+            coordinator and the shard index are added).
+        num_shards: Number of shard processes.
+    """
+    conf = get_config()
+    socket_dir = tempfile.mkdtemp(prefix="comprl-")
+    socket_path = os.path.join(socket_dir, "coordinator.sock")
+
+    coordinator = Coordinator()
+    factory = _CoordinatorFactory(coordinator)
+    port = reactor.listenUNIX(socket_path, factory)  # type: ignore[attr-defined]
+    update_loop = LoopingCall(coordinator.matchmaking._update)
+    update_loop.start(conf.server_update_interval)
+
+    log.info("Launching %d shards on port %d", num_shards, conf.port)
+    launcher = _ShardLauncher(
+        [*shard_args, "--coordinator-socket", socket_path], num_shards
+    )
+
+    def _reload_users(signum, frame):
+        coordinator.player_manager.clear_user_cache()
+        launcher.signal("HUP")
+
+    signal.signal(signal.SIGHUP, _reload_users)
+
+    if conf.profiling:
+        # toggle the sampling profiler of the coordinator and of the shards
+        toggle_profiler = signal.getsignal(signal.SIGUSR1)
+
+        def _toggle_profilers(signum, frame):
+            if callable(toggle_profiler):
+                toggle_profiler(signum, frame)
+            launcher.signal("USR1")
+
+        signal.signal(signal.SIGUSR1, _toggle_profilers)
+
+    def _stop_shards() -> defer.Deferred:
+        launcher.stopping = True
+        update_loop.stop()
+        shards = list(coordinator.shards.values())
+
+        def _disconnect(_) -> defer.Deferred:
+            # the shards stop once their connection to the coordinator is closed
+            for shard in shards:
+                shard.transport.loseConnection()
+            ended = defer.DeferredList(
+                [process.ended for process in launcher.processes]
+            )
+            ended.addTimeout(30, reactor)  # type: ignore[arg-type]
+            return ended.addErrback(
+                lambda failure: log.warning("Shards did not stop in time")
+            )
+
+        # The shards end their games first and report the results, which are rated
+        # when the factory stops (i.e. after the port is closed).
+        games_ended = defer.DeferredList(
+            [shard.callRemote(StopShard) for shard in shards], consumeErrors=True
+        )
+        games_ended.addTimeout(30, reactor)  # type: ignore[arg-type]
+        games_ended.addErrback(
+            lambda failure: log.warning("Shards did not end their games in time")
+        )
+        games_ended.addCallback(_disconnect)
+        return games_ended.addCallback(lambda _: port.stopListening())
+
+    reactor.addSystemEventTrigger(  # type: ignore[attr-defined]
+        "before", "shutdown", _stop_shards
+    )
+    try:
+        reactor.run()  # type: ignore[attr-defined]
+    finally:
+        shutil.rmtree(socket_dir, ignore_errors=True)
+
+
+def launch_shard(server: IServer, shard: Shard, coordinator_socket: str) -> None:
+    """Connects to the coordinator and runs the shard.
+
+    Args:
+        server: The server of the shard (using :class:`ShardMatchmaking`).
+        shard: The shard.
+        coordinator_socket: Path of the socket of the coordinator.
+    """
+    conf = get_config()
+    index = shard.index
+
+    def _connected(protocol: CoordinatorClient) -> defer.Deferred:
+        shard.coordinator = protocol
+        return protocol.callRemote(RegisterShard, shard=index)
+
+    def _listen(_) -> None:
+        log.info("Shard %d listening on port %d", index, conf.port)
+        networking.listen(server, conf.port, reuse_port=True)
+        LoopingCall(server.on_update).start(conf.server_update_interval)
+        # Ctrl+C is sent to the whole process group.  Ignore it, the shard stops when
+        # the coordinator closes the connection.
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    def _failed(failure) -> None:
+        log.error("Shard %d failed to start: %s", index, failure.getErrorMessage())
+        reactor.stop()  # type: ignore[attr-defined]
+
+    connectProtocol(
+        UNIXClientEndpoint(reactor, coordinator_socket), CoordinatorClient(shard)
+    ).addCallback(_connected).addCallbacks(_listen, _failed)
+    reactor.run()  # type: ignore[attr-defined]
@@ -2,6 +2,9 @@
 This module contains utility functions for the server.
 """
 
+import importlib.abc
+import importlib.util
+import os
 import uuid
 
 from comprl.shared.types import GameID, PlayerID
@@ -27,3 +30,34 @@ class IDGenerator:
             GameID: obtained id
         """
         return uuid.uuid4()
+
+
+def load_class(module_path: str, class_name: str):
+    """
+    Loads a a class from a module.
+    """
+    # get the module name by splitting the path and removing the file extension
+    name = module_path.split(os.sep)[-1].split(".")[0]
+
+    # load the module
+    spec = importlib.util.spec_from_file_location(name, module_path)
+
+    # check if the module could be loaded
+    if spec is None:
+        return None
+
+    # create the module
+    module = importlib.util.module_from_spec(spec)
+
+    # this is for mypy
+    if not isinstance(spec.loader, importlib.abc.Loader):
+        return None
+
+    # exec the module
+    try:
+        spec.loader.exec_module(module)
+    except FileNotFoundError:
+        return None
+
+    # finally get the class
+    return getattr(module, class_name)
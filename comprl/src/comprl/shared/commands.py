@@ -2,7 +2,75 @@
 Defines the commands used for the server client communication.
 """
 
-from twisted.protocols.amp import Integer, String, Boolean, Command, Float, ListOf
+import struct
+
+import numpy as np
+from twisted.protocols.amp import (
+    Argument,
+    Integer,
+    String,
+    Boolean,
+    Command,
+    Float,
+    ListOf,
+)
+
+
+class NumpyArray(Argument):
+    """AMP argument type for float arrays, encoded as packed little-endian binary.
+
+    The encoded value consists of a small header followed by the raw array data:
+
+    - dtype code (1 byte): ``f`` for float32, ``d`` for float64
+    - number of dimensions (1 byte)
+    - size of each dimension (4 bytes each, unsigned little-endian)
+
+    Compared to ``ListOf(Float())``, which sends every value as decimal string with its
+    own length prefix, this is much more compact and can be decoded directly into a
+    NumPy array without building intermediate Python lists.
+
+    Lists and arrays of other dtypes are converted to ``dtype`` before sending.
+    float32/float64 arrays are sent as they are, so the receiver gets the same dtype.
+    """
+
+    _DTYPES: dict[bytes, np.dtype] = {b"f": np.dtype("<f4"), b"d": np.dtype("<f8")}
+    _CODES: dict[np.dtype, bytes] = {
+        np.dtype(np.float32): b"f",
+        np.dtype(np.float64): b"d",
+    }
+
+    def __init__(self, dtype=np.float64, optional: bool = False) -> None:
+        """Initialize the argument.
+
+        Args:
+            dtype: dtype used for values that are not float32/float64 arrays.
+            optional: Whether the argument can be omitted.
+        """
+        super().__init__(optional)
+        self.dtype = np.dtype(dtype)
+        if self.dtype not in self._CODES:
+            raise ValueError(f"Unsupported dtype {self.dtype}")
+
+    def toString(self, inObject) -> bytes:
+        """Encode an array (or list of floats) to bytes."""
+        array = np.asarray(inObject)
+        if array.dtype not in self._CODES:
+            array = array.astype(self.dtype)
+        code = self._CODES[array.dtype]
+        header = struct.pack(f"<cB{array.ndim}I", code, array.ndim, *array.shape)
+        return header + array.astype(self._DTYPES[code], copy=False).tobytes()
+
+    def fromString(self, inString: bytes) -> np.ndarray:
+        """Decode bytes to a NumPy array."""
+        code, ndim = struct.unpack_from("<cB", inString)
+        if code not in self._DTYPES:
+            raise ValueError(f"Bad array dtype code {code!r}")
+        shape = struct.unpack_from(f"<{ndim}I", inString, 2)
+        dtype = self._DTYPES[code]
+        offset = 2 + 4 * ndim
+        array = np.frombuffer(inString, dtype=dtype, offset=offset)
+        # copy so that the receiver gets a writeable array in native byte order
+        return array.astype(dtype.newbyteorder("="), copy=True).reshape(shape)
 
 
 class Auth(Command):
@@ -45,12 +113,26 @@ class EndGame(Command):
 
 
 class Step(Command):
-    """Command for requesting the next step from the agent"""
+    """Command for requesting the next step from the agent.
+
+    Used for clients with protocol version 1.  Newer clients use :class:`PackedStep`.
+    """
 
     arguments = [(b"obv", ListOf(Float()))]
     response = [(b"action", ListOf(Float()))]
 
 
+class PackedStep(Command):
+    """Command for requesting the next step from the agent (binary encoding).
+
+    Same as :class:`Step` but observation and action are sent as packed binary
+    arrays (see :class:`NumpyArray`).  Requires protocol version 2.
+    """
+
+    arguments = [(b"obv", NumpyArray())]
+    response = [(b"action", NumpyArray())]
+
+
 class Error(Command):
     """Command interface for a generic error message"""
 
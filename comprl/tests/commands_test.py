@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from comprl.shared.commands import NumpyArray, PackedStep
+
+
+@pytest.mark.parametrize("dtype", [np.float32, np.float64])
+def test_numpy_array_roundtrip(dtype):
+    arg = NumpyArray()
+    array = np.arange(18, dtype=dtype).reshape(2, 9) / 7
+
+    decoded = arg.fromString(arg.toString(array))
+
+    assert decoded.dtype == dtype
+    assert decoded.shape == (2, 9)
+    np.testing.assert_array_equal(decoded, array)
+    # decoded arrays must be writeable
+    decoded[0, 0] = 42
+
+
+def test_numpy_array_from_list():
+    arg = NumpyArray()
+    values = [0.1, -2.5, 3.0, 1e-12]
+
+    encoded = arg.toString(values)
+    decoded = arg.fromString(encoded)
+
+    assert decoded.dtype == np.float64
+    np.testing.assert_array_equal(decoded, values)
+    # 1 byte dtype + 1 byte ndim + 4 bytes shape + 8 bytes per value
+    assert len(encoded) == 2 + 4 + 8 * len(values)
+
+
+def test_numpy_array_integer_input_is_converted():
+    arg = NumpyArray(dtype=np.float32)
+    decoded = arg.fromString(arg.toString(np.array([1, 2, 3])))
+
+    assert decoded.dtype == np.float32
+    np.testing.assert_array_equal(decoded, [1.0, 2.0, 3.0])
+
+
+def test_numpy_array_bad_dtype_code():
+    with pytest.raises(ValueError):
+        NumpyArray().fromString(b"x\x01\x01\x00\x00\x00\x00")
+
+
+def test_packed_step_arguments():
+    obv = np.linspace(-1, 1, 18)
+    box = PackedStep.makeArguments({"obv": obv}, None)
+    parsed = PackedStep.parseArguments(box, None)
+
+    np.testing.assert_array_equal(parsed["obv"], obv)
@@ -0,0 +1,204 @@
+import pytest
+from twisted.internet import task
+
+from comprl.server import config, interfaces
+from comprl.server.interfaces import IGame, IPlayer
+from comprl.server.managers import GameManager
+
+
+class FakePlayer(IPlayer):
+    def __init__(self, user_id):
+        super().__init__()
+        self.user_id = user_id
+        self.pending = None
+        self.num_requests = 0
+        self.disconnected = None
+
+    def authenticate(self, result_callback):
+        pass
+
+    def is_ready(self, result_callback):
+        return True
+
+    def notify_start(self, game_id):
+        pass
+
+    def get_action(self, obv, result_callback):
+        self.num_requests += 1
+        self.pending = result_callback
+
+    def notify_end(self, result, stats):
+        pass
+
+    def disconnect(self, reason):
+        self.disconnected = reason
+
+    def notify_error(self, error):
+        pass
+
+    def notify_info(self, msg):
+        pass
+
+
+class CountingGame(IGame):
+    def __init__(self, players):
+        super().__init__(players)
+        self.ticks = 0
+        self.max_ticks = 3
+        self.ended = False
+
+    def _update(self, actions):
+        self.ticks += 1
+        return self.ticks >= self.max_ticks
+
+    def _get_observation(self, id):
+        return [float(self.ticks)]
+
+    def _validate_action(self, action):
+        return True
+
+    def _player_won(self, id):
+        return False
+
+    def _player_stats(self, id):
+        return []
+
+    def _save_replay(self):
+        pass
+
+    def _end(self, reason="unknown"):
+        self.ended = True
+        super()._end(reason)
+
+
+@pytest.fixture
+def clock(tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        config,
+        "_config",
+        config.Config(data_dir=tmp_path, timeout=5, step_deadline_ms=100),
+    )
+    clock = task.Clock()
+    monkeypatch.setattr(interfaces, "reactor", clock)
+    return clock
+
+
+def test_single_deadline_timer(clock):
+    player1, player2 = FakePlayer(1), FakePlayer(2)
+    game = CountingGame([player1, player2])
+    game.step_deadline_ms = 0
+    game.start()
+
+    assert len(clock.getDelayedCalls()) == 1
+    deadline = clock.getDelayedCalls()[0]
+
+    clock.advance(3)
+    player1.pending([1.0])
+    player2.pending([2.0])
+    assert game.ticks == 1
+    # the same timer is moved forward for the next tick
+    assert clock.getDelayedCalls() == [deadline]
+    assert deadline.getTime() == 3 + 5
+
+    # additional answers in the same tick are ignored
+    player1.pending([1.0])
+    player1.pending([1.0])
+    player2.pending([2.0])
+    assert game.ticks == 2
+
+    player1.pending([1.0])
+    player2.pending([2.0])
+    assert game.ended
+    assert game.all_actions == [[[1.0], [2.0]]] * 3
+    assert clock.getDelayedCalls() == []
+
+
+def test_deadline_disconnects_late_players(clock):
+    player1, player2 = FakePlayer(1), FakePlayer(2)
+    game = CountingGame([player1, player2])
+    game.step_deadline_ms = 0
+    game.start()
+
+    player1.pending([1.0])
+    clock.advance(5)
+
+    assert player1.disconnected is None
+    assert player2.disconnected == "Timeout after 5s"
+
+    # an answer after the deadline does not advance the game
+    player2.pending([2.0])
+    assert game.ticks == 0
+
+    game.force_end(player2.id)
+    assert game.ended
+    assert game.get_result().disconnected_id == 2
+
+
+def test_step_deadline_uses_default_action(clock):
+    player1, player2 = FakePlayer(1), FakePlayer(2)
+    game = CountingGame([player1, player2])
+    game.start()
+
+    # without a previous action, the game waits for the player
+    player1.pending([1.0])
+    clock.advance(0.1)
+    assert game.ticks == 0
+    player2.pending([2.0])
+    assert game.ticks == 1
+
+    # the previous action is used for the late player
+    player1.pending([3.0])
+    clock.advance(0.1)
+    assert game.ticks == 2
+    assert game.all_actions[-1] == [[3.0], [2.0]]
+    assert game.late_actions == {player1.id: 0, player2.id: 1}
+
+    # the late player doesn't get a new observation until it has answered, its
+    # answer is used for the current step
+    assert (player1.num_requests, player2.num_requests) == (3, 2)
+    player2.pending([4.0])
+    player1.pending([5.0])
+    assert game.ended
+    assert game.all_actions[-1] == [[5.0], [4.0]]
+
+
+def test_step_deadline_timeout(clock):
+    player1, player2 = FakePlayer(1), FakePlayer(2)
+    game = CountingGame([player1, player2])
+    game.max_ticks = 100
+    game.start()
+    player1.pending([1.0])
+    player2.pending([2.0])
+
+    # the late player is still disconnected after the timeout
+    for _ in range(40):
+        player1.pending([1.0])
+        clock.advance(0.1)
+    assert game.ticks == 41
+    assert player2.disconnected is None
+    player1.pending([1.0])
+    clock.advance(1.0)
+    assert player2.disconnected == "Timeout after 5s"
+
+
+def test_force_game_end_only_ends_games_of_player(clock):
+    class IndexOnlyGameManager(GameManager):
+        def end_game(self, game):
+            # don't store the result
+            self._remove_game(game)
+
+    manager = IndexOnlyGameManager(CountingGame)
+    players = [FakePlayer(i) for i in range(4)]
+    game1 = manager.start_game(players[:2])
+    game2 = manager.start_game(players[2:])
+
+    manager.force_game_end(players[1].id)
+
+    assert game1.ended
+    assert not game2.ended
+    assert list(manager.games) == [game2.id]
+    assert manager._games_by_player == {p.id: {game2.id} for p in players[2:]}
+
+    # unknown players are ignored
+    manager.force_game_end(players[0].id)
+    assert list(manager.games) == [game2.id]
@@ -0,0 +1,262 @@
+import subprocess
+import sys
+import textwrap
+import uuid
+
+import pytest
+from twisted.internet import task
+
+from comprl.server import config, interfaces
+from comprl.server.game_worker import (
+    GameWorker,
+    RemoteGame,
+    WorkerGames,
+    _encode,
+    _read_message,
+)
+from comprl.server.interfaces import IPlayer
+from comprl.server.replays import Replay, shutdown_replay_writer
+from comprl.server.util import load_class
+
+GAME_SOURCE = textwrap.dedent("""
+    from comprl.server.interfaces import IGame
+
+
+    class CountingGame(IGame):
+        def __init__(self, players):
+            super().__init__(players)
+            self.total = 0.0
+
+        def _update(self, actions):
+            for player_id, action in actions.items():
+                self.total += action[0]
+                self.scores[player_id] += action[0]
+            return self.total >= 4
+
+        def _get_observation(self, id):
+            print("this must not break the worker protocol")
+            return [self.total]
+
+        def _validate_action(self, action):
+            return len(action) == 1 and action[0] >= 0
+
+        def _player_won(self, id):
+            return all(self.scores[id] > s for p, s in self.scores.items() if p != id)
+
+        def _player_stats(self, id):
+            return [self.scores[id]]
+
+
+    class IdleGame(CountingGame):
+        def _default_action(self, id):
+            return [0.0]
+    """)
+
+
+@pytest.fixture
+def game_path(tmp_path):
+    path = tmp_path / "counting_game.py"
+    path.write_text(GAME_SOURCE)
+    return str(path)
+
+
+class FakePlayer(IPlayer):
+    def __init__(self, user_id):
+        super().__init__()
+        self.user_id = user_id
+        self.observations = []
+        self.pending = None
+        self.results = []
+        self.disconnected = None
+
+    def authenticate(self, result_callback):
+        pass
+
+    def is_ready(self, result_callback):
+        return True
+
+    def notify_start(self, game_id):
+        pass
+
+    def get_action(self, obv, result_callback):
+        self.observations.append(obv)
+        self.pending = result_callback
+
+    def notify_end(self, result, stats):
+        self.results.append((result, stats))
+
+    def disconnect(self, reason):
+        self.disconnected = reason
+
+    def notify_error(self, error):
+        pass
+
+    def notify_info(self, msg):
+        pass
+
+
+class FakeWorker:
+    """Relays messages of a RemoteGame directly to WorkerGames."""
+
+    def __init__(self, game_type):
+        self.worker_games = WorkerGames(game_type)
+        self.games = {}
+
+    def add_game(self, game):
+        self.games[game.id] = game
+
+    def remove_game(self, game):
+        self.games.pop(game.id, None)
+
+    def send(self, message):
+        reply = self.worker_games.handle(message)
+        if reply is not None:
+            kind, game_id, payload = reply
+            self.games[game_id].on_worker_message(kind, payload)
+
+
+def test_worker_games(game_path):
+    worker = WorkerGames(load_class(game_path, "CountingGame"))
+    game_id = uuid.uuid4()
+    p1, p2 = uuid.uuid4(), uuid.uuid4()
+
+    kind, _, state = worker.handle(("start", game_id, [(p1, 1), (p2, 2)]))
+    assert kind == "state"
+    assert not state["finished"]
+    assert state["observations"] == {p1: [0.0], p2: [0.0]}
+    # there is no previous action yet
+    assert state["default_actions"] == {p1: None, p2: None}
+
+    # invalid actions are reported without updating the game
+    _, _, state = worker.handle(("step", game_id, {p1: [1.0], p2: [-1.0]}))
+    assert state["invalid"] == [p2]
+    assert state["scores"] == {p1: 0.0, p2: 0.0}
+
+    _, _, state = worker.handle(("step", game_id, {p1: [2.0], p2: [0.0]}))
+    assert state["observations"] == {p1: [2.0], p2: [2.0]}
+    assert state["default_actions"] == {p1: [2.0], p2: [0.0]}
+
+    _, _, state = worker.handle(("step", game_id, {p1: [2.0], p2: [1.0]}))
+    assert state["finished"]
+    assert state["won"] == {p1: True, p2: False}
+    assert state["stats"] == {p1: [4.0], p2: [1.0]}
+    assert state["replay"] is not None
+    assert game_id not in worker.games
+
+    # messages for finished games are ignored
+    assert worker.handle(("end", game_id, p1)) is None
+
+
+def test_remote_game(game_path, tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "_config", config.Config(data_dir=tmp_path))
+    worker = FakeWorker(load_class(game_path, "CountingGame"))
+    player1, player2 = FakePlayer(user_id=1), FakePlayer(user_id=2)
+    game = RemoteGame([player1, player2], worker)
+    finished = []
+    game.add_finish_callback(finished.append)
+
+    game.start()
+    assert player1.observations == [[0.0]]
+    for _ in range(2):
+        player1.pending([1.0])
+        player2.pending([1.0])
+
+    assert finished == [game]
+    assert worker.games == {}
+    assert player1.results == [(False, [2.0])]
+    result = game.get_result()
+    assert result.score_user_1 == 2.0
+    assert result.score_user_2 == 2.0
+
+    shutdown_replay_writer()
+    with Replay(tmp_path / "game_actions" / f"{game.id}.npz") as replay:
+        assert replay["actions"].shape == (2, 2, 1)
+
+
+def test_remote_game_invalid_action(game_path, tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "_config", config.Config(data_dir=tmp_path))
+    worker = FakeWorker(load_class(game_path, "CountingGame"))
+    player1, player2 = FakePlayer(user_id=1), FakePlayer(user_id=2)
+    game = RemoteGame([player1, player2], worker)
+
+    game.start()
+    player1.pending([1.0])
+    player2.pending([-1.0])
+    assert player2.disconnected == "Invalid action"
+
+    # the server ends the game once the player is disconnected
+    game.force_end(player2.id)
+    assert worker.games == {}
+    assert player1.results == [(False, [0.0])]
+    assert player2.results == []
+    result = game.get_result()
+    assert result.disconnected_id == 2
+    shutdown_replay_writer()
+
+
+def test_remote_game_uses_default_action_of_game(game_path, tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        config, "_config", config.Config(data_dir=tmp_path, step_deadline_ms=50)
+    )
+    clock = task.Clock()
+    monkeypatch.setattr(interfaces, "reactor", clock)
+    worker = FakeWorker(load_class(game_path, "IdleGame"))
+    player1, player2 = FakePlayer(user_id=1), FakePlayer(user_id=2)
+    game = RemoteGame([player1, player2], worker)
+
+    game.start()
+    # player 2 is late in the first step, in which there is no previous action
+    player1.pending([1.0])
+    clock.advance(0.05)
+    assert game.late_actions[player2.id] == 1
+    assert game.scores == {player1.id: 1.0, player2.id: 0.0}
+    assert len(player1.observations) == 2
+    shutdown_replay_writer()
+
+
+def test_game_worker_splits_messages():
+    class Game:
+        def __init__(self):
+            self.id = uuid.uuid4()
+            self.messages = []
+
+        def on_worker_message(self, kind, payload):
+            self.messages.append((kind, payload))
+
+    worker = GameWorker(pool=None, index=0)
+    game = Game()
+    worker.add_game(game)
+    frames = [_encode(("state", game.id, i)) for i in range(3)]
+    data = b"".join(frames)
+    split = len(frames[0]) + 5
+
+    # messages may be split arbitrarily by the transport
+    worker.childDataReceived(1, data[:3])
+    assert game.messages == []
+    worker.childDataReceived(1, data[3:split])
+    assert game.messages == [("state", 0)]
+    worker.childDataReceived(1, data[split:])
+    assert game.messages == [("state", 0), ("state", 1), ("state", 2)]
+    assert worker._buffer == b""
+
+
+def test_worker_process(game_path):
+    worker = subprocess.Popen(
+        [sys.executable, "-m", "comprl.server.game_worker", game_path, "CountingGame"],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+    )
+    game_id = uuid.uuid4()
+    p1, p2 = uuid.uuid4(), uuid.uuid4()
+
+    worker.stdin.write(_encode(("start", game_id, [(p1, 1), (p2, 2)])))
+    worker.stdin.flush()
+    kind, reply_game_id, state = _read_message(worker.stdout)
+
+    assert kind == "state"
+    assert reply_game_id == game_id
+    assert state["observations"] == {p1: [0.0], p2: [0.0]}
+
+    # the worker exits once its input is closed
+    worker.stdin.close()
+    assert worker.wait(timeout=10) == 0
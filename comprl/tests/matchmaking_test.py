@@ -0,0 +1,371 @@
+import math
+import types
+import uuid
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+from openskill.models import PlackettLuce
+from twisted.internet import task
+
+from comprl.server import managers, matchmaking
+from comprl.server.managers import MatchmakingManager, QueueEntry
+
+
+class FakePlayerManager:
+    def __init__(self, player_ids):
+        self.auth_players = {
+            pid: (types.SimpleNamespace(id=pid), 0) for pid in player_ids
+        }
+
+    def get_player_by_id(self, player_id):
+        entry = self.auth_players.get(player_id)
+        return entry[0] if entry else None
+
+
+class FakeGameManager:
+    def __init__(self):
+        self.started_games = []
+
+    def start_game(self, players, store_result=True):
+        self.started_games.append(tuple(p.id for p in players))
+        return types.SimpleNamespace(add_finish_callback=lambda cb: None)
+
+
+def _random_queue(rng, n):
+    now = datetime.now()
+    entries = []
+    for i in range(n):
+        user = types.SimpleNamespace(
+            user_id=int(rng.integers(0, n // 2 + 1)),
+            username=f"user{i}",
+            role=str(rng.choice(["user", "bot"])),
+            mu=float(rng.uniform(15, 35)),
+            sigma=float(rng.uniform(1, 8.333)),
+        )
+        waiting = timedelta(seconds=float(rng.uniform(0, 600)))
+        entries.append(QueueEntry(uuid.uuid4(), user, now - waiting))
+    return entries
+
+
+def _reference_matches(entries, threshold, time_bonus):
+    """Pairwise first-fit matching as it was implemented before vectorization."""
+    model = PlackettLuce()
+    now = datetime.now()
+    queue = list(entries)
+    matches = []
+
+    def quality(p1, p2):
+        waiting = (now - p1.in_queue_since + (now - p2.in_queue_since)).total_seconds()
+        bonus = max(0.0, (waiting / 60 - 1) * time_bonus)
+        r1 = model.create_rating([p1.user.mu, p1.user.sigma])
+        r2 = model.create_rating([p2.user.mu, p2.user.sigma])
+        return model.predict_draw([[r1], [r2]]) + bonus
+
+    def search(start):
+        for i in range(start, len(queue)):
+            for j in range(i + 1, len(queue)):
+                p1, p2 = queue[i], queue[j]
+                if p1.user.user_id == p2.user.user_id:
+                    continue
+                if p1.user.role == "bot" and p2.user.role == "bot":
+                    continue
+                if quality(p1, p2) > threshold:
+                    matches.append((p1.player_id, p2.player_id))
+                    queue.remove(p1)
+                    queue.remove(p2)
+                    search(i)
+                    return
+
+    search(0)
+    return matches
+
+
+def test_draw_probability_matches_openskill():
+    model = PlackettLuce()
+    rng = np.random.default_rng(42)
+    mu = rng.uniform(0, 50, 20)
+    sigma = rng.uniform(0.5, 10, 20)
+
+    draw_prob = matchmaking.draw_probability_matrix(mu, sigma, model.beta)
+
+    for i in range(20):
+        for j in range(20):
+            r1 = model.create_rating([mu[i], sigma[i]])
+            r2 = model.create_rating([mu[j], sigma[j]])
+            expected = model.predict_draw([[r1], [r2]])
+            # the error function is approximated (error < 1e-7)
+            assert draw_prob[i, j] == pytest.approx(expected, abs=2e-7)
+
+
+def test_erf():
+    x = np.linspace(-6, 6, 100001)
+    expected = np.array([math.erf(v) for v in x])
+    np.testing.assert_allclose(matchmaking.erf(x), expected, rtol=0, atol=1e-7)
+    assert matchmaking.erf(np.array([0.0, np.inf, -np.inf])).tolist() == [
+        pytest.approx(0.0, abs=1e-7),
+        1.0,
+        -1.0,
+    ]
+
+
+def test_first_fit_matches():
+    matchable = np.array(
+        [
+            [0, 0, 1, 1],
+            [0, 0, 1, 1],
+            [1, 1, 0, 0],
+            [1, 1, 0, 0],
+        ],
+        dtype=bool,
+    )
+    assert matchmaking.first_fit_matches(matchable) == [(0, 2), (1, 3)]
+    # stop as soon as less than 3 players would be left
+    assert matchmaking.first_fit_matches(matchable, min_queue_length=3) == [(0, 2)]
+
+
+def test_max_weight_matches():
+    quality = np.array(
+        [
+            [0.0, 0.9, 0.85, 0.0],
+            [0.9, 0.0, 0.0, 0.95],
+            [0.85, 0.0, 0.0, 0.0],
+            [0.0, 0.95, 0.0, 0.0],
+        ]
+    )
+    matchable = quality > 0.8
+
+    # first fit takes (0, 1) and leaves 2 and 3 unmatched
+    assert matchmaking.first_fit_matches(matchable) == [(0, 1)]
+    assert matchmaking.select_matches(
+        matchmaking.MatchingStrategy.MAX_WEIGHT, quality, matchable
+    ) == [(1, 3), (0, 2)]
+    assert matchmaking.max_weight_matches(quality, matchable, min_queue_length=3) == [
+        (1, 3)
+    ]
+
+
+@pytest.mark.parametrize("use_index", [False, True])
+@pytest.mark.parametrize("seed", range(5))
+def test_matchmaking_manager_same_as_pairwise(seed, use_index):
+    rng = np.random.default_rng(seed)
+    entries = _random_queue(rng, 30)
+
+    player_manager = FakePlayerManager([e.player_id for e in entries])
+    game_manager = FakeGameManager()
+    manager = MatchmakingManager(player_manager, game_manager)
+    manager._index_min_queue_length = 2 if use_index else 0
+    manager._percentage_min_players_waiting = 0.0
+    manager._match_quality_threshold = 0.5
+    manager._queue = {e.player_id: e for e in entries}
+
+    manager._search_for_matches()
+
+    expected = _reference_matches(entries, 0.5, manager._percental_time_bonus)
+    assert len(expected) > 0
+    assert game_manager.started_games == expected
+    matched = {pid for match in expected for pid in match}
+    assert list(manager._queue) == [
+        e.player_id for e in entries if e.player_id not in matched
+    ]
+
+
+def test_pair_quality_cache_same_as_full_computation():
+    model = PlackettLuce()
+    rng = np.random.default_rng(0)
+    n = 40
+    mu = rng.uniform(15, 35, n)
+    sigma = rng.uniform(1, 8.333, n)
+    queued_at = rng.uniform(0, 600, n)
+    user_ids = rng.integers(0, n // 2, n)
+    is_bot = rng.random(n) < 0.3
+
+    cache = matchmaking.PairQualityCache(model.beta)
+    cache.set_parameters(0.5, 0.1)
+    # add the players in batches and remove some in between
+    for batch in np.array_split(np.arange(n), 4):
+        cache.keep(rng.random(len(cache)) < 0.7)
+        cache.add(
+            list(batch),
+            mu[batch],
+            sigma[batch],
+            queued_at[batch],
+            user_ids[batch],
+            is_bot[batch],
+        )
+
+    idx = np.array(cache.keys)
+    now = 700.0
+    quality = matchmaking.draw_probability_matrix(
+        mu[idx], sigma[idx], model.beta
+    ) + matchmaking.waiting_bonus_matrix(now - queued_at[idx], 0.1)
+    matchable = (quality > 0.5) & matchmaking.allowed_pairs_mask(
+        user_ids[idx], is_bot[idx]
+    )
+
+    np.testing.assert_allclose(cache.match_quality(now), quality, rtol=1e-12)
+    np.testing.assert_array_equal(cache.matchable(now), matchable)
+    assert cache.next_eligible_at() < now
+    rows, cols = np.nonzero(matchable)
+    np.testing.assert_allclose(
+        cache.pair_match_quality(rows, cols, now), quality[rows, cols], rtol=1e-12
+    )
+
+    # changing the parameters updates the eligibility
+    assert cache.set_parameters(0.9, 0.0)
+    assert not cache.set_parameters(0.9, 0.0)
+    np.testing.assert_array_equal(
+        cache.matchable(now), (cache.draw_prob > 0.9) & cache.allowed
+    )
+
+
+def test_matchmaking_manager_rates_only_new_entries(monkeypatch):
+    rng = np.random.default_rng(1)
+    entries = _random_queue(rng, 10)
+    for entry in entries:
+        # nobody is matchable yet
+        entry.user.role = "bot"
+
+    player_manager = FakePlayerManager([e.player_id for e in entries])
+    game_manager = FakeGameManager()
+    manager = MatchmakingManager(player_manager, game_manager)
+    manager._percentage_min_players_waiting = 0.0
+    manager._queue = {e.player_id: e for e in entries}
+
+    rated = []
+    draw_probability = matchmaking.draw_probability
+
+    def _draw_probability(mu1, sigma1, mu2, sigma2, beta):
+        rated.append((len(mu1), len(mu2)))
+        return draw_probability(mu1, sigma1, mu2, sigma2, beta)
+
+    monkeypatch.setattr(matchmaking, "draw_probability", _draw_probability)
+
+    manager._search_for_matches()
+    assert rated == [(10, 10)]
+    assert game_manager.started_games == []
+
+    # the queue didn't change and no pair can become matchable
+    manager._search_for_matches()
+    assert rated == [(10, 10)]
+
+    user = types.SimpleNamespace(
+        user_id=1000, username="new", role="user", mu=25.0, sigma=8.333
+    )
+    new_entry = QueueEntry(uuid.uuid4(), user, datetime.now())
+    player_manager.auth_players[new_entry.player_id] = (
+        types.SimpleNamespace(id=new_entry.player_id),
+        0,
+    )
+    manager._queue[new_entry.player_id] = new_entry
+    manager._search_for_matches()
+
+    assert rated == [(10, 10), (1, 11)]
+    assert len(game_manager.started_games) == 1
+    assert new_entry.player_id in game_manager.started_games[0]
+
+
+@pytest.mark.parametrize("strategy", list(matchmaking.MatchingStrategy))
+@pytest.mark.parametrize("threshold,time_bonus", [(0.8, 0.1), (0.5, 0.0), (0.95, 1.0)])
+def test_rating_index_same_as_all_pairs(strategy, threshold, time_bonus):
+    model = PlackettLuce()
+    rng = np.random.default_rng(3)
+    n = 300
+    mu = rng.normal(25, 8, n)
+    sigma = rng.uniform(1, 8.333, n)
+    queued_at = rng.uniform(0, 300, n)
+    user_ids = rng.integers(0, n // 2, n)
+    is_bot = rng.random(n) < 0.3
+    now = 300.0
+
+    index = matchmaking.RatingIndex(model.beta)
+    for batch in np.array_split(rng.permutation(n), 3):
+        index.add(
+            list(batch),
+            mu[batch],
+            sigma[batch],
+            queued_at[batch],
+            user_ids[batch],
+            is_bot[batch],
+        )
+    index.keep(np.arange(n) % 7 != 0)
+    assert (np.diff(index.mu) >= 0).all()
+
+    # queue order: by key
+    queue = np.array(sorted(index.keys))
+    position = {key: k for k, key in enumerate(queue)}
+    positions = np.array([position[key] for key in index.keys])
+    i, j, quality = index.matchable_pairs(now, threshold, time_bonus)
+    matches = matchmaking.select_matches_from_pairs(
+        strategy,
+        np.minimum(positions[i], positions[j]),
+        np.maximum(positions[i], positions[j]),
+        quality,
+        len(queue),
+    )
+
+    full_quality = matchmaking.draw_probability_matrix(
+        mu[queue], sigma[queue], model.beta
+    ) + matchmaking.waiting_bonus_matrix(now - queued_at[queue], time_bonus)
+    matchable = (full_quality > threshold) & matchmaking.allowed_pairs_mask(
+        user_ids[queue], is_bot[queue]
+    )
+    # the index only rates a fraction of the pairs but finds all matchable ones
+    assert len(i) == np.triu(matchable, k=1).sum()
+    assert matches == matchmaking.select_matches(strategy, full_quality, matchable)
+
+
+def test_matchmaking_manager_requeues_players_if_user_is_missing(monkeypatch):
+    class PlayerManager(FakePlayerManager):
+        def __init__(self, player_ids):
+            super().__init__(player_ids)
+            self.updates = {}
+            self.games = []
+
+        def get_matchmaking_parameters(self, user_id):
+            if user_id == 2:
+                raise ValueError(f"User with ID {user_id} not found.")
+            return 25.0, 8.333
+
+        def update_all_matchmaking_parameters(self, ratings, history=None, games=None):
+            self.updates.update(ratings)
+            self.games.extend(games or [])
+
+    clock = task.Clock()
+    monkeypatch.setattr(managers, "reactor", clock)
+    player_ids = [uuid.uuid4() for _ in range(4)]
+    player_manager = PlayerManager(player_ids)
+    manager = MatchmakingManager(player_manager, FakeGameManager())
+    requeued = []
+    manager.try_match = requeued.append
+
+    for (user1, player1), (user2, player2) in [
+        ((1, player_ids[0]), (2, player_ids[1])),
+        ((3, player_ids[2]), (4, player_ids[3])),
+    ]:
+        result = types.SimpleNamespace(
+            game_id=uuid.uuid4(),
+            user1_id=user1,
+            user2_id=user2,
+            score_user_1=1.0,
+            score_user_2=0.0,
+        )
+        manager._end_game(
+            types.SimpleNamespace(
+                get_result=lambda result=result: result,
+                players={
+                    player1: types.SimpleNamespace(id=player1),
+                    player2: types.SimpleNamespace(id=player2),
+                },
+            )
+        )
+
+    # the games that ended in the same reactor iteration are rated together
+    assert len(clock.getDelayedCalls()) == 1
+    clock.advance(0)
+
+    # the game of the deleted user is skipped, the other one is rated
+    assert set(player_manager.updates) == {3, 4}
+    # the results of both games are written together with the rating updates
+    assert [(g.user1_id, g.user2_id) for g in player_manager.games] == [(1, 2), (3, 4)]
+    assert requeued == player_ids
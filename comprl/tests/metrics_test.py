@@ -0,0 +1,70 @@
+import pytest
+from twisted.internet import task
+from twisted.web.test.requesthelper import DummyRequest
+
+from comprl.server import metrics
+
+
+def test_render():
+    registry = metrics.Registry()
+    counter = registry.counter("games", "Number of games.", label="state")
+    gauge = registry.gauge("players", "Number of players.")
+    histogram = registry.histogram("latency_seconds", "Latency.", buckets=[0.1, 1])
+
+    counter.inc(label="win")
+    counter.inc(2, label="draw")
+    gauge.set_function(lambda: 3)
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.observe(value)
+
+    assert registry.render() == (
+        "# HELP games Number of games.\n"
+        "# TYPE games counter\n"
+        'games_total{state="draw"} 2.0\n'
+        'games_total{state="win"} 1.0\n'
+        "# HELP players Number of players.\n"
+        "# TYPE players gauge\n"
+        "players 3.0\n"
+        "# HELP latency_seconds Latency.\n"
+        "# TYPE latency_seconds histogram\n"
+        'latency_seconds_bucket{le="0.1"} 2.0\n'
+        'latency_seconds_bucket{le="1.0"} 3.0\n'
+        'latency_seconds_bucket{le="+Inf"} 4.0\n'
+        "latency_seconds_sum 2.65\n"
+        "latency_seconds_count 4.0\n"
+    )
+
+    with pytest.raises(ValueError):
+        registry.gauge("players", "Duplicate.")
+
+
+def test_metrics_resource():
+    registry = metrics.Registry()
+    registry.gauge("players", "Number of players.").set(1)
+    request = DummyRequest([b""])
+
+    body = metrics.MetricsResource(registry).render_GET(request)
+
+    assert body == registry.render().encode()
+    assert request.responseHeaders.getRawHeaders(b"content-type")[0].startswith(
+        b"text/plain"
+    )
+
+
+def test_reactor_lag(monkeypatch):
+    clock = task.Clock()
+    monkeypatch.setattr(metrics, "reactor", clock)
+    histogram = metrics.Histogram("lag", "Lag.", buckets=[0.1])
+    monitor = metrics.ReactorLagMonitor(histogram, interval=0.5)
+    monitor._loop.clock = clock
+
+    monitor.start()
+    clock.advance(0.5)
+    # the reactor was blocked for 0.3s
+    clock.advance(0.8)
+
+    assert histogram.count == 2
+    assert list(histogram.samples())[:2] == [
+        ("lag_bucket", {"le": "0.1"}, 1),
+        ("lag_bucket", {"le": "+Inf"}, 2),
+    ]
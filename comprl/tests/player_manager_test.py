@@ -0,0 +1,114 @@
+import types
+
+import pytest
+
+from comprl.server import config
+from comprl.server.data import UserData
+from comprl.server.data.sql_backend import create_database_tables
+from comprl.server.data.write_behind import (
+    get_write_behind_store,
+    shutdown_write_behind_store,
+)
+from comprl.server.managers import PlayerManager
+
+
+@pytest.fixture
+def user_data(tmp_path, monkeypatch):
+    db_file = tmp_path / "database.db"
+    create_database_tables(db_file)
+    monkeypatch.setattr(config, "_config", config.Config(database_path=db_file))
+    yield UserData(db_file)
+    shutdown_write_behind_store()
+
+
+def _connect(player_manager):
+    player = types.SimpleNamespace(id=object(), user_id=None)
+    player_manager.add(player)
+    return player
+
+
+def test_auth_uses_cache(user_data, monkeypatch):
+    user_id = user_data.add(user_name="alice", user_password="pw", user_token="tok")
+    player_manager = PlayerManager()
+
+    player = _connect(player_manager)
+    assert player_manager.auth(player.id, "tok")
+    assert player.user_id == user_id
+    assert not player_manager.auth(_connect(player_manager).id, "wrong")
+
+    # no database access once the user is cached
+    def _fail(*args, **kwargs):
+        raise AssertionError("database was accessed")
+
+    monkeypatch.setattr(UserData, "get", _fail)
+    monkeypatch.setattr(UserData, "get_user_by_token", _fail)
+
+    assert player_manager.auth(_connect(player_manager).id, "tok")
+    user = player_manager.get_user(user_id)
+    assert user is not None
+    assert user.username == "alice"
+    assert player_manager.get_matchmaking_parameters(user_id) == (user.mu, user.sigma)
+
+
+def test_rating_update_is_written_through(user_data):
+    user_id = user_data.add(user_name="alice", user_password="pw", user_token="tok")
+    player_manager = PlayerManager()
+    player_manager.get_user(user_id)
+
+    player_manager.update_matchmaking_parameters(user_id, 30.0, 4.0)
+
+    assert player_manager.get_matchmaking_parameters(user_id) == (30.0, 4.0)
+    # a reload from the database must not return the old values while the update is
+    # still pending
+    player_manager.clear_user_cache()
+    assert player_manager.get_matchmaking_parameters(user_id) == (30.0, 4.0)
+
+    get_write_behind_store().flush()
+    assert user_data.get_matchmaking_parameters(user_id) == (30.0, 4.0)
+
+
+def test_cache_invalidation(user_data, monkeypatch):
+    user_id = user_data.add(user_name="alice", user_password="pw", user_token="tok")
+    player_manager = PlayerManager()
+    player_manager.get_user(user_id)
+
+    # changes made directly in the database are not visible until reload
+    user_data.set_matchmaking_parameters(user_id, 20.0, 2.0)
+    assert player_manager.get_matchmaking_parameters(user_id) != (20.0, 2.0)
+
+    player_manager.clear_user_cache()
+    assert player_manager.get_matchmaking_parameters(user_id) == (20.0, 2.0)
+
+    user_data.set_matchmaking_parameters(user_id, 21.0, 3.0)
+    player_manager.invalidate_user(user_id)
+    assert player_manager.get_matchmaking_parameters(user_id) == (21.0, 3.0)
+
+    # entries expire after the configured TTL
+    user_data.set_matchmaking_parameters(user_id, 22.0, 4.0)
+    player_manager._user_cache_ttl = 0.0
+    assert player_manager.get_matchmaking_parameters(user_id) == (22.0, 4.0)
+
+    assert player_manager.get_user(12345) is None
+
+
+def test_user_reloaded_if_rating_was_written_while_loading(user_data, monkeypatch):
+    user_id = user_data.add(user_name="alice", user_password="pw", user_token="tok")
+    player_manager = PlayerManager()
+    store = get_write_behind_store()
+
+    get = UserData.get
+    loads = []
+
+    def _get(self, uid):
+        user = get(self, uid)
+        if not loads:
+            # the rating update is committed after the old value was read
+            store.set_matchmaking_parameters(user_id, 30.0, 4.0)
+            store.flush()
+        loads.append(user)
+        return user
+
+    monkeypatch.setattr(UserData, "get", _get)
+
+    assert player_manager.get_matchmaking_parameters(user_id) == (30.0, 4.0)
+    assert len(loads) == 2
@@ -0,0 +1,67 @@
+import threading
+import time
+
+from comprl.server import metrics, profiling
+
+
+def test_span(monkeypatch):
+    monkeypatch.setattr(profiling, "_span_histograms", {})
+    monkeypatch.setattr(metrics, "REGISTRY", metrics.Registry())
+
+    # spans do nothing unless profiling is enabled
+    monkeypatch.setattr(profiling, "_enabled", False)
+    with profiling.span("test"):
+        pass
+    assert metrics.REGISTRY.metrics == {}
+
+    monkeypatch.setattr(profiling, "_enabled", True)
+    for _ in range(2):
+        with profiling.span("test"):
+            pass
+
+    histogram = metrics.REGISTRY.metrics["comprl_span_test_seconds"]
+    assert isinstance(histogram, metrics.Histogram)
+    assert histogram.count == 2
+
+
+def _busy_wait(event):
+    while not event.is_set():
+        time.sleep(0.001)
+
+
+def test_sampling_profiler():
+    stop = threading.Event()
+    thread = threading.Thread(target=_busy_wait, args=(stop,))
+    thread.start()
+    assert thread.ident is not None
+    profiler = profiling.SamplingProfiler(interval=0.001, thread_id=thread.ident)
+
+    profiler.start()
+    time.sleep(0.05)
+    profiler.stop()
+    stop.set()
+    thread.join()
+
+    assert not profiler.running
+    lines = profiler.folded().splitlines()
+    assert lines
+    stack, count = lines[0].rsplit(" ", 1)
+    assert int(count) > 0
+    # stacks start at the root frame
+    frames = stack.split(";")
+    assert frames[0].startswith("_bootstrap (threading.py:")
+    assert frames[-1].startswith("_busy_wait (profiling_test.py:")
+
+
+def test_profiler_toggle(tmp_path):
+    toggle = profiling.ProfilerToggle(tmp_path / "profiles", interval=0.001)
+
+    assert toggle.toggle() is None
+    assert toggle.profiler.running
+    time.sleep(0.01)
+    path = toggle.toggle()
+
+    assert not toggle.profiler.running
+    assert path is not None
+    assert path.parent == tmp_path / "profiles"
+    assert path.read_text() == toggle.profiler.folded()
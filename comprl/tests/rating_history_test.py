@@ -0,0 +1,49 @@
+from datetime import datetime, timedelta
+
+from comprl.server.data import RatingHistoryData, UserData
+from comprl.server.data.interfaces import RatingHistoryEntry
+from comprl.server.data.sql_backend import create_database_tables
+from comprl.server.data.write_behind import WriteBehindStore
+
+
+def test_rating_history(tmp_path):
+    db_file = tmp_path / "database.db"
+    create_database_tables(db_file)
+    user_data = UserData(db_file)
+    user1 = user_data.add(user_name="u1", user_password="pw", user_token="t1")
+    user2 = user_data.add(user_name="u2", user_password="pw", user_token="t2")
+
+    # one game every 20 minutes over 5 hours
+    start = datetime(2024, 1, 1)
+    history = []
+    for i in range(15):
+        ts = start + timedelta(minutes=20 * i)
+        history.append(RatingHistoryEntry(f"game{i}", user1, 25.0 + i, 8.0, ts))
+        history.append(RatingHistoryEntry(f"game{i}", user2, 25.0 - i, 8.0, ts))
+
+    store = WriteBehindStore(db_file, flush_interval=60, max_records=1000)
+    store.set_all_matchmaking_parameters(
+        {user1: (39.0, 8.0), user2: (11.0, 8.0)}, history
+    )
+    assert store.num_pending == 32
+    store.close()
+
+    assert user_data.get_matchmaking_parameters(user1) == (39.0, 8.0)
+
+    history_data = RatingHistoryData(db_file)
+    entries = history_data.get(user1)
+    assert entries == [e for e in history if e.user_id == user1]
+
+    assert [e.game_id for e in history_data.get(user2, limit=3)] == [
+        "game12",
+        "game13",
+        "game14",
+    ]
+
+    # last entry of each hour
+    hourly = history_data.get(user1, bucket_seconds=3600)
+    assert [e.game_id for e in hourly] == [f"game{i}" for i in (2, 5, 8, 11, 14)]
+    hourly = history_data.get(
+        user1, bucket_seconds=3600, limit=2, since=start + timedelta(hours=1)
+    )
+    assert [e.mu for e in hourly] == [36.0, 39.0]
@@ -0,0 +1,109 @@
+import numpy as np
+import pytest
+from openskill.models import PlackettLuce
+
+from comprl.server import rating
+
+
+def _rate_with_openskill(model, ratings, game):
+    r1 = model.create_rating(list(ratings[game.user1_id]))
+    r2 = model.create_rating(list(ratings[game.user2_id]))
+    [[r1], [r2]] = model.rate(
+        [[r1], [r2]], scores=[game.score_user_1, game.score_user_2]
+    )
+    ratings[game.user1_id] = (r1.mu, r1.sigma)
+    ratings[game.user2_id] = (r2.mu, r2.sigma)
+
+
+def test_rate_same_as_openskill():
+    model = PlackettLuce()
+    rng = np.random.default_rng(0)
+    n = 500
+    mu1 = rng.uniform(0, 50, n)
+    sigma1 = rng.uniform(0.1, 8.333, n)
+    mu2 = rng.uniform(0, 50, n)
+    sigma2 = rng.uniform(0.1, 8.333, n)
+    # includes equal scores (which openskill does not treat as tie for floats)
+    score1 = rng.integers(0, 3, n).astype(float)
+    score2 = rng.integers(0, 3, n).astype(float)
+
+    new_mu1, new_sigma1, new_mu2, new_sigma2 = rating.rate(
+        model, mu1, sigma1, mu2, sigma2, score1, score2
+    )
+
+    for k in range(n):
+        r1 = model.create_rating([mu1[k], sigma1[k]])
+        r2 = model.create_rating([mu2[k], sigma2[k]])
+        [[r1], [r2]] = model.rate([[r1], [r2]], scores=[score1[k], score2[k]])
+        # bit for bit the same
+        assert (new_mu1[k], new_sigma1[k]) == (r1.mu, r1.sigma)
+        assert (new_mu2[k], new_sigma2[k]) == (r2.mu, r2.sigma)
+
+
+def test_apply_games_same_as_sequential_updates():
+    model = PlackettLuce()
+    rng = np.random.default_rng(1)
+    # few users, so that most of them play several games in the batch
+    games = [
+        rating.GameOutcome(*rng.choice(10, 2, replace=False).tolist(), *scores)
+        for scores in rng.integers(0, 2, (200, 2)).astype(float).tolist()
+    ]
+    initial = {user_id: (25.0 + user_id, 8.0) for user_id in range(10)}
+
+    expected = dict(initial)
+    for game in games:
+        _rate_with_openskill(model, expected, game)
+
+    batch = rating.RatingBatch(model)
+    for game in games[:120]:
+        batch.add(game)
+    assert len(batch) == 120
+    ratings, history = batch.apply(lambda user_id: initial[user_id])
+    assert len(batch) == 0
+    # the last history entry of each user is the final rating
+    assert len(history) == 240
+    assert {entry.user_id: (entry.mu, entry.sigma) for entry in history} == ratings
+
+    # continue with the rest of the games in a second chunk
+    changed = rating.apply_games(model, games[120:], ratings)
+    assert changed == {u for game in games[120:] for u in game[:2]}
+    assert ratings == expected
+
+
+def test_rating_batch_skips_games_of_missing_users():
+    model = PlackettLuce()
+    known = {1: (25.0, 8.0), 2: (30.0, 5.0), 3: (20.0, 6.0)}
+
+    def get_rating(user_id):
+        if user_id not in known:
+            raise ValueError(f"User with ID {user_id} not found.")
+        return known[user_id]
+
+    games = [
+        rating.GameOutcome(1, 2, 1.0, 0.0, "a"),
+        rating.GameOutcome(2, 99, 1.0, 0.0, "b"),
+        rating.GameOutcome(3, 1, 0.0, 1.0, "c"),
+    ]
+    batch = rating.RatingBatch(model)
+    for game in games:
+        batch.add(game)
+    ratings, history = batch.apply(get_rating)
+
+    expected = dict(known)
+    for game in (games[0], games[2]):
+        _rate_with_openskill(model, expected, game)
+    assert ratings == expected
+    assert {entry.game_id for entry in history} == {"a", "c"}
+    assert len(batch) == 0
+
+
+def test_rating_batch_keeps_games_if_rating_fails():
+    batch = rating.RatingBatch(PlackettLuce())
+    batch.add(rating.GameOutcome(1, 2, 1.0, 0.0))
+
+    def get_rating(user_id):
+        raise RuntimeError("database is locked")
+
+    with pytest.raises(RuntimeError):
+        batch.apply(get_rating)
+    assert len(batch) == 1
@@ -0,0 +1,84 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+from openskill.models import PlackettLuce
+
+import comprl.scripts.recompute_ratings as recompute_ratings
+from comprl.server.data import GameData, RatingHistoryData, UserData
+from comprl.server.data.interfaces import GameResult, RatingHistoryEntry
+from comprl.server.data.sql_backend import create_database_tables, get_engine
+from comprl.server.util import IDGenerator
+
+
+def test_recompute_ratings(tmp_path):
+    db_path = tmp_path / "database.db"
+    create_database_tables(db_path)
+    user_data = UserData(db_path)
+    game_data = GameData(db_path)
+
+    user_ids = [
+        user_data.add(
+            user_name=f"user_{i}",
+            user_password="pw",
+            user_token=str(IDGenerator.generate_player_id()),
+        )
+        for i in range(5)
+    ]
+    # ratings are replaced, also of users without games
+    for user_id in user_ids:
+        user_data.set_matchmaking_parameters(user_id, mu=30.0, sigma=2.0)
+
+    model = PlackettLuce()
+    expected = {user_id: model.rating() for user_id in user_ids[:4]}
+    rng = np.random.default_rng(0)
+    start = datetime(2024, 1, 1)
+    games = []
+    for i in range(50):
+        user1, user2 = rng.choice(user_ids[:4], 2, replace=False).tolist()
+        score1, score2 = rng.integers(0, 2, 2).astype(float).tolist()
+        games.append(
+            GameResult(
+                game_id=IDGenerator.generate_game_id(),
+                user1_id=user1,
+                user2_id=user2,
+                score_user_1=score1,
+                score_user_2=score2,
+                start_time=start + timedelta(minutes=i),
+            )
+        )
+        [[expected[user1]], [expected[user2]]] = model.rate(
+            [[expected[user1]], [expected[user2]]], scores=[score1, score2]
+        )
+    # the games are replayed by start time, not in the order they were stored
+    for game in reversed(games):
+        game_data.add(game)
+
+    engine = get_engine(db_path)
+    history = []
+    ratings, num_games = recompute_ratings.replay_games(
+        engine, model, chunk_size=7, history=history
+    )
+    assert num_games == 50
+    assert ratings == {u: (r.mu, r.sigma) for u, r in expected.items()}
+    assert len(history) == 100
+
+    # the old history is replaced
+    history_data = RatingHistoryData(db_path)
+    history_data.add([RatingHistoryEntry("old", user_ids[4], 30.0, 2.0, start)])
+
+    # nothing is written if games have been added since the replay
+    with pytest.raises(RuntimeError):
+        recompute_ratings.write_ratings(engine, ratings, history, num_games - 1)
+    assert user_data.get_matchmaking_parameters(user_ids[0]) == (30.0, 2.0)
+
+    assert recompute_ratings.write_ratings(engine, ratings, history, num_games) == 4
+    for user_id, r in expected.items():
+        assert user_data.get_matchmaking_parameters(user_id) == (r.mu, r.sigma)
+    assert user_data.get_matchmaking_parameters(user_ids[4]) == (25.0, 8.333)
+    assert history_data.get(user_ids[4]) == []
+    last_game = games[-1]
+    entries = history_data.get(last_game.user1_id)
+    assert entries[-1].game_id == str(last_game.game_id)
+    assert entries[-1].timestamp == last_game.start_time
+    assert (entries[-1].mu, entries[-1].sigma) == ratings[last_game.user1_id]
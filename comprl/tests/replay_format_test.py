@@ -0,0 +1,73 @@
+import pickle
+
+import numpy as np
+import pytest
+
+from comprl.server.replays import Replay, convert_pickle_replay, write_replay
+
+
+def _hockey_like_game_info(num_rounds=2, steps=5):
+    rng = np.random.default_rng(0)
+    game_info = {"num_rounds": [np.array([num_rounds])]}
+    for i in range(num_rounds):
+        game_info[f"actions_round_{i}"] = [rng.uniform(-1, 1, 8) for _ in range(steps)]
+        game_info[f"observations_round_{i}"] = [
+            rng.normal(size=18) for _ in range(steps + 1)
+        ]
+    game_info["actions"] = np.array(
+        [[rng.uniform(-1, 1, 4), rng.uniform(-1, 1, 4)] for _ in range(steps)]
+    )
+    return game_info
+
+
+def test_write_and_read_replay(tmp_path):
+    game_info = _hockey_like_game_info()
+    path = tmp_path / "game.npz"
+    write_replay(path, game_info)
+
+    with Replay(path) as replay:
+        assert set(replay.keys()) == set(game_info.keys())
+        assert replay.num_rounds == 2
+        assert replay.shape("observations_round_1") == (6, 18)
+        assert replay.dtype("observations_round_1") == np.float32
+        assert replay.dtype("num_rounds").kind == "i"
+
+        round1 = replay.round(1)
+        assert set(round1.keys()) == {"actions", "observations"}
+        np.testing.assert_allclose(
+            round1["observations"], game_info["observations_round_1"], rtol=1e-6
+        )
+        assert replay["num_rounds"][0, 0] == 2
+        assert replay["actions"].shape == (5, 2, 4)
+
+        with pytest.raises(IndexError):
+            replay.round(2)
+        with pytest.raises(KeyError):
+            replay["foo"]
+
+
+def test_write_replay_skips_ragged_entries(tmp_path):
+    path = tmp_path / "game.npz"
+    write_replay(
+        path, {"ok": [1.0, 2.0], "ragged": [[1.0], [1.0, 2.0]]}, compress=False
+    )
+
+    with Replay(path) as replay:
+        assert replay.keys() == ["ok"]
+        assert replay.num_rounds == 0
+
+
+def test_convert_pickle_replay(tmp_path):
+    game_info = _hockey_like_game_info(num_rounds=4)
+    pkl_path = tmp_path / "game.pkl"
+    with open(pkl_path, "wb") as f:
+        pickle.dump(game_info, f)
+
+    output_path = convert_pickle_replay(pkl_path)
+
+    assert output_path == tmp_path / "game.npz"
+    with Replay(output_path) as replay:
+        assert replay.num_rounds == 4
+        np.testing.assert_allclose(
+            replay["actions_round_3"], game_info["actions_round_3"], rtol=1e-6
+        )
@@ -0,0 +1,79 @@
+import pickle
+import threading
+
+import pytest
+
+from comprl.server.replays import FsyncPolicy, ReplayWriter
+
+
+def test_replay_writer_writes_all_files(tmp_path):
+    writer = ReplayWriter(num_threads=2, max_queue_size=4, fsync=FsyncPolicy.FULL)
+
+    for i in range(10):
+        writer.submit(tmp_path / f"{i}.pkl", lambda f, i=i: pickle.dump({"i": i}, f))
+    writer.close()
+
+    for i in range(10):
+        with open(tmp_path / f"{i}.pkl", "rb") as f:
+            assert pickle.load(f) == {"i": i}
+    # no temporary files are left over
+    assert len(list(tmp_path.iterdir())) == 10
+
+    assert writer.stats.submitted == 10
+    assert writer.stats.written == 10
+    assert writer.stats.failed == 0
+    assert writer.queue_depth == 0
+    assert writer.stats.max_write_time <= writer.stats.total_write_time
+
+
+def test_replay_writer_failed_write(tmp_path):
+    writer = ReplayWriter()
+
+    def _fail(f):
+        raise RuntimeError("test")
+
+    writer.submit(tmp_path / "fail.pkl", _fail)
+    writer.submit(tmp_path / "ok.pkl", lambda f: f.write(b"ok"))
+    writer.flush()
+
+    assert writer.stats.failed == 1
+    assert writer.stats.written == 1
+    assert (tmp_path / "ok.pkl").read_bytes() == b"ok"
+    assert not (tmp_path / "fail.pkl").exists()
+    assert not (tmp_path / "fail.pkl.tmp").exists()
+
+    writer.close()
+    with pytest.raises(RuntimeError):
+        writer.submit(tmp_path / "late.pkl", lambda f: None)
+
+
+def test_replay_writer_backpressure(tmp_path):
+    writer = ReplayWriter(num_threads=1, max_queue_size=1)
+    started = threading.Event()
+    release = threading.Event()
+
+    def _block(f):
+        started.set()
+        release.wait()
+
+    # first job blocks the worker, second one fills the queue
+    writer.submit(tmp_path / "0", _block)
+    assert started.wait(timeout=5)
+    writer.submit(tmp_path / "1", lambda f: None)
+
+    # the third submit has to wait until the worker makes progress
+    submitter = threading.Thread(
+        target=writer.submit, args=(tmp_path / "2", lambda f: None)
+    )
+    submitter.start()
+    submitter.join(timeout=0.2)
+    assert submitter.is_alive()
+
+    release.set()
+    submitter.join(timeout=5)
+    assert not submitter.is_alive()
+    writer.close()
+
+    assert writer.stats.blocked == 1
+    assert writer.stats.max_queue_depth == 1
+    assert writer.stats.written == 3
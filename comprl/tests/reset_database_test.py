@@ -1,8 +1,14 @@
+from datetime import datetime
+
 import pytest
 
-from comprl.server.data import UserData, GameData
+from comprl.server.data import RatingHistoryData, UserData, GameData
 from comprl.server.util import IDGenerator
-from comprl.server.data.interfaces import GameEndState, GameResult
+from comprl.server.data.interfaces import (
+    GameEndState,
+    GameResult,
+    RatingHistoryEntry,
+)
 from comprl.server.data.sql_backend import create_database_tables
 import comprl.scripts.reset as reset
 
@@ -67,6 +73,12 @@ def test_reset(tmp_path):
 
     assert len(game_data.get_all()) == 3
 
+    history_data = RatingHistoryData(db_path)
+    history_data.add(
+        [RatingHistoryEntry(str(gameID3), userID1, 24.0, 9.333, datetime(2024, 1, 1))]
+    )
+    assert len(history_data.get(userID1)) == 1
+
     # reset
     reset.reset_games(game_data=game_data)
     reset.reset_elo(user_data=user_data)
@@ -78,3 +90,4 @@ def test_reset(tmp_path):
         assert pytest.approx(sigma) == 8.333, f"user_id: {user_id}"
 
     assert len(game_data.get_all()) == 0
+    assert history_data.get(userID1) == []
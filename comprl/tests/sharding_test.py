@@ -0,0 +1,243 @@
+import uuid
+
+import numpy as np
+import pytest
+from twisted.internet import defer
+
+from comprl.server.data.interfaces import GameEndState
+from comprl.server.managers import GameManager
+from comprl.server.sharding import (
+    GameEnded,
+    PlayerDisconnected,
+    RelayedPlayer,
+    RelayReady,
+    RelayStep,
+    Shard,
+    ShardMatch,
+    StartMatch,
+)
+
+
+class FakeConnection:
+    """Records the sent commands and answers them with the given responses."""
+
+    def __init__(self, index=0, responses=None):
+        self.index = index
+        self.responses = responses or {}
+        self.calls = []
+
+    def callRemote(self, command, **kwargs):
+        self.calls.append((command, kwargs))
+        response = self.responses.get(command, {})
+        if isinstance(response, defer.Deferred):
+            return response
+        if isinstance(response, Exception):
+            return defer.fail(response)
+        return defer.succeed(response)
+
+
+class FakePlayerManager:
+    def __init__(self, players):
+        self.players = {p.id: p for p in players}
+
+    def get_player_by_id(self, player_id):
+        return self.players.get(player_id)
+
+
+class FakeGame:
+    def __init__(self, players):
+        self.id = uuid.uuid4()
+        self.players = {p.id: p for p in players}
+        self.scores = {p.id: float(i) for i, p in enumerate(players)}
+        self.disconnected_player_id = None
+        self.finish_callbacks = []
+
+    def add_finish_callback(self, callback):
+        self.finish_callbacks.append(callback)
+
+    def get_result(self):
+        return object()
+
+    def _player_won(self, player_id):
+        return self.scores[player_id] > 0
+
+    def _end(self, reason="unknown"):
+        for callback in self.finish_callbacks:
+            callback(self)
+
+
+class FakeGameManager(GameManager):
+    def start_game(self, players):
+        self.game = FakeGame(players)
+        self._add_game(self.game)
+        self.game.add_finish_callback(self._remove_game)
+        return self.game
+
+
+def test_relayed_player():
+    connection = FakeConnection(
+        responses={
+            RelayReady: {"ready": True},
+            RelayStep: {"action": np.array([1.0])},
+            PlayerDisconnected: RuntimeError("gone"),
+        }
+    )
+    player = RelayedPlayer(connection, uuid.uuid4(), user_id=3)
+
+    ready = []
+    player.is_ready(ready.append)
+    actions = []
+    player.get_action([0.5, 0.5], actions.append)
+    player.notify_info("hello")
+
+    assert ready == [True]
+    np.testing.assert_array_equal(actions[0], [1.0])
+    assert [kwargs["player_id"] for _, kwargs in connection.calls] == [
+        player.id.bytes
+    ] * 3
+    assert connection.calls[2][1]["msg"] == "hello"
+    assert connection.calls[2][1]["error"] is False
+
+    # errors (e.g. the player disconnected in the meantime) are not raised
+    connection.responses[RelayStep] = RuntimeError("gone")
+    player.get_action([0.5, 0.5], actions.append)
+    assert len(actions) == 1
+
+
+def test_shard_match():
+    host, other = FakeConnection(index=0), FakeConnection(index=1)
+    player1 = RelayedPlayer(host, uuid.uuid4(), user_id=1)
+    player2 = RelayedPlayer(other, uuid.uuid4(), user_id=2)
+    match = ShardMatch([player1, player2])
+    finished = []
+    match.add_finish_callback(finished.append)
+
+    match.start()
+    [(command, kwargs)] = host.calls
+    assert command is StartMatch
+    assert kwargs["match_id"] == match.id.bytes
+    assert [(p["user_id"], p["shard"]) for p in kwargs["players"]] == [(1, 0), (2, 1)]
+    assert other.calls == []
+
+    match.force_end(player2.id)
+    assert host.calls[-1] == (PlayerDisconnected, {"player_id": player2.id.bytes})
+
+    match.finish(False, scores=[0.0, 1.0], won=[False, False], disconnected=player2.id)
+    # the result is only reported once
+    match.finish(True, scores=[], won=[], disconnected=None)
+
+    assert finished == [match]
+    result = match.get_result()
+    assert result.end_state == GameEndState.DISCONNECTED
+    assert result.disconnected_id == 2
+    assert result.score_user_2 == 1.0
+
+
+def test_shard_match_failed():
+    match = ShardMatch(
+        [
+            RelayedPlayer(FakeConnection(), uuid.uuid4(), user_id=1),
+            RelayedPlayer(FakeConnection(), uuid.uuid4(), user_id=2),
+        ]
+    )
+    match.finish(True, scores=[], won=[], disconnected=None)
+    assert match.get_result() is None
+
+
+@pytest.mark.parametrize("connected", [True, False])
+def test_shard_start_match(connected):
+    local_player = RelayedPlayer(FakeConnection(), uuid.uuid4(), user_id=1)
+    coordinator = FakeConnection()
+    game_manager = FakeGameManager(FakeGame)
+    shard = Shard(
+        FakePlayerManager([local_player] if connected else []), game_manager, index=0
+    )
+    shard.coordinator = coordinator
+    remote_id = uuid.uuid4()
+    match_id = uuid.uuid4()
+
+    shard.start_match(
+        match_id,
+        [
+            {"player_id": local_player.id.bytes, "user_id": 1, "shard": 0},
+            {"player_id": remote_id.bytes, "user_id": 2, "shard": 1},
+        ],
+    )
+
+    if not connected:
+        # the local player has disconnected before the match could be started
+        assert coordinator.calls == [
+            (
+                GameEnded,
+                {"match_id": match_id.bytes, "failed": True, "scores": [], "won": []},
+            )
+        ]
+        return
+
+    game = game_manager.game
+    assert list(game.players) == [local_player.id, remote_id]
+    remote_player = game.players[remote_id]
+    assert isinstance(remote_player, RelayedPlayer)
+    assert remote_player.connection is coordinator
+
+    for callback in game.finish_callbacks:
+        callback(game)
+    assert coordinator.calls == [
+        (
+            GameEnded,
+            {
+                "match_id": match_id.bytes,
+                "failed": False,
+                "scores": [0.0, 1.0],
+                "won": [False, True],
+            },
+        )
+    ]
+
+
+def test_shard_stop():
+    players = [RelayedPlayer(FakeConnection(), uuid.uuid4(), user_id=i) for i in (1, 2)]
+    reported: defer.Deferred = defer.Deferred()
+    coordinator = FakeConnection(responses={GameEnded: reported})
+    game_manager = FakeGameManager(FakeGame)
+    shard = Shard(FakePlayerManager(players), game_manager, index=0)
+    shard.coordinator = coordinator
+    match_id = uuid.uuid4()
+    shard.start_match(
+        match_id,
+        [{"player_id": p.id.bytes, "user_id": p.user_id, "shard": 0} for p in players],
+    )
+
+    stopped = []
+    shard.stop().addCallback(stopped.append)
+
+    # the running game is ended and reported with its current scores
+    assert game_manager.games == {}
+    assert coordinator.calls == [
+        (
+            GameEnded,
+            {
+                "match_id": match_id.bytes,
+                "failed": False,
+                "scores": [0.0, 1.0],
+                "won": [False, True],
+            },
+        )
+    ]
+    # the shard waits until the coordinator has received the result
+    assert stopped == []
+    reported.callback({})
+    assert len(stopped) == 1
+
+    # no new games are started
+    new_match_id = uuid.uuid4()
+    shard.start_match(
+        new_match_id,
+        [{"player_id": p.id.bytes, "user_id": p.user_id, "shard": 0} for p in players],
+    )
+    assert coordinator.calls[-1][1] == {
+        "match_id": new_match_id.bytes,
+        "failed": True,
+        "scores": [],
+        "won": [],
+    }
@@ -1,7 +1,15 @@
 import pytest
+import sqlalchemy as sa
 
 from comprl.server.data import UserData
-from comprl.server.data.sql_backend import create_database_tables
+from comprl.server.data.sql_backend import (
+    User,
+    create_database_tables,
+    get_engine,
+    refresh_leaderboard,
+    upgrade_database,
+)
+from comprl.server.data.write_behind import WriteBehindStore
 
 
 def test_user_data(tmp_path):
@@ -34,3 +42,131 @@ def test_user_data(tmp_path):
     # user1 was updated above
     assert pytest.approx(mu1) == 23.0
     assert pytest.approx(sigma1) == 3.0
+
+
+def test_engine_is_shared(tmp_path):
+    db_file = tmp_path / "database.db"
+    create_database_tables(db_file)
+
+    user_data1 = UserData(db_file)
+    user_data2 = UserData(str(db_file))
+    assert user_data1.engine is user_data2.engine
+
+    with user_data1.engine.connect() as conn:
+        journal_mode = conn.exec_driver_sql("PRAGMA journal_mode").scalar()
+        synchronous = conn.exec_driver_sql("PRAGMA synchronous").scalar()
+    assert journal_mode == "wal"
+    assert synchronous == 1  # NORMAL
+
+
+def test_upgrade_database(tmp_path):
+    db_file = tmp_path / "database.db"
+    create_database_tables(db_file)
+    user_id = UserData(db_file).add(
+        user_name="player", user_password="pass", user_token="token"
+    )
+
+    # simulate a database created by an old version without indexes
+    engine = get_engine(db_file)
+    with engine.begin() as conn:
+        indexes = conn.exec_driver_sql(
+            "SELECT name FROM sqlite_master WHERE type = 'index'"
+            " AND tbl_name IN ('users', 'games') AND sql IS NOT NULL"
+        ).scalars()
+        for name in indexes.all():
+            conn.exec_driver_sql(f"DROP INDEX {name}")
+
+    created = upgrade_database(db_file)
+    assert "ix_users_token" in created
+    assert "ix_users_ranking" in created
+    assert "ix_games_user1_start_time" in created
+    assert "ix_games_user2_start_time" in created
+
+    with engine.connect() as conn:
+        game_indexes = {i["name"] for i in sa.inspect(conn).get_indexes("games")}
+    assert {"ix_games_start_time", "ix_games_winner"} <= game_indexes
+
+    # data is kept and a second upgrade is a no-op
+    user = UserData(db_file).get_user_by_token("token")
+    assert user is not None
+    assert user.user_id == user_id
+    assert upgrade_database(db_file) == []
+
+
+def test_leaderboard(tmp_path):
+    db_file = tmp_path / "database.db"
+    create_database_tables(db_file)
+    user_data = UserData(db_file)
+
+    user_ids = [
+        user_data.add(user_name=f"user{i}", user_password="pw", user_token=f"t{i}")
+        for i in range(5)
+    ]
+    # new users are ranked right away (equal ratings are ordered by ID)
+    assert [user_data.get_rank(u) for u in user_ids] == [1, 2, 3, 4, 5]
+
+    for user_id, mu, sigma in [(user_ids[3], 30.0, 2.0), (user_ids[1], 20.0, 1.0)]:
+        user_data.set_matchmaking_parameters(user_id, mu, sigma)
+    store = WriteBehindStore(db_file, flush_interval=60, max_records=1000)
+    store.set_all_matchmaking_parameters({user_ids[4]: (40.0, 1.0)})
+    store.close()
+
+    expected = [user_ids[i] for i in (4, 3, 1, 0, 2)]
+    leaderboard = user_data.get_leaderboard()
+    assert [rank for rank, _ in leaderboard] == [1, 2, 3, 4, 5]
+    assert [user.user_id for _, user in leaderboard] == expected
+    assert leaderboard[0][1].username == "user4"
+    assert [u.user_id for _, u in user_data.get_leaderboard(limit=2)] == expected[:2]
+    assert [rank for rank, _ in user_data.get_leaderboard(limit=2, offset=3)] == [4, 5]
+    assert user_data.get_rank(user_ids[1]) == 3
+    assert user_data.get_rank(1000) is None
+
+    # the ranks are looked up with the indexes, not by sorting all users
+    with user_data.engine.connect() as conn:
+        plan = conn.exec_driver_sql(
+            "EXPLAIN QUERY PLAN SELECT user_id FROM users"
+            " ORDER BY mu - sigma DESC, user_id"
+        ).all()
+    assert "ix_users_ranking" in str(plan)
+    assert "TEMP B-TREE" not in str(plan)
+
+
+def test_leaderboard_with_unranked_users(tmp_path):
+    db_file = tmp_path / "database.db"
+    create_database_tables(db_file)
+    user_data = UserData(db_file)
+
+    user_ids = [
+        user_data.add(user_name=f"user{i}", user_password="pw", user_token=f"t{i}")
+        for i in range(5)
+    ]
+    user_data.set_matchmaking_parameters(user_ids[4], 30.0, 2.0)
+
+    # users inserted directly (like older web interfaces did) are ranked on read,
+    # which also moves the other users down
+    with user_data.engine.begin() as conn:
+        new_user_id = conn.execute(
+            sa.insert(User)
+            .values(username="new", password=b"pw", token="new", mu=40.0, sigma=1.0)
+            .returning(User.user_id)
+        ).scalar_one()
+    assert user_data.get_rank(new_user_id) == 1
+    assert user_data.get_rank(user_ids[4]) == 2
+    assert user_data.get_rank(user_ids[2]) == 5
+    assert [u.user_id for _, u in user_data.get_leaderboard()] == [
+        new_user_id,
+        user_ids[4],
+        *user_ids[:4],
+    ]
+
+    # only the entries whose rank changed are rewritten
+    with user_data.engine.begin() as conn:
+        sqlite_connection = conn.connection.driver_connection
+        changes = sqlite_connection.total_changes
+        # user 2 drops below user 3
+        conn.execute(sa.update(User).where(User.user_id == user_ids[2]).values(mu=24.9))
+        refresh_leaderboard(conn)
+        # the user update, two deleted and two inserted entries
+        assert sqlite_connection.total_changes - changes == 5
+    assert user_data.get_rank(user_ids[3]) == 5
+    assert user_data.get_rank(user_ids[2]) == 6
@@ -0,0 +1,97 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import sqlalchemy as sa
+
+from comprl.server.data import GameData
+from comprl.server.data.interfaces import GameEndState, GameResult
+from comprl.server.data.sql_backend import (
+    UserStats,
+    create_database_tables,
+    get_engine,
+    rebuild_user_stats,
+    upgrade_database,
+)
+from comprl.server.data.write_behind import WriteBehindStore
+from comprl.server.util import IDGenerator
+
+
+def _random_games(n):
+    rng = np.random.default_rng(0)
+    start = datetime(2024, 1, 1)
+    games = []
+    for _ in range(n):
+        user1, user2 = rng.choice(5, 2, replace=False).tolist()
+        games.append(
+            GameResult(
+                game_id=IDGenerator.generate_game_id(),
+                user1_id=user1,
+                user2_id=user2,
+                score_user_1=0,
+                score_user_2=0,
+                start_time=start + timedelta(minutes=int(rng.integers(0, 1000))),
+                end_state=GameEndState(int(rng.integers(0, 3))),
+                is_user1_winner=bool(rng.integers(0, 2)),
+                is_user1_disconnected=bool(rng.integers(0, 2)),
+            )
+        )
+    return games
+
+
+def _all_stats(db_file):
+    with sa.orm.Session(get_engine(db_file)) as session:
+        return {
+            s.user_id: (
+                s.played,
+                s.won,
+                s.lost,
+                s.drawn,
+                s.disconnected,
+                s.last_game_at,
+            )
+            for s in session.scalars(sa.select(UserStats))
+        }
+
+
+def test_user_stats_updated_with_games(tmp_path):
+    db_file = tmp_path / "database.db"
+    create_database_tables(db_file)
+    game_data = GameData(db_file)
+    games = _random_games(60)
+
+    for game in games[:10]:
+        game_data.add(game)
+    store = WriteBehindStore(db_file, flush_interval=60, max_records=20)
+    for game in games[10:]:
+        store.add_game(game)
+    store.close()
+
+    expected = {}
+    for user_id in range(5):
+        own = [g for g in games if user_id in (g.user1_id, g.user2_id)]
+        expected[user_id] = (
+            len(own),
+            sum(g.winner_id == user_id for g in own),
+            sum(g.winner_id not in (None, user_id) for g in own),
+            sum(g.end_state == GameEndState.DRAW for g in own),
+            sum(g.disconnected_id == user_id for g in own),
+            max(g.start_time for g in own),
+        )
+    assert _all_stats(db_file) == expected
+
+    stats = game_data.get_user_stats(2)
+    assert (stats.played, stats.won) == expected[2][:2]
+    assert game_data.get_user_stats(100).played == 0
+
+    # rebuilding from the games table gives the same result
+    with get_engine(db_file).begin() as conn:
+        rebuild_user_stats(conn)
+    assert _all_stats(db_file) == expected
+
+    # the statistics are filled when the table is added to an existing database
+    UserStats.__table__.drop(get_engine(db_file))
+    assert "user_stats" in upgrade_database(db_file)
+    assert _all_stats(db_file) == expected
+
+    game_data.delete_all()
+    assert _all_stats(db_file) == {}
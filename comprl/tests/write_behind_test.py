@@ -0,0 +1,193 @@
+import threading
+from datetime import datetime
+
+import sqlalchemy as sa
+
+from comprl.server.data import GameData, UserData
+from comprl.server.data.interfaces import GameResult, RatingHistoryEntry
+from comprl.server.data.sql_backend import RatingHistoryData, create_database_tables
+from comprl.server.data.write_behind import WriteBehindStore
+from comprl.server.util import IDGenerator
+
+
+def _game(user1, user2):
+    return GameResult(
+        game_id=IDGenerator.generate_game_id(),
+        user1_id=user1,
+        user2_id=user2,
+        score_user_1=1,
+        score_user_2=0,
+    )
+
+
+def test_write_behind_batches_records(tmp_path):
+    db_file = tmp_path / "database.db"
+    create_database_tables(db_file)
+    user_data = UserData(db_file)
+    user1 = user_data.add(user_name="u1", user_password="pw", user_token="t1")
+    user2 = user_data.add(user_name="u2", user_password="pw", user_token="t2")
+
+    # long interval, so that nothing is written before the explicit flush
+    store = WriteBehindStore(db_file, flush_interval=60, max_records=1000)
+    for _ in range(5):
+        store.add_game(_game(user1, user2))
+    store.set_matchmaking_parameters(user1, 26.0, 8.0)
+    store.set_matchmaking_parameters(user2, 24.0, 8.0)
+    store.set_matchmaking_parameters(user1, 27.0, 7.0)
+
+    assert store.num_pending == 7
+    assert store.pending_matchmaking_parameters(user1) == (27.0, 7.0)
+    assert len(GameData(db_file).get_all()) == 0
+
+    store.flush()
+
+    assert store.num_pending == 0
+    assert store.pending_matchmaking_parameters(user1) is None
+    assert len(GameData(db_file).get_all()) == 5
+    assert user_data.get_matchmaking_parameters(user1) == (27.0, 7.0)
+    assert user_data.get_matchmaking_parameters(user2) == (24.0, 8.0)
+    assert store.stats.flushes == 1
+    assert store.stats.last_flush_size == 7
+
+    store.close()
+
+
+def test_write_behind_flushes_when_full_and_on_close(tmp_path):
+    db_file = tmp_path / "database.db"
+    create_database_tables(db_file)
+
+    store = WriteBehindStore(db_file, flush_interval=60, max_records=3)
+    for _ in range(3):
+        store.add_game(_game(1, 2))
+    store.add_game(_game(1, 2))
+    store.close()
+
+    assert len(GameData(db_file).get_all()) == 4
+    assert store.stats.records == 4
+    assert store.stats.max_flush_size >= 1
+
+
+def test_write_behind_failed_record_does_not_drop_batch(tmp_path):
+    db_file = tmp_path / "database.db"
+    create_database_tables(db_file)
+
+    duplicate = _game(1, 2)
+    GameData(db_file).add(duplicate)
+
+    store = WriteBehindStore(db_file, flush_interval=60)
+    store.add_game(_game(1, 2))
+    store.add_game(duplicate)
+    store.add_game(_game(1, 2))
+    store.close()
+
+    assert len(GameData(db_file).get_all()) == 3
+    assert store.stats.failed_records == 1
+    assert store.stats.records == 2
+
+
+def test_write_behind_reports_ratings_while_writing(tmp_path, monkeypatch):
+    db_file = tmp_path / "database.db"
+    create_database_tables(db_file)
+    user_data = UserData(db_file)
+    user = user_data.add(user_name="u1", user_password="pw", user_token="t1")
+
+    store = WriteBehindStore(db_file, flush_interval=60, max_records=1000)
+    writing = threading.Event()
+    resume = threading.Event()
+    write = store._write
+
+    def _write(*args):
+        writing.set()
+        resume.wait(5)
+        write(*args)
+
+    monkeypatch.setattr(store, "_write", _write)
+
+    store.set_matchmaking_parameters(user, 30.0, 4.0)
+    generation = store.write_generation
+    flush = threading.Thread(target=store.flush)
+    flush.start()
+    assert writing.wait(5)
+
+    # not committed yet: the database still has the old rating, but the update is
+    # reported as pending
+    assert user_data.get_matchmaking_parameters(user) != (30.0, 4.0)
+    assert store.pending_matchmaking_parameters(user) == (30.0, 4.0)
+    assert store.write_generation == generation
+
+    resume.set()
+    flush.join()
+    assert store.pending_matchmaking_parameters(user) is None
+    assert store.write_generation == generation + 1
+    assert user_data.get_matchmaking_parameters(user) == (30.0, 4.0)
+
+    store.close()
+
+
+def test_write_behind_writes_games_with_their_rating_updates(tmp_path):
+    db_file = tmp_path / "database.db"
+    create_database_tables(db_file)
+    user_data = UserData(db_file)
+    user1 = user_data.add(user_name="u1", user_password="pw", user_token="t1")
+    user2 = user_data.add(user_name="u2", user_password="pw", user_token="t2")
+
+    store = WriteBehindStore(db_file, flush_interval=60, max_records=1000)
+    game = _game(user1, user2)
+    history = [
+        RatingHistoryEntry(str(game.game_id), user1, 27.0, 7.0, datetime.now()),
+        RatingHistoryEntry(str(game.game_id), user2, 23.0, 7.0, datetime.now()),
+    ]
+    store.set_all_matchmaking_parameters(
+        {user1: (27.0, 7.0), user2: (23.0, 7.0)}, history, [game]
+    )
+    assert store.num_pending == 5
+    store.flush()
+
+    # everything is written in one transaction
+    assert store.stats.flushes == 1
+    assert store.stats.last_flush_size == 5
+    assert [g.game_id for g in GameData(db_file).get_all()] == [str(game.game_id)]
+    assert RatingHistoryData(db_file).get(user2) == [history[1]]
+    store.close()
+
+
+def test_write_behind_requeues_failed_rating_updates(tmp_path, monkeypatch):
+    db_file = tmp_path / "database.db"
+    create_database_tables(db_file)
+    user_data = UserData(db_file)
+    user1 = user_data.add(user_name="u1", user_password="pw", user_token="t1")
+    user2 = user_data.add(user_name="u2", user_password="pw", user_token="t2")
+
+    store = WriteBehindStore(db_file, flush_interval=60, max_records=1000)
+    update_ratings = store._update_ratings
+    failures = []
+
+    def _update_ratings(session, ratings):
+        if len(failures) < 2:
+            # fails in the batch and when retried separately
+            failures.append(ratings)
+            raise sa.exc.OperationalError("UPDATE", {}, Exception("locked"))
+        update_ratings(session, ratings)
+
+    monkeypatch.setattr(store, "_update_ratings", _update_ratings)
+
+    history = [RatingHistoryEntry(None, user1, 27.0, 7.0, datetime.now())]
+    store.set_all_matchmaking_parameters(
+        {user1: (27.0, 7.0), user2: (23.0, 7.0)}, history
+    )
+    store.flush()
+
+    # the history is written, the rating updates are kept for the next flush
+    assert RatingHistoryData(db_file).get(user1) == history
+    assert user_data.get_matchmaking_parameters(user1) == (25.0, 8.333)
+    assert store.pending_matchmaking_parameters(user1) == (27.0, 7.0)
+    assert store.stats.records == 1
+    assert store.stats.failed_records == 0
+
+    # newer updates are not overwritten by the retried ones
+    store.set_matchmaking_parameters(user1, 28.0, 6.0)
+    store.flush()
+    assert user_data.get_matchmaking_parameters(user1) == (28.0, 6.0)
+    assert user_data.get_matchmaking_parameters(user2) == (23.0, 7.0)
+    assert store.stats.records == 3
+    store.close()